@@ -0,0 +1,146 @@
+"""
+Import time benchmark of `anysd`.
+
+Imports anysd in fresh interpreters and reports the wall time of `import anysd`, the heaviest modules it pulls in
+(from `python -X importtime`), and the one off cost of the first use of the settings (reading the config file and
+building the redis client), which happens on the first request rather than on import.
+
+    python benchmarks/bench_import.py
+    python benchmarks/bench_import.py --runs 50 --output before.json
+    python benchmarks/bench_import.py --output after.json --compare before.json
+
+Run it from the repository root, against the working tree or an installed version.
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+from datetime import datetime, timezone
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+SRC = os.path.join(os.path.dirname(HERE), 'src')
+
+# run in a fresh interpreter per measurement: only the first import of a module costs anything
+IMPORT = '''
+import sys, time
+t = time.perf_counter()
+import anysd
+print(time.perf_counter() - t)
+print(','.join(sorted(name for name in ('redis', 'cfg_load', 'asyncio', 'yaml') if name in sys.modules)))
+'''
+
+FIRST_USE = '''
+import time
+import anysd.conf
+t = time.perf_counter()
+# versions without `settings` did all of this on import
+settings = getattr(anysd.conf, 'settings', None)
+if settings is not None:
+    settings.config, settings.back_symbol, settings.redis
+print(time.perf_counter() - t)
+'''
+
+
+def _run(code, *flags):
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [SRC, os.environ.get('PYTHONPATH')])))
+    env.setdefault('ANYSD_CONFIG_FILE', os.path.join(HERE, 'config.yaml'))
+    out = subprocess.run([sys.executable, *flags, '-c', code], env=env, capture_output=True, text=True, check=True)
+    return out.stdout, out.stderr
+
+
+def _percentile(values, pct):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(pct / 100 * (len(values) - 1))))]
+
+
+def _import_times(code):
+    _, stderr = _run(code, '-X', 'importtime')
+    for line in stderr.splitlines():
+        if line.startswith('import time:') and 'cumulative' not in line:
+            _, cumulative, name = line[len('import time:'):].split('|')
+            yield name.strip(), int(cumulative) / 1000
+
+
+def heaviest_modules(top):
+    """the `top` modules importing anysd costs the most, by cumulative import time in ms"""
+    # the interpreter imports these on its own
+    startup = {name for name, _ in _import_times('pass')}
+    modules = [(name, ms) for name, ms in _import_times('import anysd') if name not in startup and name != 'anysd']
+    return sorted(modules, key=lambda module: -module[1])[:top]
+
+
+def run(runs):
+    # once, so bytecode caches are written before measuring
+    _run(IMPORT)
+
+    import_ms, imported = [], ''
+    for _ in range(runs):
+        stdout, _ = _run(IMPORT)
+        seconds, imported = stdout.splitlines()
+        import_ms.append(float(seconds) * 1000)
+    first_use_ms = [float(_run(FIRST_USE)[0]) * 1000 for _ in range(runs)]
+
+    return {
+        'runs': runs,
+        'import_ms': {
+            'min': round(min(import_ms), 2),
+            'p50': round(statistics.median(import_ms), 2),
+            'p90': round(_percentile(import_ms, 90), 2),
+        },
+        'first_use_ms': {
+            'min': round(min(first_use_ms), 2),
+            'p50': round(statistics.median(first_use_ms), 2),
+        },
+        'imported_on_import': imported.split(',') if imported else [],
+    }
+
+
+def compare(result, baseline_file):
+    with open(baseline_file) as f:
+        before = json.load(f)['result']
+    change = (result['import_ms']['p50'] / before['import_ms']['p50'] - 1) * 100
+    print(f"\ncompared to {baseline_file}:\n  import p50 {before['import_ms']['p50']:.1f}ms -> "
+          f"{result['import_ms']['p50']:.1f}ms ({change:+.1f}%)")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--runs', type=int, default=20, help='fresh interpreters per measurement')
+    parser.add_argument('--top', type=int, default=10, help='heaviest modules to list')
+    parser.add_argument('--output', help='write the results to this json file')
+    parser.add_argument('--compare', help='json file of an earlier run to compare against')
+    args = parser.parse_args(argv)
+
+    result = run(args.runs)
+    result['heaviest_modules'] = heaviest_modules(args.top)
+
+    timing = result['import_ms']
+    print(f"import anysd   min {timing['min']:.1f}ms   p50 {timing['p50']:.1f}ms   p90 {timing['p90']:.1f}ms")
+    print(f"first use      p50 {result['first_use_ms']['p50']:.1f}ms (config file and redis client)")
+    print(f"imported on import: {', '.join(result['imported_on_import']) or 'none of redis, cfg_load, asyncio, yaml'}")
+    print('heaviest imports:')
+    for name, ms in result['heaviest_modules']:
+        print(f'  {name:<32}{ms:>8.1f}ms')
+
+    report = {
+        'meta': {
+            'date': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'args': vars(args),
+        },
+        'result': result,
+    }
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    if args.compare:
+        compare(result, args.compare)
+    return report
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,349 @@
+"""
+End to end benchmark of `NavigationController.navigate()`.
+
+Builds synthetic menus, replays generated ussd sessions through `navigate()` one hop at a time, and reports hops per
+second, latency percentiles, session store round trips per hop and allocations per hop, for each menu and store.
+
+    python benchmarks/bench_navigate.py                          # every scenario, in-memory store
+    python benchmarks/bench_navigate.py --backend memory redis   # also against the redis in benchmarks/config.yaml
+    python benchmarks/bench_navigate.py --output before.json
+    python benchmarks/bench_navigate.py --output after.json --compare before.json
+
+Run it from the repository root, against the working tree (`pip install -e .`) or an installed version.
+"""
+import argparse
+import gc
+import json
+import logging
+import os
+import platform
+import random
+import statistics
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timezone
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+# anysd reads its configuration on first use
+os.environ.setdefault('ANYSD_CONFIG_FILE', os.path.join(HERE, 'config.yaml'))
+sys.path.insert(0, os.path.join(os.path.dirname(HERE), 'src'))
+
+import redis  # noqa: E402
+
+import anysd  # noqa: E402
+from anysd import (NavigationController, NavigationMenu, FormFlow, ListInput, SessionStore, RedisSessionStore,  # noqa
+                   MemorySessionStore, compile_menu, set_session_store, get_redis)
+
+LANGUAGES = ('en', 'sw')
+
+
+def accept_all(current_step, last_input, **kwargs):
+    return True, None
+
+
+def noop_post_call(msisdn, session_id, ussd_string, data):
+    return None
+
+
+def product_items(msisdn=None, session_id=None, lang=None, **kwargs):
+    return [{'name': f'Product {n} @{n * 10}', 'code': n} for n in range(1, 31)]
+
+
+def _text(text, translated):
+    return {lang: f'{text} ({lang})' for lang in LANGUAGES} if translated else text
+
+
+def _form(questions=3, translated=False, lists=False):
+    form_questions = {}
+    for step in range(1, questions):
+        if lists and step % 2:
+            menu = ListInput(items=product_items, title=_text('Select product', translated), key='name')
+        else:
+            menu = _text(f'Enter value {step}', translated)
+        form_questions[str(step)] = {'name': f'FIELD_{step}', 'menu': menu}
+    form_questions[str(questions - 1)]['post_call'] = noop_post_call
+    form_questions[str(questions)] = {'name': 'DONE', 'menu': _text('END Thank you {FIELD_1}', translated)}
+    return FormFlow(form_questions=form_questions, step_validator=accept_all)
+
+
+def _menu(name, title, parent=None, form=None):
+    return NavigationMenu(name=name, title=title, parent=parent, next_form=form)
+
+
+def wide_tree(translated=False, lists=False, questions=3, width=9, depth=2):
+    home = _menu('home', _text('Main Menu', translated))
+    level = [home]
+    for d in range(depth):
+        next_level = []
+        for parent in level:
+            for n in range(width):
+                leaf = d == depth - 1
+                form = _form(questions, translated, lists) if leaf else None
+                next_level.append(_menu(f'{parent.name}_{n}', _text(f'Option {n + 1}', translated), parent, form))
+        level = next_level
+    return home
+
+
+def deep_tree(depth=15, width=3):
+    home = _menu('home', 'Main Menu')
+    parent = home
+    for d in range(depth):
+        for n in range(width):
+            last = d == depth - 1 or n > 0
+            node = _menu(f'level{d}_{n}', f'Level {d} option {n + 1}', parent, _form() if last else None)
+            if n == 0 and not last:
+                following = node
+        parent = following
+    return home
+
+
+SCENARIOS = {
+    'wide': dict(build=lambda: wide_tree(), translated=False),
+    'deep': dict(build=lambda: deep_tree(), translated=False),
+    'forms': dict(build=lambda: wide_tree(questions=12, width=3, depth=1), translated=False),
+    'translated': dict(build=lambda: wide_tree(translated=True), translated=True),
+    'lists': dict(build=lambda: wide_tree(lists=True, questions=6, width=4), translated=False),
+}
+
+
+def generate_session(home, rng, back_rate=0.1):
+    """inputs of one session: the dial, menu choices down to a form (with some back presses), then form answers"""
+    inputs = ['']
+    node, trail = home, []
+    while node.children:
+        if trail and rng.random() < back_rate:
+            inputs.append(anysd.back_symbol)
+            node = trail.pop()
+            continue
+        choice = rng.randrange(len(node.children))
+        inputs.append(str(choice + 1))
+        trail.append(node)
+        node = node.children[choice]
+
+    questions = node.next_form.form_questions
+    for step in range(1, len(questions)):
+        menu = questions[str(step)]['menu']
+        # free text answers are numeric, like amounts and phone numbers
+        inputs.append(str(rng.randint(1, 9)) if isinstance(menu, ListInput) else str(rng.randint(10, 5000)))
+    return inputs
+
+
+class CountingStore(SessionStore):
+    """passes every call to `store`, counting the ones that reach it (a round trip, for redis)"""
+
+    def __init__(self, store: SessionStore):
+        self.store = store
+        self.round_trips = 0
+
+    def _count(self, *args):
+        if any(args):
+            self.round_trips += 1
+
+    def get_all(self, key):
+        self._count(True)
+        return self.store.get_all(key)
+
+    def get_many(self, key, fields):
+        fields = list(fields)
+        self._count(fields)
+        return self.store.get_many(key, fields)
+
+    def set_many(self, key, mapping):
+        self._count(mapping)
+        return self.store.set_many(key, mapping)
+
+    def delete_many(self, key, fields):
+        fields = list(fields)
+        self._count(fields)
+        return self.store.delete_many(key, fields)
+
+    def update(self, key, changed=None, deleted=None, ttl=None):
+        self._count(changed, deleted, ttl)
+        return self.store.update(key, changed, deleted, ttl)
+
+    def expire(self, key, ttl):
+        self._count(True)
+        return self.store.expire(key, ttl)
+
+    def delete(self, key):
+        self._count(True)
+        return self.store.delete(key)
+
+    def get_all_many(self, keys):
+        self._count(True)
+        return self.store.get_all_many(keys)
+
+    def update_many(self, updates):
+        self._count(*(any(update.values()) for update in updates.values()))
+        return self.store.update_many(updates)
+
+
+def make_store(backend):
+    if backend == 'memory':
+        return MemorySessionStore(max_sessions=None)
+    conn = get_redis()
+    try:
+        conn.ping()
+    except redis.RedisError as e:
+        raise RuntimeError(f'redis is not reachable ({e})')
+    return RedisSessionStore(conn)
+
+
+def redis_commands(backend):
+    if backend != 'redis':
+        return None
+    return sum(stats['calls'] for stats in get_redis().info('commandstats').values())
+
+
+def replay(home, sessions, store, translated, run_id):
+    """navigate every hop of every session. returns the latency of each hop, in seconds"""
+    get_language = (lambda **kwargs: 'sw') if translated else None
+    latencies = []
+    for n, inputs in enumerate(sessions):
+        msisdn, session_id = f'bench-{run_id}-{n}', 'session'
+        for hop in range(len(inputs)):
+            ussd_string = '*'.join(inputs[1:hop + 1])
+            start = time.perf_counter()
+            NavigationController(home, msisdn, session_id, ussd_string, translated, get_language, store=store).navigate()
+            latencies.append(time.perf_counter() - start)
+    return latencies
+
+
+def percentile(sorted_values, q):
+    index = min(len(sorted_values) - 1, max(0, round(q / 100 * len(sorted_values) + 0.5) - 1))
+    return sorted_values[index]
+
+
+def run_scenario(name, backend, sessions_count, compiled, seed):
+    scenario = SCENARIOS[name]
+    tree = scenario['build']()
+    home = compile_menu(tree) if compiled else tree
+    rng = random.Random(seed)
+    sessions = [generate_session(tree, rng) for _ in range(sessions_count)]
+    hops = sum(len(inputs) for inputs in sessions)
+
+    store = CountingStore(make_store(backend))
+    # module level helpers (get_var, set_var...) use the default store outside a hop
+    set_session_store(store)
+    run_id = f'{name}-{int(time.time() * 1000)}'
+
+    # warm up caches (rendered menus, imports) on a separate set of session ids
+    replay(home, sessions[:max(1, len(sessions) // 10)], store, scenario['translated'], f'{run_id}-warmup')
+
+    store.round_trips = 0
+    commands_before = redis_commands(backend)
+    gc.collect()
+    started = time.perf_counter()
+    latencies = replay(home, sessions, store, scenario['translated'], run_id)
+    elapsed = time.perf_counter() - started
+    commands = redis_commands(backend) - commands_before if commands_before is not None else None
+    round_trips = store.round_trips
+
+    # allocations are measured on a separate, shorter pass: tracing slows everything down
+    traced = sessions[:max(1, len(sessions) // 10)]
+    traced_hops = sum(len(inputs) for inputs in traced)
+    gc.collect()
+    tracemalloc.start()
+    blocks_before = sys.getallocatedblocks()
+    tracemalloc.reset_peak()
+    replay(home, traced, store, scenario['translated'], f'{run_id}-traced')
+    _, peak = tracemalloc.get_traced_memory()
+    blocks_after = sys.getallocatedblocks()
+    tracemalloc.stop()
+
+    latencies.sort()
+    ms = 1000
+    return {
+        'scenario': name,
+        'backend': backend,
+        'compiled': compiled,
+        'sessions': len(sessions),
+        'hops': hops,
+        'ops_per_sec': round(hops / elapsed, 1),
+        'latency_ms': {
+            'mean': round(statistics.fmean(latencies) * ms, 4),
+            'p50': round(percentile(latencies, 50) * ms, 4),
+            'p95': round(percentile(latencies, 95) * ms, 4),
+            'p99': round(percentile(latencies, 99) * ms, 4),
+            'max': round(latencies[-1] * ms, 4),
+        },
+        'round_trips_per_hop': round(round_trips / hops, 3),
+        'redis_commands_per_hop': round(commands / hops, 3) if commands is not None else None,
+        'alloc_peak_kib': round(peak / 1024, 1),
+        'alloc_net_blocks_per_hop': round((blocks_after - blocks_before) / traced_hops, 1),
+    }
+
+
+def compare(results, baseline_file):
+    with open(baseline_file) as f:
+        baseline = {(r['scenario'], r['backend'], r['compiled']): r for r in json.load(f)['results']}
+    print(f'\ncompared to {baseline_file}:')
+    for result in results:
+        before = baseline.get((result['scenario'], result['backend'], result['compiled']))
+        if before is None:
+            continue
+        ops = (result['ops_per_sec'] / before['ops_per_sec'] - 1) * 100
+        p99 = (result['latency_ms']['p99'] / before['latency_ms']['p99'] - 1) * 100
+        print(f"  {result['scenario']:<11}{result['backend']:<8} ops/sec {ops:+6.1f}%   p99 {p99:+6.1f}%   "
+              f"round trips/hop {before['round_trips_per_hop']} -> {result['round_trips_per_hop']}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--scenario', nargs='+', choices=sorted(SCENARIOS), default=sorted(SCENARIOS))
+    parser.add_argument('--backend', nargs='+', choices=['memory', 'redis'], default=['memory'])
+    parser.add_argument('--sessions', type=int, default=500, help='sessions replayed per scenario')
+    parser.add_argument('--compiled', action='store_true', help='navigate a compiled menu instead of the tree')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', help='write the results to this json file')
+    parser.add_argument('--compare', help='json file of an earlier run to compare against')
+    args = parser.parse_args(argv)
+
+    # keep debug logging of every hop out of the measurements
+    logging.disable(logging.INFO)
+
+    results, skipped = [], []
+    for backend in args.backend:
+        for name in args.scenario:
+            try:
+                result = run_scenario(name, backend, args.sessions, args.compiled, args.seed)
+            except RuntimeError as e:
+                skipped.append({'scenario': name, 'backend': backend, 'reason': str(e)})
+                print(f'{name:<11}{backend:<8} skipped: {e}')
+                continue
+            results.append(result)
+            latency = result['latency_ms']
+            print(f"{name:<11}{backend:<8}{result['ops_per_sec']:>10.0f} hops/s   p50 {latency['p50']:.3f}ms   "
+                  f"p95 {latency['p95']:.3f}ms   p99 {latency['p99']:.3f}ms   "
+                  f"{result['round_trips_per_hop']} round trips/hop   {result['alloc_peak_kib']}KiB peak")
+
+    report = {
+        'meta': {
+            'date': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'anysd': _anysd_version(),
+            'args': vars(args),
+        },
+        'results': results,
+        'skipped': skipped,
+    }
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    if args.compare:
+        compare(results, args.compare)
+    return report
+
+
+def _anysd_version():
+    try:
+        from importlib.metadata import version
+        return version('anysd')
+    except Exception:
+        return None
+
+
+if __name__ == '__main__':
+    main()
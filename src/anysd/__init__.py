@@ -1 +1,17 @@
+__version__ = '1.2.1'
+
 from . main import *
+from . aio import AsyncNavigationController, AsyncRedisSessionStore, anavigate_many
+from . loader import build_menu, load_menu, import_string, ParseError
+
+
+def __getattr__(name):
+    # the simulator pulls in asyncio and urllib, so it is only imported when asked for
+    if name in ('Simulator', 'SimulationReport'):
+        from . import simulator
+
+        return getattr(simulator, name)
+    # settings that used to be read on import and re-exported here (`anysd.r`, `anysd.back_symbol`, ...)
+    from . import conf
+
+    return getattr(conf, name)
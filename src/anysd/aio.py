@@ -0,0 +1,255 @@
+import inspect
+from typing import Callable, List, Union
+
+from .conf import ImproperlyConfigured, get_async_redis
+from .main import NavigationController, SessionUnitOfWork, NavigationMenu, ConditionalFlow, CompiledMenu, ReloadableMenu, \
+    NavigationRequest, NavigationResult, _BatchRound
+from .instrumentation import HopMetrics, Instrumentation
+from .store import SessionStore, RedisSessionStore
+
+
+async def _adrive(gen, metrics: HopMetrics = None):
+    """
+    run a `_*_gen` generator to completion, awaiting every callable it yields that returns an awaitable. user
+    callbacks are timed into `metrics`, if given
+    """
+    try:
+        call = next(gen)
+        while True:
+            try:
+                if metrics is None or call.kind is None:
+                    result = call.fxn(*call.args, **call.kwargs)
+                    if inspect.isawaitable(result):
+                        result = await result
+                else:
+                    result = await metrics.acall(call)
+            except Exception as x:
+                call = gen.throw(x)
+            else:
+                call = gen.send(result)
+    except StopIteration as stop:
+        return stop.value
+
+
+async def _maybe_await(result):
+    if inspect.isawaitable(result):
+        return await result
+    return result
+
+
+class AsyncRedisSessionStore(RedisSessionStore):
+    """`RedisSessionStore` over a `redis.asyncio` client. Every method is a coroutine"""
+
+    def __init__(self, conn=None):
+        super().__init__(get_async_redis() if conn is None else conn)
+
+    async def get_all(self, key):
+        return await self.conn.hgetall(key) or {}
+
+    async def get_many(self, key, fields):
+        fields = list(fields)
+        if not fields:
+            return {}
+        return dict(zip(fields, await self.conn.hmget(key, fields)))
+
+    async def set_many(self, key, mapping):
+        if mapping:
+            return await self.conn.hset(key, mapping=mapping)
+
+    async def delete_many(self, key, fields):
+        fields = list(fields)
+        if fields:
+            return await self.conn.hdel(key, *fields)
+
+    async def update(self, key, changed=None, deleted=None, ttl=None):
+        if not (changed or deleted or ttl):
+            return
+        async with self.conn.pipeline(transaction=True) as pipe:
+            self._queue_update(pipe, key, changed, deleted, ttl)
+            await pipe.execute()
+
+    async def expire(self, key, ttl):
+        return await self.conn.expire(key, ttl)
+
+    async def delete(self, key):
+        return await self.conn.delete(key)
+
+    async def get_all_many(self, keys):
+        async with self.conn.pipeline(transaction=False) as pipe:
+            for key in keys:
+                pipe.hgetall(key)
+            return [data or {} for data in await pipe.execute()]
+
+    async def update_many(self, updates):
+        updates = {key: update for key, update in updates.items() if any(update.values())}
+        if not updates:
+            return
+        async with self.conn.pipeline(transaction=True) as pipe:
+            for key, update in updates.items():
+                self._queue_update(pipe, key, **update)
+            await pipe.execute()
+
+
+class AsyncSessionUnitOfWork(SessionUnitOfWork):
+    """
+    `SessionUnitOfWork` for asyncio. Works with stores whose methods are coroutines (`AsyncRedisSessionStore`) and
+    with plain ones (`MemorySessionStore`). `aload()` must be awaited before the session is used
+    """
+
+    def load(self):
+        raise ImproperlyConfigured(f'{self.__class__.__name__} should be loaded with `await aload()`')
+
+    async def aload(self):
+        self._loaded_with(await _maybe_await(self.store.get_all(self.redis_key)))
+        return self
+
+    @staticmethod
+    def load_all(units):
+        raise ImproperlyConfigured('AsyncSessionUnitOfWork should be loaded with `await aload_all()`')
+
+    @staticmethod
+    async def aload_all(units):
+        data = await _maybe_await(units[0].store.get_all_many([unit.redis_key for unit in units]))
+        for unit, _data in zip(units, data):
+            unit._loaded_with(_data)
+
+    def flush(self):
+        raise ImproperlyConfigured(f'{self.__class__.__name__} should be flushed with `await aflush()`')
+
+    async def aflush(self, ttl: int = None):
+        if not (self.dirty or ttl):
+            return
+        await _maybe_await(self.store.update(self.redis_key, **self._pending_update(ttl)))
+        self._clear_writes()
+
+    @staticmethod
+    def flush_all(units, ttl: int = None):
+        raise ImproperlyConfigured('AsyncSessionUnitOfWork should be flushed with `await aflush_all()`')
+
+    @staticmethod
+    async def aflush_all(units, ttl: int = None):
+        await _maybe_await(units[0].store.update_many({unit.redis_key: unit._pending_update(ttl) for unit in units}))
+        for unit in units:
+            unit._clear_writes()
+
+
+class AsyncNavigationController(NavigationController):
+    def __init__(
+            self,
+            home_menu: Union[NavigationMenu, ConditionalFlow, CompiledMenu, ReloadableMenu],
+            msisdn,
+            session_id,
+            ussd_string,
+            enable_translation,
+            get_translation_fxn,
+            logger=None,
+            store: SessionStore = None,
+            instrumentation: Union[Instrumentation, Callable] = None
+    ):
+        """
+        `NavigationController` for asyncio applications, backed by `redis.asyncio`.
+
+        Step validators, `ListInput` item callables, callable menus, `post_call` hooks, `ConditionalFlow` condition
+        functions and the translation function may be coroutine functions; they are awaited. Plain callables are
+        called as usual.
+
+        :param store: [Optional] session store. defaults to an `AsyncRedisSessionStore` on the shared async pool
+        :param instrumentation: [Optional] see `NavigationController`
+        """
+        super().__init__(home_menu, msisdn, session_id, ussd_string, enable_translation, get_translation_fxn,
+                         logger=logger, instrumentation=instrumentation)
+        self.r = get_async_redis()
+        store = self._metered(AsyncRedisSessionStore(self.r) if store is None else store)
+        self.session = AsyncSessionUnitOfWork(self.redis_key, store)
+        self.globals = AsyncSessionUnitOfWork(self.redis_global_key, store)
+
+    async def navigate(self, offset=None):
+        metrics = self.metrics
+        if metrics is not None:
+            metrics.mark('load')
+        units = (self.session, self.globals)
+        try:
+            await AsyncSessionUnitOfWork.aload_all(units)
+            resp = await self._aresolve(offset)
+            await AsyncSessionUnitOfWork.aflush_all(units, ttl=self.get_session_ttl(resp))
+        except Exception as e:
+            if metrics is not None:
+                self._report(error=e)
+            raise
+        if metrics is not None:
+            self._report(resp)
+        return resp
+
+    async def _aresolve(self, offset=None):
+        token = AsyncSessionUnitOfWork.activate_all((self.session, self.globals))
+        try:
+            resp = await _adrive(self._navigate_gen(offset), self.metrics)
+        finally:
+            AsyncSessionUnitOfWork.deactivate(token)
+        if self.metrics is not None:
+            self.metrics.mark('flush')
+        return resp
+
+    async def get_processed_path(self):
+        if not self.session.loaded:
+            await self.session.aload()
+        return super().get_processed_path()
+
+    async def _redis_processing(self, state: dict):
+        super()._redis_processing(state)
+
+    async def format_response(self, resp):
+        if not (self.session.loaded and self.globals.loaded):
+            await AsyncSessionUnitOfWork.aload_all((self.session, self.globals))
+        return super().format_response(resp)
+
+
+async def anavigate_many(
+        home_menu: Union[NavigationMenu, ConditionalFlow, CompiledMenu, ReloadableMenu],
+        requests,
+        enable_translation=False,
+        get_translation_fxn=None,
+        logger=None,
+        store: SessionStore = None,
+        instrumentation: Union[Instrumentation, Callable] = None,
+        offset=None
+) -> List[NavigationResult]:
+    """
+    `navigate_many()` with `AsyncNavigationController`s: one pipeline to fetch every session of the batch, one to write
+    them back. The hops are resolved one after the other
+
+    :param store: [Optional] session store. defaults to an `AsyncRedisSessionStore` on the shared async pool
+    """
+    store = AsyncRedisSessionStore() if store is None else store
+    requests = [NavigationRequest(*request) for request in requests]
+    results = [None] * len(requests)
+
+    def controller(msisdn, session_id, ussd_string):
+        return AsyncNavigationController(home_menu, msisdn, session_id, ussd_string, enable_translation,
+                                         get_translation_fxn, logger=logger, store=store,
+                                         instrumentation=instrumentation)
+
+    for indexes in _BatchRound.rounds(requests):
+        batch = _BatchRound(requests, indexes, results, controller)
+        if not batch.hops:
+            continue
+        try:
+            batch.loaded(await _maybe_await(store.get_all_many(batch.start())))
+        except Exception as e:
+            batch.failed(e)
+            continue
+
+        for index, nav in batch.hops:
+            try:
+                batch.hop_done(index, nav, await nav._aresolve(offset))
+            except Exception as e:
+                batch.hop_failed(index, nav, e)
+
+        try:
+            if batch.resolved:
+                await _maybe_await(store.update_many(batch.updates()))
+        except Exception as e:
+            batch.failed(e)
+            continue
+        batch.flushed()
+    return results
@@ -0,0 +1,183 @@
+import base64
+import json
+import zlib
+from typing import Optional
+
+from .conf import ImproperlyConfigured, settings
+
+# JSON text never starts with `~`, so values carrying this header are told apart from plain JSON written by older
+# versions (and by `JsonCodec` below its compression threshold)
+HEADER = '~'
+
+
+class StateCodec:
+    """
+    Turns structured session values (lists, dicts, global variables) into the strings kept in session hash fields, and
+    back. Scalars the navigation stores (inputs, steps, responses) are kept as they are and never go through a codec.
+
+    Encoded values are one of:
+
+    - plain JSON text, as written by every version before codecs existed
+    - `~{format}{z}:{base64 payload}`, where format is `j` (JSON) or `m` (msgpack) and `z` marks a zlib compressed
+      payload. Session hashes hold text, so binary payloads are base64 encoded
+
+    Every codec decodes every format, so changing codecs never breaks sessions already in flight.
+
+    Subclass and implement `serialize` and `deserialize` to add a format, then pass an instance to `set_state_codec()`.
+    """
+    format: str = None
+
+    def __init__(self, compress_threshold: Optional[int] = None, compress_level: int = 6):
+        """
+        :param compress_threshold: [Optional] values whose serialized size reaches this many bytes are zlib
+                                   compressed, if that makes them smaller. None never compresses
+        :param compress_level: [Optional] zlib compression level, 1 (fastest) to 9 (smallest)
+        """
+        if compress_threshold is not None and compress_threshold < 0:
+            raise ImproperlyConfigured('compress_threshold should be a positive number or None')
+        self.compress_threshold = compress_threshold
+        self.compress_level = compress_level
+
+    def serialize(self, value) -> bytes:
+        raise NotImplementedError
+
+    def deserialize(self, data: bytes):
+        raise NotImplementedError
+
+    def encode(self, value) -> str:
+        return self._pack(self.serialize(value))
+
+    def _pack(self, data: bytes, plain: str = None) -> str:
+        # `plain`: what to write when the value is not compressed, instead of the base64 armoured payload
+        if self.compress_threshold is not None and len(data) >= self.compress_threshold:
+            compressed = zlib.compress(data, self.compress_level)
+            if len(compressed) < len(data):
+                return f'{HEADER}{self.format}z:{base64.b64encode(compressed).decode("ascii")}'
+        if plain is not None:
+            return plain
+        return f'{HEADER}{self.format}:{base64.b64encode(data).decode("ascii")}'
+
+    @staticmethod
+    def decode(text):
+        """the value `text` was encoded from, whichever codec encoded it"""
+        if isinstance(text, bytes):
+            text = text.decode('utf-8')
+        if not text.startswith(HEADER):
+            return json.loads(text)
+
+        header, _, payload = text.partition(':')
+        codec = _formats.get(header[1:2])
+        if codec is None or header[2:] not in ('', 'z'):
+            raise ValueError(f'unknown session value format {header!r}')
+        data = base64.b64decode(payload)
+        if header[2:] == 'z':
+            try:
+                data = zlib.decompress(data)
+            except zlib.error as x:
+                raise ValueError(f'corrupt session value: {x}')
+        return codec.deserialize(data)
+
+
+class JsonCodec(StateCodec):
+    """
+    Compact JSON. Values below the compression threshold are written as plain JSON text, readable by older versions
+    """
+    format = 'j'
+
+    def serialize(self, value) -> bytes:
+        return self.dumps(value).encode('utf-8')
+
+    def deserialize(self, data: bytes):
+        return json.loads(data)
+
+    @staticmethod
+    def dumps(value) -> str:
+        return json.dumps(value, separators=(',', ':'), ensure_ascii=False)
+
+    def encode(self, value) -> str:
+        text = self.dumps(value)
+        # len() counts characters, not bytes: close enough to skip encoding values that are too small to compress
+        if self.compress_threshold is None or len(text) < self.compress_threshold:
+            return text
+        return self._pack(text.encode('utf-8'), plain=text)
+
+
+class MsgpackCodec(StateCodec):
+    """
+    msgpack (`pip install msgpack`). Tuples come back as lists, like with JSON. Smaller than JSON for number heavy and
+    nested values, but the base64 armour costs a third of the payload, so small values are better left to `JsonCodec`
+    """
+    format = 'm'
+
+    def __init__(self, compress_threshold: Optional[int] = None, compress_level: int = 6):
+        try:
+            import msgpack
+        except ImportError:
+            raise ImproperlyConfigured('MsgpackCodec requires msgpack. Install it with `pip install msgpack`')
+        super().__init__(compress_threshold, compress_level)
+        self._msgpack = msgpack
+
+    def serialize(self, value) -> bytes:
+        return self._msgpack.packb(value, use_bin_type=True)
+
+    def deserialize(self, data: bytes):
+        return self._msgpack.unpackb(data, raw=False)
+
+
+class _LazyMsgpack:
+    # reading msgpack values must not require building a MsgpackCodec (or having msgpack) up front
+    def deserialize(self, data):
+        try:
+            import msgpack
+        except ImportError:
+            raise ImproperlyConfigured('msgpack is required to read session values written by MsgpackCodec. '
+                                       'Install it with `pip install msgpack`')
+        return msgpack.unpackb(data, raw=False)
+
+
+_formats = {'j': JsonCodec(), 'm': _LazyMsgpack()}
+CODECS = {'json': JsonCodec, 'msgpack': MsgpackCodec}
+
+_default_codec: Optional[StateCodec] = None
+
+
+def get_state_codec() -> StateCodec:
+    """
+    the codec session values are written with. Built on first use from the `session` config section (`codec`: `json`
+    or `msgpack`, `compress_threshold`: bytes) unless set with `set_state_codec()`
+    """
+    if _default_codec is None:
+        return settings.state_codec
+    return _default_codec
+
+
+def set_state_codec(codec: StateCodec):
+    global _default_codec
+    if not isinstance(codec, StateCodec):
+        raise ImproperlyConfigured(f'codec should be a StateCodec, not {codec.__class__.__name__}')
+    # values written with a custom format can be read back from then on
+    _formats.setdefault(codec.format, codec)
+    _default_codec = codec
+
+
+def encode_state(value) -> str:
+    """`value` as a session hash field, with the default codec"""
+    return get_state_codec().encode(value)
+
+
+def decode_state(text):
+    """the value a session hash field was encoded from. Plain JSON, from before codecs, is read as well"""
+    return StateCodec.decode(text)
+
+
+def as_text(text):
+    """
+    a field for display: values written in a binary format are shown as the JSON text `JsonCodec` would have written,
+    everything else as it is
+    """
+    if not text or not isinstance(text, str) or not text.startswith(HEADER):
+        return text
+    try:
+        return JsonCodec.dumps(StateCodec.decode(text))
+    except ValueError:
+        return text
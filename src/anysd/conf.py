@@ -1,30 +1,290 @@
-import cfg_load
-import redis
+import logging
 import os
+import threading
+from typing import Optional
 
-config_path = os.environ.get("ANYSD_CONFIG_FILE", 'config.yaml')
-configs = cfg_load.load(config_path)
+LOG_FORMAT = '%(asctime)s %(levelname)-6s %(funcName)s (on line %(lineno)-4d) : %(message)s'
+DEFAULT_CONFIG_FILE = 'config.yaml'
+# connections a pool with `pool_timeout` holds when `max_connections` is not set, as in redis-py
+DEFAULT_BLOCKING_MAX_CONNECTIONS = 50
 
-environment = os.getenv('ENVIRONMENT', 'development')
-config = configs.get(environment)
+logger = logging.getLogger(__name__)
 
-nav: dict = config.get('navigation')
-if nav and 'back_symbol' in nav:
-    back_symbol = str(nav.get('back_symbol'))
-else:
-    back_symbol = '0'
 
-if nav and 'home_symbol' in nav:
-    home_symbol = str(nav.get('home_symbol'))
-else:
-    home_symbol = '00'
+class _setting:
+    # like functools.cached_property (python 3.8+): worked out on first access, then kept on the instance. Assigning
+    # to it overrides the value
+    def __init__(self, fxn):
+        self.fxn = fxn
+        self.name = fxn.__name__
+        self.__doc__ = fxn.__doc__
 
-rc = config.get('redis')
-if 'connection' in rc:
-    rc = rc.get('connection')
+    def __get__(self, instance, owner):
+        if instance is None:
+            return self
+        with instance._lock:
+            if self.name not in instance.__dict__:
+                instance.__dict__[self.name] = self.fxn(instance)
+        return instance.__dict__[self.name]
 
-r = redis.Redis(host=rc.get('host', 'localhost'), port=rc.get('port', 6379), charset="utf-8",
-                password=rc.get('password', ''), decode_responses=True, db=rc.get('db', 4))
+
+class Settings:
+    """
+    anysd configuration, read from the file in `ANYSD_CONFIG_FILE` (config.yaml by default), in the section named by
+    `ENVIRONMENT` (development by default).
+
+    Nothing is read, and no redis client is built, until a setting is first used, so importing anysd stays cheap and
+    connections are only made in the processes that use them (after a gunicorn fork, not before). Every value is
+    worked out once and kept, including the ones read from the environment. Call `anysd.setup()` at startup to read it
+    up front, from another file or environment if needed.
+    """
+
+    def __init__(self, config_file: str = None, environment: str = None):
+        """
+        :param config_file: [Optional] path to the config file. defaults to `ANYSD_CONFIG_FILE`, then config.yaml
+        :param environment: [Optional] config section to use. defaults to `ENVIRONMENT`, then development
+        """
+        self._lock = threading.RLock()
+        self._config_file = config_file
+        self._environment = environment
+
+    def reset(self, config_file: str = None, environment: str = None):
+        """
+        forget every value read so far, and what was built from them: the redis clients, the default session store and
+        state codec. The next access reads them again, from `config_file` and `environment`. A store or codec set with
+        `set_session_store()` or `set_state_codec()` is kept
+        """
+        with self._lock:
+            pool = self.__dict__.get('connection_pool')
+            self.__dict__ = {'_lock': self._lock, '_config_file': config_file, '_environment': environment}
+        if pool is not None:
+            # close the connections of the old pool. Clients still holding it reconnect on their next command
+            pool.disconnect()
+
+    @_setting
+    def config_file(self):
+        return self._config_file or os.environ.get("ANYSD_CONFIG_FILE", DEFAULT_CONFIG_FILE)
+
+    @_setting
+    def environment(self):
+        return self._environment or os.getenv('ENVIRONMENT', 'development')
+
+    @_setting
+    def configs(self) -> dict:
+        """every section of the config file"""
+        path = self.config_file
+        if not os.path.exists(path):
+            if path != DEFAULT_CONFIG_FILE:
+                raise ImproperlyConfigured(f'anysd config file {path!r} does not exist')
+            # nothing to read: redis on localhost, and default navigation symbols
+            logger.warning(f'{DEFAULT_CONFIG_FILE} not found, using the default anysd configuration')
+            return {}
+
+        import cfg_load
+
+        return cfg_load.load(path)
+
+    @_setting
+    def config(self) -> dict:
+        """the section of the config file for `environment`"""
+        if not self.configs:
+            return {}
+        config = self.configs.get(self.environment)
+        if config is None:
+            raise ImproperlyConfigured(f'{self.config_file!r} has no {self.environment!r} section')
+        return config
+
+    @_setting
+    def back_symbol(self) -> str:
+        nav = self.config.get('navigation')
+        return str(nav.get('back_symbol')) if nav and 'back_symbol' in nav else '0'
+
+    @_setting
+    def home_symbol(self) -> str:
+        nav = self.config.get('navigation')
+        return str(nav.get('home_symbol')) if nav and 'home_symbol' in nav else '00'
+
+    @_setting
+    def invalid_input(self) -> Optional[dict]:
+        """`strings.invalid_input`: the invalid input template of forms, per language"""
+        strings = self.config.get('strings')
+        return strings.get('invalid_input') if strings else None
+
+    @_setting
+    def variable_substitution_precedence(self) -> str:
+        """`VARIABLE_SUBSTITUTION_PRECEDENCE`: `local` variables win over global ones with the same name, or `global`"""
+        return os.getenv('VARIABLE_SUBSTITUTION_PRECEDENCE', 'local')
+
+    @_setting
+    def global_var_key(self) -> str:
+        return os.getenv('GLOBAL_VARIABLES_NAME', 'GLOBAL_VARIABLES')
+
+    # seconds a session hash is kept after its last hop, and after a hop that ended the session (`END` response).
+    # None keeps sessions forever
+    @_setting
+    def session_ttl(self) -> Optional[int]:
+        return (self.config.get('session') or {}).get('ttl')
+
+    @_setting
+    def completed_session_ttl(self) -> Optional[int]:
+        return (self.config.get('session') or {}).get('completed_ttl')
+
+    # how structured session values are written: `json` or `msgpack`, zlib compressed from `compress_threshold` bytes
+    @_setting
+    def session_codec(self) -> str:
+        return (self.config.get('session') or {}).get('codec', 'json')
+
+    @_setting
+    def session_compress_threshold(self) -> Optional[int]:
+        return (self.config.get('session') or {}).get('compress_threshold')
+
+    @_setting
+    def redis_config(self) -> dict:
+        return self.config.get('redis') or {}
+
+    @_setting
+    def redis_connection(self) -> dict:
+        """the connection details: `redis.connection`, or the `redis` section itself"""
+        return self.redis_config.get('connection', self.redis_config)
+
+    def _pool_option(self, name, default=None):
+        # pool options may sit next to the connection details, or directly under the `redis` section
+        if name in self.redis_connection:
+            return self.redis_connection.get(name)
+        return self.redis_config.get(name, default)
+
+    @_setting
+    def pool_kwargs(self) -> dict:
+        rc = self.redis_connection
+        kwargs = dict(
+            host=rc.get('host', 'localhost'),
+            port=rc.get('port', 6379),
+            password=rc.get('password', ''),
+            db=rc.get('db', 4),
+            encoding='utf-8',
+            decode_responses=True,
+            health_check_interval=self._pool_option('health_check_interval', 0),
+            socket_keepalive=self._pool_option('socket_keepalive', False),
+        )
+        # left out when not set, for the pool's own default
+        if self._pool_option('max_connections') is not None:
+            kwargs['max_connections'] = self._pool_option('max_connections')
+        return kwargs
+
+    def _build_pool(self, module):
+        # `module`: redis, or redis.asyncio
+        timeout = self._pool_option('pool_timeout')
+        if timeout is None:
+            return module.ConnectionPool(**self.pool_kwargs)
+        # wait for a free connection instead of failing when `max_connections` is reached. A blocking pool fills a
+        # queue with `max_connections` slots up front, so it always needs a bound
+        kwargs = dict(self.pool_kwargs)
+        kwargs.setdefault('max_connections', DEFAULT_BLOCKING_MAX_CONNECTIONS)
+        return module.BlockingConnectionPool(timeout=timeout, **kwargs)
+
+    @_setting
+    def connection_pool(self):
+        import redis
+
+        return self._build_pool(redis)
+
+    @_setting
+    def redis(self):
+        """the shared redis client. It connects on its first command"""
+        import redis
+
+        return redis.Redis(connection_pool=self.connection_pool)
+
+    @_setting
+    def async_redis(self):
+        """the shared `redis.asyncio` client, on its own pool built from the same `redis` section"""
+        from redis import asyncio as aioredis
+
+        return aioredis.Redis(connection_pool=self._build_pool(aioredis))
+
+    @_setting
+    def session_store(self):
+        """the session store used when none is set with `set_session_store()`: redis, through the shared pool"""
+        from .store import RedisSessionStore
+
+        return RedisSessionStore(self.redis)
+
+    @_setting
+    def state_codec(self):
+        """the codec used when none is set with `set_state_codec()`, from `session.codec` and `compress_threshold`"""
+        from .codec import CODECS
+
+        if self.session_codec not in CODECS:
+            raise ImproperlyConfigured(f'unknown session codec {self.session_codec!r}. Use one of {", ".join(CODECS)}')
+        return CODECS[self.session_codec](compress_threshold=self.session_compress_threshold)
+
+
+settings = Settings()
+
+
+def setup(config_file: str = None, environment: str = None, log_level: Optional[int] = logging.INFO,
+          log_format: str = LOG_FORMAT):
+    """
+    Configure anysd explicitly, once at startup, before the first request: reads the config file now rather than on
+    first use, and sets up logging, which anysd does not do on import. No connection is made; the redis client connects
+    on its first command, in the process that uses it.
+
+    Everything built from an earlier configuration is dropped, so the default session store and state codec follow
+    the new one. Stores and codecs set with `set_session_store()` or `set_state_codec()` are kept.
+
+    :param config_file: [Optional] path to the config file. defaults to `ANYSD_CONFIG_FILE`, then config.yaml
+    :param environment: [Optional] config section to use. defaults to `ENVIRONMENT`, then development
+    :param log_level: [Optional] level for `logging.basicConfig`. None leaves logging to the application
+    :param log_format: [Optional] format for `logging.basicConfig`
+    :return: the settings
+    """
+    settings.reset(config_file, environment)
+    # read now, so a missing file or environment fails at startup
+    settings.config
+    if log_level is not None:
+        logging.basicConfig(level=log_level, format=log_format)
+    return settings
+
+
+def get_redis():
+    """the shared redis client. All anysd sessions, variables and conditional flows draw from one pool"""
+    return settings.redis
+
+
+def get_async_redis():
+    """
+    the shared `redis.asyncio` client, built on first use from the same `redis` config section as `get_redis()`
+    """
+    return settings.async_redis
+
+
+def pool_stats():
+    """
+    connection usage of the shared pool
+
+    :return: dict with `max_connections`, `created`, `in_use`, `available` and `saturation` (in_use / max_connections,
+             or None when the pool is unbounded)
+    """
+    import redis
+
+    pool = settings.connection_pool
+    if isinstance(pool, redis.BlockingConnectionPool):
+        created = len(pool._connections)
+        available = len([c for c in list(pool.pool.queue) if c is not None])
+        in_use = created - available
+    else:
+        created = pool._created_connections
+        available = len(pool._available_connections)
+        in_use = len(pool._in_use_connections)
+
+    max_connections = pool.max_connections if pool.max_connections < 2 ** 31 else None
+    return {
+        'max_connections': max_connections,
+        'created': created,
+        'in_use': in_use,
+        'available': available,
+        'saturation': in_use / max_connections if max_connections else None,
+    }
 
 
 class FormBackError(IndexError):
@@ -61,4 +321,17 @@ class TranslationError(Exception):
     """raised when translation for selected language cannot be found"""
 
 
-global_var_key = os.getenv('GLOBAL_VARIABLES_NAME', 'GLOBAL_VARIABLES')
+# module level names from before `settings`, read from it on first use
+_SETTINGS = {
+    'config_path': 'config_file', 'config': 'config', 'configs': 'configs', 'environment': 'environment',
+    'back_symbol': 'back_symbol', 'home_symbol': 'home_symbol', 'session_ttl': 'session_ttl',
+    'completed_session_ttl': 'completed_session_ttl', 'session_codec': 'session_codec',
+    'session_compress_threshold': 'session_compress_threshold', 'redis_config': 'redis_config',
+    'connection_pool': 'connection_pool', 'r': 'redis', 'global_var_key': 'global_var_key', 'rc': 'redis_connection',
+}
+
+
+def __getattr__(name):
+    if name in _SETTINGS:
+        return getattr(settings, _SETTINGS[name])
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
@@ -0,0 +1,364 @@
+import inspect
+import logging
+import time
+from typing import Callable, Iterable, Optional, Union
+
+from .conf import ImproperlyConfigured
+from .store import SessionStore
+
+logger = logging.getLogger(__name__)
+
+# phases of a hop, in the order they run. a phase runs again when navigation has to back out of a form
+PHASES = ('load', 'resolve', 'menu', 'format_response', 'flush')
+
+
+class HopMetrics:
+    """
+    What one `navigate()` call did: time spent in each phase and in user callbacks, and session store traffic.
+
+    - `phases`: {phase: seconds}, see `PHASES`. `resolve` covers path processing and navigation, including condition
+      functions; `menu` covers the menu or form, including validators, list items, `post_call` hooks and the
+      translation function
+    - `callbacks`: (kind, start offset, seconds) of every user callable invoked. kinds are `validator`, `list_items`,
+      `menu`, `post_call`, `condition` and `translation`
+    - `timeline`: (phase, start offset, seconds) of every phase, in order. offsets are seconds from `started`
+    - `redis_round_trips`, `redis_commands`, `redis_bytes_sent`, `redis_bytes_received`: session store traffic,
+      counted at the store, so for any backend. bytes are those of keys, fields and values
+    """
+
+    def __init__(self, msisdn, session_id, ussd_string):
+        self.msisdn = msisdn
+        self.session_id = session_id
+        self.ussd_string = ussd_string
+        self.started = None
+        self.duration = None
+        self.phases = {}
+        self.timeline = []
+        self.callbacks = []
+        self.redis_round_trips = 0
+        self.redis_commands = 0
+        self.redis_bytes_sent = 0
+        self.redis_bytes_received = 0
+        self.ended = None
+        self.error = None
+        self._t0 = None
+        self._phase = None
+        self._phase_started = None
+
+    def mark(self, phase: Optional[str]):
+        """end the running phase, and start `phase` (unless None)"""
+        now = time.perf_counter()
+        if self._t0 is None:
+            self._t0 = now
+            self.started = time.time()
+        if self._phase is not None:
+            elapsed = now - self._phase_started
+            self.phases[self._phase] = self.phases.get(self._phase, 0.0) + elapsed
+            self.timeline.append((self._phase, self._phase_started - self._t0, elapsed))
+        self._phase, self._phase_started = phase, now
+
+    def finish(self, response=None, error: BaseException = None):
+        self.mark(None)
+        self.duration = time.perf_counter() - self._t0
+        self.ended = isinstance(response, str) and response.startswith('END')
+        self.error = error
+
+    def call(self, call):
+        """invoke a `_Call` for a user callback, timing it"""
+        started = time.perf_counter()
+        try:
+            return call.fxn(*call.args, **call.kwargs)
+        finally:
+            self.add_callback(call.kind, started)
+
+    async def acall(self, call):
+        """`call()` for `AsyncNavigationController`, awaiting awaitable results"""
+        started = time.perf_counter()
+        try:
+            result = call.fxn(*call.args, **call.kwargs)
+            if inspect.isawaitable(result):
+                result = await result
+            return result
+        finally:
+            self.add_callback(call.kind, started)
+
+    def add_callback(self, kind, started):
+        self.callbacks.append((kind, started - (self._t0 or started), time.perf_counter() - started))
+
+    def callback_totals(self) -> dict:
+        """{kind: (calls, seconds)}"""
+        totals = {}
+        for kind, _, seconds in self.callbacks:
+            calls, total = totals.get(kind, (0, 0.0))
+            totals[kind] = (calls + 1, total + seconds)
+        return totals
+
+    def as_dict(self) -> dict:
+        return {
+            'session_id': self.session_id,
+            'started': self.started,
+            'duration': self.duration,
+            'phases': dict(self.phases),
+            'callbacks': {kind: {'calls': calls, 'seconds': seconds}
+                          for kind, (calls, seconds) in self.callback_totals().items()},
+            'redis_round_trips': self.redis_round_trips,
+            'redis_commands': self.redis_commands,
+            'redis_bytes_sent': self.redis_bytes_sent,
+            'redis_bytes_received': self.redis_bytes_received,
+            'ended': self.ended,
+            'error': self.error.__class__.__name__ if self.error is not None else None,
+        }
+
+
+def _size(*values):
+    return sum(len(value.encode('utf-8')) if isinstance(value, str) else len(str(value)) for value in values)
+
+
+class MeteredSessionStore(SessionStore):
+    """
+    Passes every call to `store`, counting round trips, commands and bytes into `metrics`. Works with stores whose
+    methods are coroutines too.
+    """
+
+    def __init__(self, store: SessionStore, metrics: HopMetrics):
+        self.store = store
+        self.metrics = metrics
+
+    def _sent(self, commands, *values):
+        metrics = self.metrics
+        metrics.redis_round_trips += 1
+        metrics.redis_commands += commands
+        metrics.redis_bytes_sent += _size(*values)
+
+    def _received(self, result, size):
+        if inspect.isawaitable(result):
+            return self._areceived(result, size)
+        self.metrics.redis_bytes_received += size(result)
+        return result
+
+    async def _areceived(self, result, size):
+        result = await result
+        self.metrics.redis_bytes_received += size(result)
+        return result
+
+    @staticmethod
+    def _hash_size(data):
+        return _size(*data.keys(), *data.values()) if data else 0
+
+    @staticmethod
+    def _values_size(data):
+        return _size(*(value for value in data.values() if value is not None)) if data else 0
+
+    def _update_commands(self, changed, deleted, ttl):
+        return bool(changed) + bool(deleted) + bool(ttl)
+
+    def get_all(self, key):
+        self._sent(1, key)
+        return self._received(self.store.get_all(key), self._hash_size)
+
+    def get_many(self, key, fields):
+        fields = list(fields)
+        if fields:
+            self._sent(1, key, *fields)
+        return self._received(self.store.get_many(key, fields), self._values_size)
+
+    def set_many(self, key, mapping):
+        if mapping:
+            self._sent(1, key, *mapping.keys(), *mapping.values())
+        return self.store.set_many(key, mapping)
+
+    def delete_many(self, key, fields):
+        fields = list(fields)
+        if fields:
+            self._sent(1, key, *fields)
+        return self.store.delete_many(key, fields)
+
+    def update(self, key, changed=None, deleted=None, ttl=None):
+        commands = self._update_commands(changed, deleted, ttl)
+        if commands:
+            changed = changed or {}
+            self._sent(commands, key, *changed.keys(), *changed.values(), *(deleted or ()))
+        return self.store.update(key, changed, deleted, ttl)
+
+    def expire(self, key, ttl):
+        self._sent(1, key)
+        return self.store.expire(key, ttl)
+
+    def delete(self, key):
+        self._sent(1, key)
+        return self.store.delete(key)
+
+    def get_all_many(self, keys):
+        keys = list(keys)
+        self._sent(len(keys), *keys)
+        return self._received(self.store.get_all_many(keys),
+                              lambda data: sum(self._hash_size(_data) for _data in data))
+
+    def update_many(self, updates):
+        commands = sum(self._update_commands(**update) for update in updates.values())
+        if commands:
+            self._sent(commands, *(
+                value for key, update in updates.items()
+                for value in (key, *(update.get('changed') or {}).keys(), *(update.get('changed') or {}).values(),
+                              *(update.get('deleted') or ()))))
+        return self.store.update_many(updates)
+
+
+class Instrumentation:
+    """
+    Receives the `HopMetrics` of every `navigate()` call. Subclass and implement `record()`, then pass it to
+    `NavigationController(instrumentation=...)` or make it the default with `set_instrumentation()`. A plain function
+    taking a `HopMetrics` works too.
+
+    `record()` runs after the response is resolved, on the request path: keep it fast. Errors it raises are logged,
+    not raised.
+    """
+
+    def record(self, metrics: HopMetrics):
+        raise NotImplementedError
+
+
+class InstrumentationGroup(Instrumentation):
+    """sends the metrics to several instrumentations"""
+
+    def __init__(self, *instrumentations: Union[Instrumentation, Callable]):
+        self.instrumentations = instrumentations
+
+    def record(self, metrics):
+        for instrumentation in self.instrumentations:
+            emit(instrumentation, metrics)
+
+
+def emit(instrumentation: Union[Instrumentation, Callable], metrics: HopMetrics):
+    try:
+        if isinstance(instrumentation, Instrumentation):
+            instrumentation.record(metrics)
+        else:
+            instrumentation(metrics)
+    except Exception as e:
+        logger.warning(f'instrumentation {instrumentation} failed: {e!r}')
+
+
+_default_instrumentation: Optional[Union[Instrumentation, Callable]] = None
+
+
+def get_instrumentation() -> Optional[Union[Instrumentation, Callable]]:
+    """the instrumentation used when none is passed explicitly. None (disabled) unless set"""
+    return _default_instrumentation
+
+
+def set_instrumentation(instrumentation: Optional[Union[Instrumentation, Callable]]):
+    """make `instrumentation` the default for every controller. None disables it"""
+    global _default_instrumentation
+    if instrumentation is not None and not (isinstance(instrumentation, Instrumentation) or callable(instrumentation)):
+        raise ImproperlyConfigured(
+            f'instrumentation should be an Instrumentation or a callable, not {instrumentation.__class__.__name__}')
+    _default_instrumentation = instrumentation
+
+
+class PrometheusInstrumentation(Instrumentation):
+    def __init__(self, namespace: str = 'anysd', registry=None, buckets: Iterable[float] = None):
+        """
+        Prometheus counters and histograms, through `prometheus_client` (`pip install prometheus-client`):
+
+        - `{namespace}_hops_total{outcome}`: `continue`, `end` or `error`
+        - `{namespace}_hop_duration_seconds`
+        - `{namespace}_phase_duration_seconds{phase}`
+        - `{namespace}_callback_duration_seconds{kind}`
+        - `{namespace}_redis_round_trips_total`, `{namespace}_redis_commands_total`
+        - `{namespace}_redis_bytes_total{direction}`: `sent` or `received`
+
+        :param namespace: [Optional] metric name prefix
+        :param registry: [Optional] `CollectorRegistry`. defaults to the global registry
+        :param buckets: [Optional] histogram buckets, in seconds
+        """
+        try:
+            import prometheus_client
+        except ImportError:
+            raise ImproperlyConfigured('PrometheusInstrumentation requires prometheus_client. '
+                                       'Install it with `pip install prometheus-client`')
+
+        options = {'namespace': namespace}
+        if registry is not None:
+            options['registry'] = registry
+        histogram = dict(options)
+        if buckets is not None:
+            histogram['buckets'] = tuple(buckets)
+
+        self.hops = prometheus_client.Counter('hops', 'navigate() calls', ['outcome'], **options)
+        self.hop_duration = prometheus_client.Histogram(
+            'hop_duration_seconds', 'navigate() duration', **histogram)
+        self.phase_duration = prometheus_client.Histogram(
+            'phase_duration_seconds', 'time spent in each phase of navigate()', ['phase'], **histogram)
+        self.callback_duration = prometheus_client.Histogram(
+            'callback_duration_seconds', 'duration of user callbacks', ['kind'], **histogram)
+        self.round_trips = prometheus_client.Counter(
+            'redis_round_trips', 'session store round trips', **options)
+        self.commands = prometheus_client.Counter('redis_commands', 'session store commands', **options)
+        self.bytes = prometheus_client.Counter(
+            'redis_bytes', 'session store payload bytes', ['direction'], **options)
+
+    def record(self, metrics):
+        if metrics.error is not None:
+            outcome = 'error'
+        else:
+            outcome = 'end' if metrics.ended else 'continue'
+        self.hops.labels(outcome).inc()
+        self.hop_duration.observe(metrics.duration)
+        for phase, seconds in metrics.phases.items():
+            self.phase_duration.labels(phase).observe(seconds)
+        for kind, _, seconds in metrics.callbacks:
+            self.callback_duration.labels(kind).observe(seconds)
+        self.round_trips.inc(metrics.redis_round_trips)
+        self.commands.inc(metrics.redis_commands)
+        self.bytes.labels('sent').inc(metrics.redis_bytes_sent)
+        self.bytes.labels('received').inc(metrics.redis_bytes_received)
+
+
+class OpenTelemetryInstrumentation(Instrumentation):
+    def __init__(self, tracer=None, span_name: str = 'anysd.navigate'):
+        """
+        One OpenTelemetry span per hop, with a child span per phase and per user callback, through
+        `opentelemetry-api`. Spans are created from the recorded timings once the hop is done, so they carry the real
+        start and end times but are not the current span while callbacks run.
+
+        The msisdn is not recorded; the session id is, as `anysd.session_id`.
+
+        :param tracer: [Optional] tracer. defaults to `trace.get_tracer('anysd')`
+        :param span_name: [Optional] name of the hop span
+        """
+        try:
+            from opentelemetry import trace
+        except ImportError:
+            raise ImproperlyConfigured('OpenTelemetryInstrumentation requires opentelemetry-api. '
+                                       'Install it with `pip install opentelemetry-api`')
+        self._trace = trace
+        self.tracer = trace.get_tracer('anysd') if tracer is None else tracer
+        self.span_name = span_name
+
+    def record(self, metrics):
+        trace = self._trace
+        t0 = int(metrics.started * 1e9)
+
+        def ns(offset):
+            return t0 + int(offset * 1e9)
+
+        span = self.tracer.start_span(self.span_name, start_time=t0, attributes={
+            'anysd.session_id': str(metrics.session_id),
+            'anysd.ended': bool(metrics.ended),
+            'anysd.redis.round_trips': metrics.redis_round_trips,
+            'anysd.redis.commands': metrics.redis_commands,
+            'anysd.redis.bytes_sent': metrics.redis_bytes_sent,
+            'anysd.redis.bytes_received': metrics.redis_bytes_received,
+        })
+        context = trace.set_span_in_context(span)
+        for phase, offset, seconds in metrics.timeline:
+            self.tracer.start_span(f'anysd.{phase}', context=context, start_time=ns(offset)).end(
+                end_time=ns(offset + seconds))
+        for kind, offset, seconds in metrics.callbacks:
+            self.tracer.start_span(f'anysd.callback.{kind}', context=context, start_time=ns(offset)).end(
+                end_time=ns(offset + seconds))
+        if metrics.error is not None:
+            span.record_exception(metrics.error)
+            span.set_status(trace.Status(trace.StatusCode.ERROR, str(metrics.error)))
+        span.end(end_time=ns(metrics.duration))
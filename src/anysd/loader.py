@@ -0,0 +1,435 @@
+import hashlib
+import importlib
+import json
+import os
+import pickle
+import stat
+import tempfile
+from typing import Union
+
+from . import __version__
+from .conf import ParseError, ImproperlyConfigured, settings
+from .main import NavigationMenu, FormFlow, ListInput, ConditionalFlow, CompiledMenu, compile_menu, universal_logger, \
+    _dotted_name
+
+# bump when the pickled layout of a menu, form, list or conditional changes, so old caches are ignored. Caches are
+# also keyed on the anysd version
+CACHE_FORMAT = 2
+
+_MENU_KEYS = {'name', 'title', 'show_title', 'children', 'form'}
+_CONDITION_KEYS = {'function', 'branches', 'cache_results', 'cache_key', 'cache_ttl', 'cache_size', 'cache_name'}
+_FORM_KEYS = {'validator', 'questions'}
+_QUESTION_KEYS = {'name', 'menu', 'post_call'}
+_LIST_KEYS = {'items', 'title', 'key', 'idx', 'extra', 'empty_list_message', 'cache_in_session', 'cache_ttl',
+              'cache_key', 'page_size', 'next_symbol', 'previous_symbol', 'next_text', 'previous_text'}
+
+
+def import_string(dotted_path: str):
+    """
+    object at `dotted_path`, either `package.module.name` or `package.module:name.attribute`
+
+    :raises ImportError: if the module or the attribute does not exist
+    """
+    if ':' in dotted_path:
+        module_path, _, attributes = dotted_path.partition(':')
+    else:
+        module_path, _, attributes = dotted_path.rpartition('.')
+    if not module_path or not attributes:
+        raise ImportError(f'{dotted_path!r} is not a dotted path')
+
+    obj = importlib.import_module(module_path)
+    for attribute in attributes.split('.'):
+        try:
+            obj = getattr(obj, attribute)
+        except AttributeError:
+            raise ImportError(f'{module_path!r} has no attribute {attributes!r}')
+    return obj
+
+
+class _SpecParser:
+    """
+    validates a whole spec, collecting every problem before anything is built, then builds the navigation from it
+    """
+
+    def __init__(self, spec):
+        self.spec = spec
+        self.errors = []
+        self.callables = {}
+        self.forms = {}
+
+    def error(self, where, message):
+        self.errors.append(f'{where}: {message}')
+
+    def callable(self, value, where):
+        if not isinstance(value, str):
+            self.error(where, f'should be a dotted path to a callable, not {value.__class__.__name__}')
+            return
+        if value not in self.callables:
+            try:
+                obj = import_string(value)
+            except ImportError as e:
+                self.error(where, f'cannot import {value!r} ({e})')
+                return
+            if not callable(obj):
+                self.error(where, f'{value!r} is not callable')
+                return
+            self.callables[value] = obj
+
+    def keys(self, spec, allowed, where):
+        unknown = set(spec) - allowed
+        if unknown:
+            self.error(where, f'unknown keys {sorted(map(str, unknown))}')
+
+    def text(self, value, where, required=True):
+        # a plain string, or translations: {language: string}
+        if value is None:
+            if required:
+                self.error(where, 'is required')
+        elif isinstance(value, dict):
+            if not value or not all(isinstance(k, str) and isinstance(v, str) for k, v in value.items()):
+                self.error(where, 'translations should map language codes to strings')
+        elif not isinstance(value, str):
+            self.error(where, f'should be a string or translations, not {value.__class__.__name__}')
+
+    def validate(self):
+        spec = self.spec
+        if not isinstance(spec, dict):
+            raise ParseError(f'spec should be a mapping, not {spec.__class__.__name__}')
+        self.keys(spec, {'menu', 'forms'}, 'spec')
+
+        forms = spec.get('forms') or {}
+        if not isinstance(forms, dict):
+            self.error('forms', 'should map form names to forms')
+            forms = {}
+        for name, form in forms.items():
+            self.validate_form(form, f'forms.{name}')
+
+        if 'menu' not in spec:
+            self.error('spec', "'menu' is required")
+        else:
+            self.validate_node(spec['menu'], 'menu')
+
+        if self.errors:
+            raise ParseError('invalid ussd spec\n' + '\n'.join(self.errors))
+
+    def validate_node(self, spec, where):
+        if not isinstance(spec, dict):
+            self.error(where, f'should be a mapping, not {spec.__class__.__name__}')
+            return
+        if 'condition' in spec:
+            self.keys(spec, {'condition'}, where)
+            self.validate_condition(spec['condition'], f'{where}.condition')
+            return
+
+        self.keys(spec, _MENU_KEYS, where)
+        if not isinstance(spec.get('name'), str) or not spec.get('name'):
+            self.error(f'{where}.name', 'is required')
+        self.text(spec.get('title'), f'{where}.title')
+
+        children = spec.get('children')
+        form = spec.get('form')
+        if children is None and form is None:
+            self.error(where, "either 'children' or 'form' should be set")
+        if children is not None:
+            if not isinstance(children, list) or not children:
+                self.error(f'{where}.children', 'should be a non empty list')
+            else:
+                for n, child in enumerate(children):
+                    if isinstance(child, dict) and 'condition' in child:
+                        self.error(f'{where}.children[{n}]', 'a condition can only be the menu or a branch of another '
+                                                             'condition')
+                        continue
+                    self.validate_node(child, f'{where}.children[{n}]')
+        if form is not None:
+            if isinstance(form, str):
+                if form not in (self.spec.get('forms') or {}):
+                    self.error(f'{where}.form', f'unknown form {form!r}')
+            else:
+                self.validate_form(form, f'{where}.form')
+
+    def validate_condition(self, spec, where):
+        if not isinstance(spec, dict):
+            self.error(where, f'should be a mapping, not {spec.__class__.__name__}')
+            return
+        self.keys(spec, _CONDITION_KEYS, where)
+        self.callable(spec.get('function'), f'{where}.function')
+        if spec.get('cache_results', False) not in (False, True, 'session', 'global'):
+            self.error(f'{where}.cache_results', "should be true, false, 'session' or 'global'")
+        if spec.get('cache_key') is not None:
+            self.callable(spec['cache_key'], f'{where}.cache_key')
+        for option in ('cache_ttl', 'cache_size'):
+            value = spec.get(option)
+            if value is not None and (not isinstance(value, int) or isinstance(value, bool) or value < 1):
+                self.error(f'{where}.{option}', 'should be a positive number')
+        if spec.get('cache_name') is not None and not isinstance(spec['cache_name'], str):
+            self.error(f'{where}.cache_name', 'should be a string')
+        elif spec.get('cache_results') and spec.get('cache_name') is None:
+            function = self.callables.get(spec.get('function'))
+            if function is not None and _dotted_name(function) is None:
+                self.error(f'{where}.cache_name', f'is required to cache the results of {spec["function"]}, which has '
+                                                  f'no name of its own')
+        branches = spec.get('branches')
+        if not isinstance(branches, dict) or not branches:
+            self.error(f'{where}.branches', 'should map condition results to menus')
+            return
+        for result, branch in branches.items():
+            self.validate_node(branch, f'{where}.branches.{result}')
+
+    def validate_form(self, spec, where):
+        if not isinstance(spec, dict):
+            self.error(where, f'should be a mapping, not {spec.__class__.__name__}')
+            return
+        self.keys(spec, _FORM_KEYS, where)
+        self.callable(spec.get('validator'), f'{where}.validator')
+
+        questions = spec.get('questions')
+        if isinstance(questions, list):
+            questions = {str(n): question for n, question in enumerate(questions, 1)}
+        if not isinstance(questions, dict) or not questions:
+            self.error(f'{where}.questions', 'should be a non empty list, or a mapping of step numbers to questions')
+            return
+        steps = sorted(str(step) for step in questions)
+        if steps != sorted(str(n) for n in range(1, len(questions) + 1)):
+            self.error(f'{where}.questions', f'steps should be numbered from 1, got {steps}')
+
+        for step, question in questions.items():
+            _where = f'{where}.questions.{step}'
+            if not isinstance(question, dict):
+                self.error(_where, f'should be a mapping, not {question.__class__.__name__}')
+                continue
+            self.keys(question, _QUESTION_KEYS, _where)
+            if not isinstance(question.get('name'), str) or not question.get('name'):
+                self.error(f'{_where}.name', 'is required')
+            if 'post_call' in question:
+                self.callable(question['post_call'], f'{_where}.post_call')
+
+            menu = question.get('menu')
+            if isinstance(menu, dict) and 'list' in menu:
+                self.keys(menu, {'list'}, f'{_where}.menu')
+                self.validate_list(menu['list'], f'{_where}.menu.list')
+            else:
+                self.text(menu, f'{_where}.menu')
+
+    def validate_list(self, spec, where):
+        if not isinstance(spec, dict):
+            self.error(where, f'should be a mapping, not {spec.__class__.__name__}')
+            return
+        self.keys(spec, _LIST_KEYS, where)
+        items = spec.get('items')
+        if isinstance(items, str):
+            self.callable(items, f'{where}.items')
+        elif not isinstance(items, list):
+            self.error(f'{where}.items', 'should be a list, or a dotted path to a callable returning one')
+        self.text(spec.get('title'), f'{where}.title')
+        page_size = spec.get('page_size')
+        if page_size is not None and (not isinstance(page_size, int) or isinstance(page_size, bool) or page_size < 1):
+            self.error(f'{where}.page_size', 'should be a positive number')
+        else:
+            error = ListInput.page_keys_error(page_size, spec.get('next_symbol', '99'), spec.get('previous_symbol', '98'),
+                                              (settings.back_symbol, settings.home_symbol))
+            if error:
+                self.error(f'{where}.page_size', error)
+        for option in ('next_text', 'previous_text'):
+            if option in spec:
+                self.text(spec[option], f'{where}.{option}')
+
+    def build(self):
+        forms = self.spec.get('forms') or {}
+        self.forms = {name: self.build_form(form) for name, form in forms.items()}
+        return self.build_node(self.spec['menu'])
+
+    def build_node(self, spec, parent=None):
+        if 'condition' in spec:
+            condition = spec['condition']
+            return ConditionalFlow(
+                condition_fxn=self.callables[condition['function']],
+                condition_result_mapping={
+                    result: self.build_node(branch) for result, branch in condition['branches'].items()},
+                cache_results=condition.get('cache_results', False),
+                cache_key=self.callables[condition['cache_key']] if condition.get('cache_key') else None,
+                cache_ttl=condition.get('cache_ttl'),
+                cache_size=condition.get('cache_size', 100_000),
+                cache_name=condition.get('cache_name')
+            )
+
+        form = spec.get('form')
+        if isinstance(form, str):
+            form = self.forms[form]
+        elif form is not None:
+            form = self.build_form(form)
+
+        menu = NavigationMenu(
+            name=spec['name'],
+            title=spec['title'],
+            show_title=spec.get('show_title', True),
+            next_form=form,
+            parent=parent
+        )
+        for child in spec.get('children') or ():
+            self.build_node(child, parent=menu)
+        return menu
+
+    def build_form(self, spec):
+        questions = spec['questions']
+        if isinstance(questions, list):
+            questions = {str(n): question for n, question in enumerate(questions, 1)}
+
+        form_questions = {}
+        for step, question in questions.items():
+            menu = question['menu']
+            if isinstance(menu, dict) and 'list' in menu:
+                options = dict(menu['list'])
+                if isinstance(options['items'], str):
+                    options['items'] = self.callables[options['items']]
+                menu = ListInput(**options)
+            built = {'name': question['name'], 'menu': menu}
+            if 'post_call' in question:
+                built['post_call'] = self.callables[question['post_call']]
+            form_questions[str(step)] = built
+
+        return FormFlow(form_questions=form_questions, step_validator=self.callables[spec['validator']])
+
+
+def build_menu(spec: dict) -> Union[NavigationMenu, ConditionalFlow]:
+    """
+    Build a navigation from a spec. The whole spec is validated before anything is built.
+
+    ```yaml
+    menu:
+        name: Home
+        title: {en: Main Menu, sw: Menyu Kuu}
+        children:
+            - name: airtime
+              title: {en: Buy Airtime, sw: Nunua Muda wa Maongezi}
+              form: airtime
+            - name: account
+              title: {en: My Account, sw: Akaunti Yangu}
+              form: balance
+    forms:
+        airtime:
+            validator: myapp.validators.airtime_validator
+            questions:
+                - {name: RECEIVER, menu: {list: {items: [Myself, Other number], title: Select Option}}}
+                - {name: AMOUNT, menu: Enter amount}
+                - {name: CONFIRMATION, menu: "Buy {AMOUNT}?\\n1. Confirm", post_call: myapp.hooks.buy}
+        balance:
+            validator: myapp.validators.balance_validator
+            questions:
+                - {name: PIN, menu: Enter PIN}
+    ```
+
+    To pick a menu at runtime, use a condition as the top menu (or as a branch of another condition):
+
+    ```yaml
+    menu:
+        condition:
+            function: myapp.conditions.registration_status
+            cache_results: session      # or global, with cache_key (a dotted path) and cache_ttl. see ConditionalFlow
+            branches:
+                registered: {name: Home, title: Main Menu, children: [...]}
+                new: {name: Register, title: Welcome, form: registration}
+    ```
+
+    A `menu` is either a navigation menu, with `children` or a `form`, or a `condition` (only as the top menu or a
+    branch of another condition). Forms are defined inline or by name under `forms`. Question menus are strings,
+    translations, or a `list` with the arguments of `ListInput`; list `items` may be a dotted path to a callable.
+    Validators, `post_call` hooks and condition functions are dotted paths, `package.module.name` or
+    `package.module:name`.
+
+    :raises ParseError: listing every problem found in the spec
+    """
+    parser = _SpecParser(spec)
+    parser.validate()
+    return parser.build()
+
+
+def _read_spec(source: Union[dict, str, os.PathLike]):
+    """
+    :return: (the spec's bytes, for hashing, and a function parsing it). files are only parsed when there is no cache
+    """
+    if isinstance(source, dict):
+        return json.dumps(source, sort_keys=True, default=str).encode(), lambda: source
+
+    with open(source, 'rb') as f:
+        raw = f.read()
+
+    def parse():
+        if str(source).endswith('.json'):
+            try:
+                return json.loads(raw)
+            except ValueError as e:
+                raise ParseError(f'{source}: {e}')
+        try:
+            import yaml
+        except ImportError:
+            raise ImproperlyConfigured('PyYAML is required to load yaml specs. use a json spec, or install pyyaml')
+        try:
+            return yaml.safe_load(raw)
+        except yaml.YAMLError as e:
+            raise ParseError(f'{source}: {e}')
+
+    return raw, parse
+
+
+def _private_dir(path) -> bool:
+    """
+    create `path` readable by its owner only, if missing. False if it cannot be trusted with pickles: a symlink, owned by
+    another user, or writable by others
+    """
+    os.makedirs(path, mode=0o700, exist_ok=True)
+    if not hasattr(os, 'getuid'):
+        # no owners or permission bits to check
+        return True
+    info = os.lstat(path)
+    if stat.S_ISLNK(info.st_mode) or not stat.S_ISDIR(info.st_mode):
+        return False
+    return info.st_uid == os.getuid() and not info.st_mode & (stat.S_IWGRP | stat.S_IWOTH)
+
+
+def load_menu(source: Union[dict, str, os.PathLike], cache_dir: Union[str, os.PathLike] = None) -> CompiledMenu:
+    """
+    Build and compile a navigation from a spec (see `build_menu()`), given as a dict or a `.yaml`/`.json` file.
+
+    :param source: the spec, or the path of a file holding it
+    :param cache_dir: [Optional] directory for a pickled copy of the compiled menu, keyed on a hash of the spec. Later
+                      loads of the same spec, from any process, unpickle it instead of parsing and building the
+                      menu again. Callables are pickled by reference, so they have to be importable. Loading a
+                      pickle runs code: the directory is created private, and not used if another user owns it or
+                      others can write to it
+    :return: the compiled menu, to pass to `NavigationController`. `.home` is the built navigation
+    """
+    raw, parse = _read_spec(source)
+
+    cache_file = None
+    if cache_dir is not None and not _private_dir(cache_dir):
+        universal_logger.warning(f'not caching the menu in {cache_dir}: it should be a directory of this user, that '
+                                 f'others cannot write to')
+        cache_dir = None
+    if cache_dir is not None:
+        digest = hashlib.sha256(raw + f':{CACHE_FORMAT}:{__version__}'.encode()).hexdigest()[:24]
+        cache_file = os.path.join(cache_dir, f'anysd-menu-{digest}.pickle')
+        try:
+            with open(cache_file, 'rb') as f:
+                menu = pickle.load(f)
+            if isinstance(menu, CompiledMenu):
+                return menu
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            # stale or corrupt cache, e.g. a callable that moved. build from the spec instead
+            universal_logger.warning(f'ignoring menu cache {cache_file}: {e}')
+
+    menu = compile_menu(build_menu(parse()))
+
+    if cache_file is not None:
+        # write then rename, so concurrent workers never read a partial file
+        fd, tmp = tempfile.mkstemp(dir=cache_dir, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                pickle.dump(menu, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp, cache_file)
+        except BaseException:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+    return menu
@@ -1,20 +1,29 @@
+import contextvars
 import enum
+import functools
+import hashlib
+import inspect
 import json
-import os
 import logging
 import string
+import time
+from collections import deque
 from itertools import count
-from typing import Callable, List, Union
+from types import MappingProxyType
+from typing import Callable, List, Mapping, NamedTuple, Optional, Union
 
-import redis
 from anytree import Node, NodeMixin
 
-from .conf import FormBackError, r, back_symbol, home_symbol, NavigationBackError, config, \
-    NavigationInvalidChoice, ImproperlyConfigured, ConditionEvaluationError, ConditionResultError, rc, TranslationError, \
-    global_var_key
+from .conf import FormBackError, NavigationBackError, NavigationInvalidChoice, ImproperlyConfigured, \
+    ConditionEvaluationError, ConditionResultError, TranslationError, LOG_FORMAT, Settings, settings, setup, \
+    get_redis, pool_stats
+from .codec import StateCodec, JsonCodec, MsgpackCodec, get_state_codec, set_state_codec, encode_state, \
+    decode_state, as_text, HEADER as _CODEC_HEADER
+from .instrumentation import HopMetrics, MeteredSessionStore, Instrumentation, InstrumentationGroup, \
+    PrometheusInstrumentation, OpenTelemetryInstrumentation, get_instrumentation, set_instrumentation, emit as _emit_metrics
+from .store import SessionStore, RedisSessionStore, MemorySessionStore, get_session_store, set_session_store, \
+    encode_value
 
-LOG_FORMAT = '%(asctime)s %(levelname)-6s %(funcName)s (on line %(lineno)-4d) : %(message)s'
-logging.basicConfig(level=logging.INFO, format=LOG_FORMAT)
 universal_logger = logging.getLogger(__name__)
 
 
@@ -29,8 +38,8 @@ class BaseUSSD:
         self.msisdn = msisdn
         self.session_id = session_id
         self.redis_key = f"{self.msisdn}:{self.session_id}"
-        self.redis_global_key =f'GLOBAL:{msisdn}:{session_id}'
-        self.r = redis.Redis(**rc)
+        self.redis_global_key = global_key(msisdn, session_id)
+        self.r = get_redis()
         self.ussd_string = ussd_string
         self.last_input = self.ussd_string.split("*")[-1]
 
@@ -39,52 +48,389 @@ class ShortCutHandler:
     pass
 
 
-def get_var(msisdn, session_id, var):
-    return r.hget(f'{msisdn}:{session_id}', var)
+_active_sessions = contextvars.ContextVar('anysd_active_sessions', default={})
+
+
+class SessionUnitOfWork:
+    def __init__(self, redis_key, store: SessionStore = None):
+        """
+        Buffers every read and write made on one session hash during a single hop.
+
+        The whole hash is read with one `get_all` (`HGETALL`) on first access, mutations are kept in memory, and
+        `flush()` writes them back in one atomic `update` (a `MULTI`/`EXEC` pipeline on redis), so a hop costs two
+        round trips no matter how many variables it touches.
+
+        :param redis_key: the session hash key, `{msisdn}:{session_id}`
+        :param store: [Optional] session store to use. defaults to `get_session_store()`
+        """
+        self.redis_key = redis_key
+        self.store = get_session_store() if store is None else store
+        self.loaded = False
+        self.memo = {}  # values computed once per hop, like ListInput items
+        self.writes = 0  # bumped by every change, so values derived from the session know when to read it again
+        self._data = {}
+        self._changed = {}
+        self._deleted = set()
+
+    def load(self):
+        self._data = self.store.get_all(self.redis_key)
+        self._clear_writes()
+        self.loaded = True
+        return self
+
+    def get(self, field, default=None):
+        if not self.loaded:
+            self.load()
+        return self._data.get(field, default)
+
+    def get_many(self, fields):
+        if not self.loaded:
+            # nothing buffered yet, so only fetch what is asked for
+            return self.store.get_many(self.redis_key, fields)
+        return {field: self._data.get(field) for field in fields}
+
+    def set(self, field, value):
+        self.update({field: value})
+
+    def update(self, mapping: dict):
+        if not self.loaded:
+            self.load()
+        self.writes += 1
+        for field, value in mapping.items():
+            value = encode_value(value)
+            self._data[field] = value
+            self._changed[field] = value
+            self._deleted.discard(field)
+        return len(mapping)
+
+    def delete(self, *fields):
+        if not self.loaded:
+            self.load()
+        self.writes += 1
+        for field in fields:
+            self._data.pop(field, None)
+            self._changed.pop(field, None)
+            self._deleted.add(field)
+
+    @property
+    def dirty(self):
+        return bool(self._changed or self._deleted)
+
+    def _clear_writes(self):
+        self._changed = {}
+        self._deleted = set()
+
+    def flush(self, ttl: int = None):
+        """
+        :param ttl: [Optional] seconds until the session expires, set in the same atomic update as the writes
+        """
+        if not (self.dirty or ttl):
+            return
+        self.store.update(self.redis_key, **self._pending_update(ttl))
+        self._clear_writes()
+
+    def _loaded_with(self, data):
+        self._data = data
+        self._clear_writes()
+        self.loaded = True
+
+    def _pending_update(self, ttl=None):
+        return {'changed': self._changed, 'deleted': self._deleted, 'ttl': ttl}
+
+    @staticmethod
+    def load_all(units):
+        """load several units of work sharing one store, in a single round trip"""
+        for unit, data in zip(units, units[0].store.get_all_many([unit.redis_key for unit in units])):
+            unit._loaded_with(data)
+
+    @staticmethod
+    def flush_all(units, ttl: int = None):
+        """flush several units of work sharing one store, in a single atomic update"""
+        units[0].store.update_many({unit.redis_key: unit._pending_update(ttl) for unit in units})
+        for unit in units:
+            unit._clear_writes()
+
+    def activate(self):
+        """make this unit of work visible to `get_var`, `set_var` and the global variable helpers"""
+        return self.activate_all([self])
+
+    @staticmethod
+    def activate_all(units):
+        sessions = dict(_active_sessions.get())
+        for unit in units:
+            sessions[unit.redis_key] = unit
+        return _active_sessions.set(sessions)
+
+    @staticmethod
+    def deactivate(token):
+        _active_sessions.reset(token)
+
+
+def _active_session(redis_key):
+    return _active_sessions.get().get(redis_key)
+
+
+def get_var(msisdn, session_id, var, decode=False, raw=False):
+    """
+    Structured values (a list input selection, a list or dict from the form state) are returned as JSON text, whichever
+    codec wrote them, so `json.loads(get_var(...))` keeps working when msgpack or compression is turned on
+
+    :param decode: [Optional] return the value of a structured variable instead of its JSON text
+    :param raw: [Optional] return the variable as stored, without going through the codec
+    """
+    session = _active_session(f'{msisdn}:{session_id}')
+    if session is not None:
+        value = session.get(var)
+    else:
+        value = get_session_store().get_many(f'{msisdn}:{session_id}', [var])[var]
+    if raw or value is None:
+        return value
+    if decode:
+        return decode_state(value)
+    return as_text(value)
+
+
+def get_vars(msisdn, session_id, keys, raw=False) -> dict:
+    """
+    several session variables in one read. missing ones are None
+
+    :param raw: [Optional] see `get_var`
+    """
+    session = _active_session(f'{msisdn}:{session_id}')
+    if session is not None:
+        values = session.get_many(keys)
+    else:
+        values = get_session_store().get_many(f'{msisdn}:{session_id}', keys)
+    if raw:
+        return values
+    return {key: as_text(value) for key, value in values.items()}
 
 
 def set_var(msisdn, session_id, data):
-    return r.hset(f'{msisdn}:{session_id}', mapping=data)
+    session = _active_session(f'{msisdn}:{session_id}')
+    if session is not None:
+        return session.update(data)
+    return get_session_store().set_many(f'{msisdn}:{session_id}', data)
+
+# the session variable holding the language `translation_fxn` returned
+language_key = 'USSD_LANGUAGE'
+
+
+def set_language(msisdn, session_id, lang):
+    """
+    change the language of a session, from a validator, hook or callable menu. It applies from the next hop: the
+    current one is rendered in the language it started with
+    """
+    return set_var(msisdn, session_id, {language_key: lang})
+
+
+def reset_language(msisdn, session_id):
+    """forget the language of a session, so `translation_fxn` is called again on the next hop"""
+    session = _active_session(f'{msisdn}:{session_id}')
+    if session is not None:
+        return session.delete(language_key)
+    return get_session_store().delete_many(f'{msisdn}:{session_id}', [language_key])
+
+
+def global_key(msisdn, session_id):
+    """the hash holding global variables. each variable is a field, encoded with the state codec"""
+    return f'GLOBAL:{msisdn}:{session_id}'
+
 
 def set_global_var(msisdn, session_id, data: dict=None, key=None, value=None):
-    redis_key = f'{msisdn}:{session_id}'
+    """
+    set global variables, either several from `data`, or one from `key` and `value`. Only the given variables are
+    written, so concurrent updates of different variables never overwrite each other
+    """
     if data:
         if not isinstance(data, dict): 
             raise ImproperlyConfigured(f'data should be a dictionary. Not a {data.__class__.__name__}')
-    
-    current = r.hget(redis_key, global_var_key) or '{}'
-    current_object = json.loads(current)
-
-    if data:
-        current_object.update(data)
-    
     else:
-        current_object[key] = value
+        data = {key: value}
 
-    r.hset(redis_key, global_var_key, json.dumps(current_object))
-    pass
+    mapping = {k: encode_state(v) for k, v in data.items()}
+    session = _active_session(global_key(msisdn, session_id))
+    if session is not None:
+        return session.update(mapping)
+    return get_session_store().set_many(global_key(msisdn, session_id), mapping)
 
 def get_global_var(msisdn, session_id, key):
+    return get_global_vars(msisdn, session_id, [key])[key]
+
+
+def get_global_vars(msisdn, session_id, keys):
+    """several global variables at once, fetching only the requested ones. missing keys are None"""
+    keys = list(keys)
+    session = _active_session(global_key(msisdn, session_id))
+    if session is not None:
+        stored = session.get_many(keys)
+    else:
+        stored = get_session_store().get_many(global_key(msisdn, session_id), keys)
+    values = {k: decode_state(v) if v is not None else None for k, v in stored.items()}
+
+    missing = [k for k, v in stored.items() if v is None]
+    if missing:
+        # sessions started before global variables had their own hash kept them in one json blob
+        legacy = get_var(msisdn, session_id, settings.global_var_key, raw=True)
+        if legacy:
+            legacy = decode_state(legacy)
+            values.update({k: legacy.get(k) for k in missing})
+    return values
+
+
+# session fields holding values written through the state codec
+_ENCODED_FIELDS = ('PROCESSED_PATH', 'PATH_AS_LIST')
+_ENCODED_PREFIXES = ('USSD_LIST_ITEMS:', 'USSD_CONDITION:')
+# the other fields written through the state codec, named by the menu (list selections, lists and dicts in the form
+# state), as a JSON list. Kept so `migrate_session` can tell them from plain text answers
+_ENCODED_REGISTRY = 'USSD_ENCODED_FIELDS'
+
+
+def _record_encoded(registered: Optional[str], data: dict, encoded) -> dict:
+    """`data`, recording its `encoded` fields in `_ENCODED_REGISTRY`, whose stored value is `registered`"""
+    registered = json.loads(registered) if registered else []
+    new = [field for field in encoded if field not in registered]
+    if not new:
+        return data
+    return {**data, _ENCODED_REGISTRY: json.dumps(registered + new)}
+
+
+def migrate_session(msisdn, session_id, store: SessionStore = None, codec: StateCodec = None) -> int:
+    """
+    rewrite a session written by an older version, or with another codec, in the format of `codec`: navigation paths,
+    cached list items, cached condition results, list selections, lists and dicts in the form state and global
+    variables are re-encoded, and the legacy global variables blob is split into the global variables hash. Reads
+    never need this, every format is decoded transparently
+
+    List selections and form state written before their fields were recorded are only rewritten when they are in a
+    binary format: plain JSON cannot be told apart from text answers. Every codec reads it
+
+    :param store: [Optional] session store. defaults to `get_session_store()`
+    :param codec: [Optional] codec to write with. defaults to `get_state_codec()`
+    :return: number of fields rewritten
+    """
+    store = get_session_store() if store is None else store
+    codec = get_state_codec() if codec is None else codec
+    redis_key, globals_key = f'{msisdn}:{session_id}', global_key(msisdn, session_id)
+    session, stored_globals = store.get_all_many([redis_key, globals_key])
+
+    registered = session.get(_ENCODED_REGISTRY)
+    registered = set(json.loads(registered)) if registered else set()
+    values = {}
+    for field, value in session.items():
+        if field in _ENCODED_FIELDS or field.startswith(_ENCODED_PREFIXES):
+            values[field] = decode_state(value)
+        elif field in registered or value.startswith(_CODEC_HEADER):
+            try:
+                values[field] = decode_state(value)
+            except ValueError:
+                # since overwritten with text, or a text answer that happens to start like an encoded value
+                pass
+    global_vars = {field: decode_state(value) for field, value in stored_globals.items()}
+    deleted = ()
+    legacy = session.get(settings.global_var_key)
+    if legacy:
+        for field, value in decode_state(legacy).items():
+            global_vars.setdefault(field, value)
+        deleted = (settings.global_var_key,)
+
+    def rewritten(decoded, stored):
+        encoded = {field: codec.encode(value) for field, value in decoded.items()}
+        return {field: value for field, value in encoded.items() if value != stored.get(field)}
+
+    updates = {
+        redis_key: {'changed': rewritten(values, session), 'deleted': deleted},
+        globals_key: {'changed': rewritten(global_vars, stored_globals)},
+    }
+    store.update_many(updates)
+    return len(updates[redis_key]['changed']) + len(deleted) + len(updates[globals_key]['changed'])
+
+
+@functools.lru_cache(maxsize=2048)
+def _template_fields(template: str) -> tuple:
+    # responses are mostly the same handful of templates, so they are only parsed once
+    return tuple(tup[1] for tup in string.Formatter().parse(template) if tup[1] is not None)
 
-    current = r.hget(f'{msisdn}:{session_id}', global_var_key)
-    current_object = json.loads(current)
 
-    return current_object.get(key, None)
+class _Call:
+    """
+    A user supplied callable (validator, list source, hook, condition...) the navigation logic wants invoked.
+
+    The `_*_gen` methods yield these instead of calling user code directly, so the same logic can be driven
+    synchronously by `_drive` or from an event loop, awaiting coroutine callables.
+    """
+    __slots__ = ('fxn', 'args', 'kwargs', 'kind')
+
+    def __init__(self, fxn, args, kwargs, kind=None):
+        self.fxn = fxn
+        self.args = args
+        self.kwargs = kwargs
+        self.kind = kind
+
+
+def _call(fxn, *args, **kwargs):
+    return _Call(fxn, args, kwargs)
+
+
+def _callback(kind, fxn, *args, **kwargs):
+    """`_call` for a user callback, timed by instrumentation as `kind`"""
+    return _Call(fxn, args, kwargs, kind)
+
+
+def _drive(gen, metrics: HopMetrics = None):
+    """
+    run a `_*_gen` generator to completion, calling every callable it yields synchronously. user callbacks are timed
+    into `metrics`, if given
+    """
+    try:
+        call = next(gen)
+        while True:
+            try:
+                if metrics is None or call.kind is None:
+                    result = call.fxn(*call.args, **call.kwargs)
+                else:
+                    result = metrics.call(call)
+                if inspect.isawaitable(result):
+                    if inspect.iscoroutine(result):
+                        result.close()
+                    raise ImproperlyConfigured(
+                        f'{call.fxn} returned an awaitable. Use AsyncNavigationController for async callables')
+            except Exception as x:
+                call = gen.throw(x)
+            else:
+                call = gen.send(result)
+    except StopIteration as stop:
+        return stop.value
 
 
 class ListInput:
 
     def __init__(self, items: Union[List, callable], title: Union[dict, str], key=None, idx=None, extra=None,
-                 empty_list_message=None):
+                 empty_list_message=None, cache_in_session=False, cache_ttl=None, cache_key=None, page_size=None,
+                 next_symbol='99', previous_symbol='98', next_text='More', previous_text='Previous'):
         """
         For handling Listable items
 
-        :param items: list of items to be displayed
+        :param items: list of items to be displayed, or a callable returning the list. A callable is called at most
+                      once per request, even though the list is needed to validate, select and display
         :param title: The title to add on the menu
         :param key: [Optional] if the list is a list of `dict` objects, the `value` of the `key` is used from each dict
                     to create the menu
         :param idx: [Optional] if the list is a list of `tuple` or `list` then the idx is the index of element in each `tuple` or `list`
                     used to create the menu
+        :param cache_in_session: [Optional] keep the list returned by `items` in the session, so the list validated on
+                    the next request is the one that was displayed. The items should be json serializable
+        :param cache_ttl: [Optional] seconds the list cached in the session is reused. None reuses it for the whole
+                    session
+        :param cache_key: [Optional] session variable suffix for the cached list, and the page shown. defaults to
+                    the form field name
+        :param page_size: [Optional] show the list `page_size` items at a time, numbered from 1 on every page, with
+                    `next_symbol` and `previous_symbol` to move between pages. The page shown is kept in the session
+        :param next_symbol: [Optional] key for the next page
+        :param previous_symbol: [Optional] key for the previous page
+        :param next_text: [Optional] label of `next_symbol`. a `dict` of translations when the title is translated
+        :param previous_text: [Optional] label of `previous_symbol`. a `dict` of translations when the title is
+                    translated
         """
         self.items = items
         self.title = title
@@ -92,12 +438,160 @@ class ListInput:
         self.idx = idx
         self.extra = extra
         self.empty_list_message = empty_list_message
+        self.cache_in_session = cache_in_session
+        self.cache_ttl = cache_ttl
+        self.cache_key = cache_key
+        if page_size is not None and (not isinstance(page_size, int) or page_size < 1):
+            raise ImproperlyConfigured('page_size should be a positive number or None')
+        self.page_size = page_size
+        self.next_symbol = str(next_symbol)
+        self.previous_symbol = str(previous_symbol)
+        error = self.page_keys_error(page_size, self.next_symbol, self.previous_symbol)
+        if error:
+            raise ImproperlyConfigured(error)
+        self.next_text = next_text
+        self.previous_text = previous_text
+        # the back and home symbols the page keys were last checked against, see `_check_navigation_symbols`
+        self._checked_symbols = None
+
+    @staticmethod
+    def page_keys_error(page_size, next_symbol, previous_symbol, navigation_symbols=()) -> Optional[str]:
+        """
+        why the page keys cannot be told apart from the choices on a page, from each other, or from
+        `navigation_symbols` (the back and home symbols). None if they can
+        """
+        if page_size is None:
+            return None
+        next_symbol, previous_symbol = str(next_symbol), str(previous_symbol)
+        if next_symbol == previous_symbol:
+            return f'next_symbol and previous_symbol should differ, both are {next_symbol!r}'
+        for symbol in (next_symbol, previous_symbol):
+            # page keys are checked first, so an item numbered like one could never be picked
+            if symbol.isdigit() and 1 <= int(symbol) <= page_size:
+                return f'page key {symbol!r} is also the number of an item on a page of {page_size}'
+            # and the back and home symbols before them, so such a page key would never turn a page
+            if symbol in navigation_symbols:
+                return f'page key {symbol!r} is also the back or home symbol'
+        return None
+
+    def _check_navigation_symbols(self):
+        # settings are read on first use, so the page keys are checked against them when the list is used, not built
+        symbols = (settings.back_symbol, settings.home_symbol)
+        if symbols != self._checked_symbols:
+            error = self.page_keys_error(self.page_size, self.next_symbol, self.previous_symbol, symbols)
+            if error:
+                raise ImproperlyConfigured(error)
+            self._checked_symbols = symbols
+
+    def _session_cache_field(self):
+        if self.cache_key is None:
+            raise ImproperlyConfigured('cache_key is required for a ListInput with cache_in_session outside a form')
+        return f'USSD_LIST_ITEMS:{self.cache_key}'
+
+    def _get_cached_items(self, msisdn, session_id, lang):
+        cached = get_var(msisdn, session_id, self._session_cache_field(), raw=True)
+        if not cached:
+            return None
+        try:
+            cached = decode_state(cached)
+        except ValueError:
+            return None
+        if cached.get('lang') != lang:
+            return None
+        if self.cache_ttl is not None and time.time() - cached.get('at', 0) > self.cache_ttl:
+            return None
+        return cached.get('items')
+
+    def _set_cached_items(self, msisdn, session_id, lang, items_list):
+        try:
+            value = encode_state({'at': time.time(), 'lang': lang, 'items': items_list})
+        except (TypeError, ValueError) as x:
+            universal_logger.warning(f'list items for {self.cache_key} cannot be cached in the session: {x}')
+            return
+        set_var(msisdn, session_id, {self._session_cache_field(): value})
+
+    def _items_gen(self, msisdn=None, session_id=None, lang=None, **kwargs):
+        """
+        resolve `self.items`. A callable is called once per request (and session, language) and the result reused
+        for validation, selection and display. With `cache_in_session`, the result is reused across requests
+        """
+        if not callable(self.items):
+            return self.items
+
+        session = _active_session(f'{msisdn}:{session_id}')
+        memo_key = (self, msisdn, session_id, lang)
+        if session is not None and memo_key in session.memo:
+            return session.memo[memo_key]
+
+        items_list = None
+        if self.cache_in_session:
+            items_list = self._get_cached_items(msisdn, session_id, lang)
+
+        if items_list is None:
+            items_list = yield _callback('list_items', self.items, msisdn=msisdn, session_id=session_id, lang=lang, **kwargs)
+            if self.cache_in_session:
+                self._set_cached_items(msisdn, session_id, lang, items_list)
+
+        if session is not None:
+            session.memo[memo_key] = items_list
+        return items_list
+
+    def _page_field(self):
+        if self.cache_key is None:
+            raise ImproperlyConfigured('cache_key is required for a ListInput with page_size outside a form')
+        return f'USSD_LIST_PAGE:{self.cache_key}'
+
+    def is_page_key(self, key) -> bool:
+        """`key` is the next or previous page key of a paginated list"""
+        return self.page_size is not None and key in (self.next_symbol, self.previous_symbol)
+
+    def get_page(self, msisdn, session_id) -> int:
+        """the page shown, counted from 0. Always 0 for a list without `page_size`"""
+        if self.page_size is None:
+            return 0
+        page = get_var(msisdn, session_id, self._page_field(), raw=True)
+        try:
+            return int(page) if page else 0
+        except ValueError:
+            return 0
+
+    def set_page(self, msisdn, session_id, page: int):
+        if self.page_size is not None and page != self.get_page(msisdn, session_id):
+            set_var(msisdn, session_id, {self._page_field(): page})
+
+    def _page_count(self, length):
+        return max(1, -(-length // self.page_size))
+
+    def position(self, idx: int, msisdn=None, session_id=None) -> int:
+        """the position in the whole list, from 1, of the choice `idx` on the page shown"""
+        if self.page_size is None:
+            return idx
+        return self.get_page(msisdn, session_id) * self.page_size + idx
+
+    def _turn_page_gen(self, key, msisdn=None, session_id=None, **kwargs):
+        """
+        show the next or previous page, if `key` is the key for it and there is such a page
+
+        :return: True if the page was turned
+        """
+        if not self.is_page_key(key):
+            return False
+        self._check_navigation_symbols()
+        items_list = yield from self._items_gen(msisdn=msisdn, session_id=session_id, **kwargs)
+        page = self.get_page(msisdn, session_id) + (1 if key == self.next_symbol else -1)
+        if not 0 <= page < self._page_count(len(items_list)):
+            return False
+        self.set_page(msisdn, session_id, page)
+        return True
 
     def get_items(self, lang, msisdn=None, session_id=None, **kwargs):
-        items_list = self.items  # Use a separate variable to avoid modifying self.items
-        if callable(items_list):
-            kwargs.update({'lang': lang})
-            items_list = items_list(msisdn=msisdn, session_id=session_id, **kwargs)
+        return _drive(self._get_items_gen(lang, msisdn=msisdn, session_id=session_id, **kwargs))
+
+    def _get_items_gen(self, lang, msisdn=None, session_id=None, page=None, **kwargs):
+        """
+        the menu of the list. Paginated lists show the page kept in the session, or `page`, which is kept from then on
+        """
+        items_list = yield from self._items_gen(msisdn=msisdn, session_id=session_id, lang=lang, **kwargs)
 
         if not isinstance(items_list, list):
             raise ValueError(f'self.items should be of type list, not {items_list.__class__.__name__}')
@@ -109,70 +603,215 @@ class ListInput:
                 menu = self.empty_list_message
         else:
             if isinstance(items_list[0], (str, int, float)):
-                rsp = '\n'.join([f'{idx}. {str(item)}' for idx, item in enumerate(items_list, start=1)])
-                menu = f'CON {self.title}\n{rsp}'
+                title, label = self.title, str
             elif isinstance(items_list[0], dict):
                 if lang is None:
-                    rsp = '\n'.join([f'{idx}. {item[self.key]}' for idx, item in enumerate(items_list, start=1)])
-                    menu = f'CON {self.title}\n{rsp}'
+                    title, label = self.title, lambda item: item[self.key]
                 else:
-                    rsp = '\n'.join([f'{idx}. {item[self.key][lang]}' for idx, item in enumerate(items_list, start=1)])
-                    menu = f'CON {self.title.get(lang)}\n{rsp}'
+                    title, label = self.title.get(lang), lambda item: item[self.key][lang]
             elif isinstance(items_list[0], list) or isinstance(items_list[0], tuple):
                 if lang is None:
-                    rsp = '\n'.join([f'{idx}. {item[self.idx]}' for idx, item in enumerate(items_list, start=1)])
-                    menu = f'CON {self.title}\n{rsp}'
+                    title, label = self.title, lambda item: item[self.idx]
                 else:
-                    rsp = '\n'.join([f'{idx}. {item[self.idx][lang]}' for idx, item in enumerate(items_list, start=1)])
-                    menu = f'CON {self.title.get(lang)}\n{rsp}'
+                    title, label = self.title.get(lang), lambda item: item[self.idx][lang]
             else:
                 raise ValueError(
                     f'self.items should contain items of type str, dict, list or tuple, not {items_list[0].__class__.__name__}')
 
+            shown, keys = items_list, ''
+            if self.page_size is not None:
+                self._check_navigation_symbols()
+                pages = self._page_count(len(items_list))
+                if page is None:
+                    page = self.get_page(msisdn, session_id)
+                # the list may have shrunk since the page was turned
+                page = min(page, pages - 1)
+                self.set_page(msisdn, session_id, page)
+                # only the items on the page are formatted
+                shown = items_list[page * self.page_size:(page + 1) * self.page_size]
+                if page + 1 < pages:
+                    keys += f'\n{self.next_symbol}. {self._text(self.next_text, lang)}'
+                if page > 0:
+                    keys += f'\n{self.previous_symbol}. {self._text(self.previous_text, lang)}'
+
+            rsp = '\n'.join([f'{idx}. {label(item)}' for idx, item in enumerate(shown, start=1)])
+            menu = f'CON {title}\n{rsp}{keys}'
+
         xtra = '' if self.extra is None else f'\n{self.extra}'
         return f'{menu}{xtra}'
 
+    @staticmethod
+    def _text(text, lang):
+        return text.get(lang) if lang and isinstance(text, dict) else text
+
     def get_item(self, idx, **kwargs):
-        items_list = self.items
+        return _drive(self._get_item_gen(idx, **kwargs))
 
-        # items_list if a fxn, call it to get the list
-        if callable(items_list):
-            items_list = items_list(**kwargs)
+    def _get_item_gen(self, idx, **kwargs):
+        """the item chosen with `idx`, on the page shown, or None"""
+        items_list = yield from self._items_gen(**kwargs)
 
-        if isinstance(idx, int) and 1 <= idx <= len(items_list):
-            return items_list[idx - 1]
+        if isinstance(idx, int) and 1 <= idx <= self._page_length(len(items_list), kwargs.get('msisdn'), kwargs.get('session_id')):
+            return items_list[self.position(idx, kwargs.get('msisdn'), kwargs.get('session_id')) - 1]
 
         return None
 
+    def _page_length(self, length, msisdn, session_id):
+        # how many items the page shown has
+        if self.page_size is None:
+            return length
+        start = self.get_page(msisdn, session_id) * self.page_size
+        return min(self.page_size, max(0, length - start))
+
     def validate(self, key, **kwargs):
+        return _drive(self._validate_gen(key, **kwargs))
+
+    def _validate_gen(self, key, **kwargs):
         try:
             if key is None:
                 return False
             key = int(key)
-            items_list = self.items  # Use the dynamic items_list
-            if callable(items_list):
-                # If items_list is callable, get the list dynamically
-                items_list = items_list(scope='validate', **kwargs)
+            items_list = yield from self._items_gen(scope='validate', **kwargs)
 
-            if key in range(1, len(items_list) + 1):
+            if key in range(1, self._page_length(len(items_list), kwargs.get('msisdn'), kwargs.get('session_id')) + 1):
                 return True
             return False
         except (ValueError, TypeError) as x:
             return False
 
 
+class _FormAnswers:
+    """
+    The answers of a form, read in one go the first time a hop needs them (for `post_call`, then a callable menu) and
+    reused, unless the session was written to in between. List selections are JSON text, as `get_var` returns them
+    """
+    __slots__ = ('keys', 'msisdn', 'session_id', '_values', '_writes')
+
+    def __init__(self, keys: tuple, msisdn, session_id):
+        self.keys = keys
+        self.msisdn = msisdn
+        self.session_id = session_id
+        self._values = None
+        self._writes = None
+
+    def read(self) -> dict:
+        session = _active_session(f'{self.msisdn}:{self.session_id}')
+        writes = session.writes if session is not None else None
+        if self._values is None or writes != self._writes:
+            self._values = get_vars(self.msisdn, self.session_id, self.keys)
+            self._writes = writes
+        return dict(self._values)
+
+
+class StepKind(enum.Enum):
+    TEXT = 'text'
+    TRANSLATED = 'translated'
+    LIST = 'list'
+    CALLABLE = 'callable'
+
+
+class FormStep:
+    """
+    One question of a `FormFlow`, with everything a hop needs worked out once, when the form is built
+
+    - `number`: the step number
+    - `question`: the question dict, as given
+    - `name`: the question name. `field` is the same name, or None if it cannot be used as a session variable
+    - `menu`: what is displayed, and `kind`, the `StepKind` of it
+    - `post_call`: hook called once the answer to this step is accepted, or None
+    - `is_last`: no step follows this one
+    """
+    __slots__ = ('number', 'question', 'name', 'field', 'menu', 'kind', 'post_call', 'is_last')
+
+    def __init__(self, number: int, question: dict, is_last: bool):
+        self.number = number
+        self.question = question
+        self.name = question.get('name')
+        self.field = self.name if self.name and self.name.replace('_', '').isalnum() and \
+            not self.name[0].isnumeric() else None
+        self.menu = question.get('menu')
+        if isinstance(self.menu, ListInput):
+            self.kind = StepKind.LIST
+        elif callable(self.menu):
+            self.kind = StepKind.CALLABLE
+        elif isinstance(self.menu, str):
+            self.kind = StepKind.TEXT
+        else:
+            self.kind = StepKind.TRANSLATED
+        self.post_call = question.get('post_call')
+        self.is_last = is_last
+
+    def __repr__(self):
+        return f'{self.__class__.__name__}({self.number}, {self.name!r}, {self.kind.name})'
+
+
 class FormFlow:
     def __init__(self, form_questions: dict, step_validator: Callable, logger=None):
         self.invalid_input = "CON Invalid input\n{menu}"
-        self.form_questions = form_questions
         self.step_validator = step_validator
         self.logger = universal_logger if logger is None else logger
+        self.form_questions = form_questions
+
+    @property
+    def form_questions(self) -> Mapping:
+        """the questions, read only. Assign new ones to change them"""
+        if self._questions_view is None:
+            self._questions_view = MappingProxyType(
+                {key: MappingProxyType(question) for key, question in self._form_questions.items()})
+        return self._questions_view
+
+    @form_questions.setter
+    def form_questions(self, form_questions: dict):
+        # hops index `steps` by step number, so the questions are compiled whenever they are replaced. They are kept as
+        # a copy, shown read only, so changing them in place fails instead of being ignored
+        form_questions = {key: dict(question) for key, question in form_questions.items()}
+        self._form_questions = form_questions
+        self._questions_view = None
+        questions = {}
+        for key, question in form_questions.items():
+            try:
+                number = int(key)
+            except (TypeError, ValueError):
+                continue
+            if number > 0 and str(number) == str(key):
+                questions[number] = question
+
+        last = max(questions, default=0)
+        steps = [None] * (last + 1)
+        for number, question in sorted(questions.items()):
+            step = steps[number] = FormStep(number, question, number == last)
+            if step.name and step.field is None:
+                self.logger.warning(
+                    f'field_name "{step.name}" is not valid. It should be contain letters, underscores and '
+                    f'numbers, but begin with a letter or underscore')
+            # lists cached in the session, and the page of paginated lists, are stored under their field name, unless
+            # named explicitly
+            if step.kind is StepKind.LIST and (step.menu.cache_in_session or step.menu.page_size is not None) and \
+                    step.menu.cache_key is None:
+                step.menu.cache_key = step.name
+
+        # index 0 is the form's entry, before any question
+        self.steps = tuple(steps)
+        # the fields `post_call` hooks and callable menus receive. closing steps may have no name
+        self.form_keys = tuple(question.get('name') for question in form_questions.values()
+                               if question.get('name') is not None)
+
+    def __getstate__(self):
+        # read only views cannot be pickled. made again on first use
+        state = self.__dict__.copy()
+        state['_questions_view'] = None
+        return state
+
+    def step(self, number: int) -> Optional[FormStep]:
+        """the step `number`, or None if the form has no such step"""
+        if 0 < number < len(self.steps):
+            return self.steps[number]
+        return None
 
     def get_invalid_input(self, menu, lang=None, **kwargs):
         invalid_text = self.invalid_input
         if lang:
-            invalid_config = config.get('strings').get(
-                'invalid_input') if 'strings' in config and 'invalid_input' in config.get('strings') else None
+            invalid_config = settings.invalid_input
             if invalid_config:
                 invalid_text = invalid_config[lang]
         
@@ -181,14 +820,14 @@ class FormFlow:
         return invalid_text.format(menu=menu)
 
     def get_step_type(self, step):
-        try:
-            t = type(self.form_questions[str(step)]['menu'])
-        except KeyError:
-            return None
-        return t
+        step = self.step(int(step))
+        return type(step.menu) if step is not None else None
 
     def get_step_item(self, step):
-        return self.form_questions[str(step)]['menu']
+        _step = self.step(int(step))
+        if _step is None:
+            raise KeyError(str(step))
+        return _step.menu
 
     def call_post_validation(self):
         pass
@@ -198,8 +837,11 @@ class FormFlow:
         validate by using if...else, for all steps in this flow
         :return:
         """
+        return _drive(self._validate_last_input_gen(current_step, last_input, msisdn, session_id, *args, **kwargs))
 
-        _val, _extra_data = self.step_validator(current_step, last_input, msisdn=msisdn, session_id=session_id, *args, **kwargs)
+    def _validate_last_input_gen(self, current_step, last_input, msisdn, session_id, *args, **kwargs):
+        _val, _extra_data = yield _callback(
+            'validator', self.step_validator, current_step, last_input, msisdn=msisdn, session_id=session_id, *args, **kwargs)
         if _val is None or not isinstance(_val, bool):
             self.logger.warning(
                 'Input not validated explicitly by validator function, Default value of True has been used')
@@ -208,26 +850,40 @@ class FormFlow:
         return _val, _extra_data
 
     def gather_form_keys(self):
-        return [self.form_questions[x]['name'] for x in self.form_questions.keys()]
+        return list(self.form_keys)
 
     def _response(self, current_step, last_input, msisdn, session_id, ussd_string, lang):
+        return _drive(self._response_gen(current_step, last_input, msisdn, session_id, ussd_string, lang))
+
+    def _response_gen(self, current_step, last_input, msisdn, session_id, ussd_string, lang):
         skip_validation = False
         valid_last_input = False
 
         _state = {}
+        answers = _FormAnswers(self.form_keys, msisdn, session_id)
 
         # we skip validation, since we are going back, we just display the menu
-        if last_input == back_symbol:
+        if last_input == settings.back_symbol:
             valid_last_input = True
             skip_validation = True
             current_step -= 2
             _state['FORM_STEP'] = current_step
 
+        step = self.step(current_step)
+        # the next and previous page keys of a paginated list show another page of the same step
+        page_turn = False
+        if not skip_validation and step is not None and step.kind is StepKind.LIST:
+            page_turn = yield from step.menu._turn_page_gen(
+                last_input, msisdn=msisdn, session_id=session_id, ussd_string=ussd_string, lang=lang,
+                last_input=last_input, scope='menu')
+            skip_validation = page_turn
+
         if not skip_validation:
+            step_info = step.question.copy() if step is not None else {}
             # validate last input.
-            if self.get_step_type(current_step) == ListInput:
-                list_ref: ListInput = self.get_step_item(current_step)
-                valid_last_input = list_ref.validate(
+            if step is not None and step.kind is StepKind.LIST:
+                list_ref: ListInput = step.menu
+                valid_last_input = yield from list_ref._validate_gen(
                     key=last_input,
                     msisdn=msisdn,
                     session_id=session_id,
@@ -237,8 +893,8 @@ class FormFlow:
                 )
 
                 # handle bs logic
-                _res = self._validate_last_input(
-                    current_step, last_input, msisdn=msisdn, session_id=session_id, step_info=self.form_questions.get(str(current_step), {}).copy())
+                _res = yield from self._validate_last_input_gen(
+                    current_step, last_input, msisdn=msisdn, session_id=session_id, step_info=step_info)
 
                 if isinstance(_res, tuple) and len(_res) == 2:
                     _xtra_data = _res[1]
@@ -249,8 +905,8 @@ class FormFlow:
                         f"response from {self._validate_last_input}() should be a tuple of bool and dict or a dict."
                         f" Not {_res.__class__.__name__}")
             else:
-                valid_last_input, _xtra_data = self._validate_last_input(
-                    current_step, last_input, msisdn=msisdn, session_id=session_id, step_info=self.form_questions.get(str(current_step), {}).copy())
+                valid_last_input, _xtra_data = yield from self._validate_last_input_gen(
+                    current_step, last_input, msisdn=msisdn, session_id=session_id, step_info=step_info)
 
             if _xtra_data is not None:
                 if isinstance(_xtra_data, dict):
@@ -260,129 +916,127 @@ class FormFlow:
                         f'extra_data from validation should be a dict not {_xtra_data.__class__.__name__}')
 
         # if last input is valid, display next menu, otherwise, show invalid input message, and display same menu
-        if valid_last_input:
+        if page_turn:
             _state['USSD_VALID_LAST_INPUT'] = 1
-            if last_input not in [back_symbol, home_symbol] and current_step != 0:
+            name, kind, menu = step.name, step.kind, step.menu
+        elif valid_last_input:
+            _state['USSD_VALID_LAST_INPUT'] = 1
+            answered = step is not None and last_input != settings.back_symbol and last_input != settings.home_symbol
+            if answered and step.field:
                 # setting last input as variable to be saved in redis
-                _field_name: str = self.form_questions.get(str(current_step)).get('name')
-                if _field_name and _field_name.replace("_", "").isalnum() and not _field_name[0].isnumeric():
-                    if self.get_step_type(current_step) == ListInput:
-                        field_value = self.get_step_item(current_step).get_item(
-                            idx=int(last_input),
-                            msisdn=msisdn,
-                            session_id=session_id,
-                            lang=lang,
-                            ussd_string=ussd_string,
-                            last_input=last_input,
-                            scope='select'
-                        )
-                        _state[_field_name] = field_value
-                        _state[f'{_field_name}_VALUE'] = int(last_input) - 1
-                        set_var(msisdn=msisdn, session_id=session_id, data={
-                            _field_name: json.dumps(field_value),
-                            f'{_field_name}_VALUE': int(last_input) - 1
-                        })
-                    else:
-
-                        set_var(msisdn=msisdn, session_id=session_id, data={
-                            _field_name: last_input,
-                            f'{_field_name}_VALUE': last_input
-                        })
-                        _state[_field_name] = last_input
-                        _state[f'{_field_name}_VALUE'] = int(last_input) - 1
+                _field_name = step.field
+                if step.kind is StepKind.LIST:
+                    # choices on a page are numbered from 1: the value is the position in the whole list
+                    index = step.menu.position(int(last_input), msisdn, session_id) - 1
+                    field_value = yield from step.menu._get_item_gen(
+                        idx=int(last_input),
+                        msisdn=msisdn,
+                        session_id=session_id,
+                        lang=lang,
+                        ussd_string=ussd_string,
+                        last_input=last_input,
+                        scope='select'
+                    )
+                    _state[_field_name] = field_value
+                    _state[f'{_field_name}_VALUE'] = index
+                    set_var(msisdn=msisdn, session_id=session_id, data=_record_encoded(
+                        get_var(msisdn, session_id, _ENCODED_REGISTRY, raw=True), {
+                            _field_name: encode_state(field_value),
+                            f'{_field_name}_VALUE': index
+                        }, (_field_name,)))
                 else:
-                    self.logger.warning(
-                        f'field_name "{_field_name}" is not valid. It should be contain letters, underscores and '
-                        f'numbers, but begin with a letter or underscore')
+
+                    set_var(msisdn=msisdn, session_id=session_id, data={
+                        _field_name: last_input,
+                        f'{_field_name}_VALUE': last_input
+                    })
+                    _state[_field_name] = last_input
+                    _state[f'{_field_name}_VALUE'] = int(last_input) - 1
                 # end variable
 
             # call post_validation..
 
-            if current_step != 0 and last_input not in [back_symbol, home_symbol]:
-                q = self.form_questions.get(str(current_step))
-                if q:
-                    post_call = q.get('post_call')
-                    if post_call:
-                        data = {}
-                        for key in self.gather_form_keys():
-                            data[key] = r.hget(f'{msisdn}:{session_id}', key)
-                        data[self.form_questions[str(current_step)]['name']] = last_input
-
-                        f = post_call(msisdn, session_id, ussd_string, data)
-            try:
-
-                resp = self.form_questions[str(current_step + 1)].copy()
-
-                # increment step here
-                if 'FORM_STEP' not in _state or last_input == back_symbol:
-                    # sometimes we might want the ussd app to modify the step to redirect the user to different part
-                    # of the form. in that case, we don't increment here and instead use user-defined step.
-                    # the developer is responsible for setting any other state info needed to make the ussd work with
-                    # the defined step
-                    _state['FORM_STEP'] = current_step + 1
+            if answered and step.post_call:
+                data = answers.read()
+                data[step.name] = last_input
 
-            except ValueError:
-                resp = None
+                f = yield _callback('post_call', step.post_call, msisdn, session_id, ussd_string, data)
 
-            except KeyError or IndexError:
+            next_step = self.step(current_step + 1)
+            if next_step is None:
                 if current_step <= -1:
                     _state['FORM_STEP'] = None
                     raise FormBackError('Cannot go back beyond this point')
-                elif current_step == len(self.form_questions):
-                    msg = 'END Next step not specified'
-                    self.logger.warning(msg[4:])
-                    resp = msg
+                elif step is not None and step.is_last:
+                    self.logger.warning('Next step not specified')
                 else:
-                    msg = 'END Step response not specified'
-                    self.logger.warning(msg[4:])
-                    resp = msg
-                raise
+                    self.logger.warning('Step response not specified')
+                raise KeyError(str(current_step + 1))
+
+            # increment step here
+            if 'FORM_STEP' not in _state or last_input == settings.back_symbol:
+                # sometimes we might want the ussd app to modify the step to redirect the user to different part
+                # of the form. in that case, we don't increment here and instead use user-defined step.
+                # the developer is responsible for setting any other state info needed to make the ussd work with
+                # the defined step
+                _state['FORM_STEP'] = current_step + 1
+            name, kind, menu = next_step.name, next_step.kind, next_step.menu
         else:
             _state['USSD_VALID_LAST_INPUT'] = 0
-            _menu = self.form_questions[str(current_step)]['menu']
-            if isinstance(_menu, ListInput):
-                initial_menu = _menu.get_items(msisdn=msisdn, session_id=session_id, last_input=last_input,
-                                               ussd_string=ussd_string, lang=lang, state=_state, scope='menu')
+            if step is None:
+                raise KeyError(str(current_step))
+            _menu = step.menu
+            if step.kind is StepKind.LIST:
+                initial_menu = yield from _menu._get_items_gen(
+                    msisdn=msisdn, session_id=session_id, last_input=last_input, ussd_string=ussd_string, lang=lang,
+                    state=_state, scope='menu')
                 resp = self.get_invalid_input(menu=initial_menu[4:], lang=lang, state=_state)
-            elif callable(_menu):
-                resp = self.get_invalid_input(menu=_menu(
-                    msisdn=msisdn, session_id=session_id, ussd_string=ussd_string, lang=lang, data={}, state=_state,
-                    scope='menu')[4:], lang=lang)
+            elif step.kind is StepKind.CALLABLE:
+                _invalid_menu = yield _callback(
+                    'menu', _menu, msisdn=msisdn, session_id=session_id, ussd_string=ussd_string, lang=lang, data={},
+                    state=_state, scope='menu')
+                resp = self.get_invalid_input(menu=_invalid_menu[4:], lang=lang)
             else:
                 resp = self.get_invalid_input(menu=_menu, lang=lang, state=_state)
 
-            resp = {'name': 'ERROR', 'menu': resp}
+            name, kind, menu = 'ERROR', StepKind.TEXT, resp
         # start get the response for next menu
-        _state['USSD_RESPONSE_MENU_NAME'] = resp.get('name')
-        if isinstance(resp['menu'], ListInput):
-            resp = resp['menu'].get_items(msisdn=msisdn, session_id=session_id, last_input=last_input,
-                                          ussd_string=ussd_string, lang=lang, state=_state, scope='menu')
-
-        elif callable(resp['menu']):
-            data = {}
-            for key in self.gather_form_keys():
-                data[key] = r.hget(f'{msisdn}:{session_id}', key)
+        _state['USSD_RESPONSE_MENU_NAME'] = name
+        if kind is StepKind.LIST:
+            # a list is shown from its first page, unless the page was just turned
+            resp = yield from menu._get_items_gen(
+                msisdn=msisdn, session_id=session_id, last_input=last_input, ussd_string=ussd_string, lang=lang,
+                state=_state, scope='menu', page=None if page_turn else 0)
+
+        elif kind is StepKind.CALLABLE:
+            data = answers.read()
             if current_step != 0:
-                data[self.form_questions[str(current_step + 1)]['name']] = last_input
+                data[name] = last_input
 
             try:
-                resp = resp['menu'](msisdn=msisdn, session_id=session_id, ussd_string=ussd_string, lang=lang, data=data,
-                                    state=_state, scope='menu')
+                resp = yield _callback('menu', menu, msisdn=msisdn, session_id=session_id,
+                                       ussd_string=ussd_string, lang=lang, data=data, state=_state, scope='menu')
             except TypeError as t:
                 self.logger.warning(t)
                 raise ImproperlyConfigured(
-                    f'The callable{resp["menu"]} should accept arbitrary kwargs')
+                    f'The callable{menu} should accept arbitrary kwargs')
 
-        elif isinstance(resp['menu'], str):
-            resp = resp['menu']
+        elif kind is StepKind.TEXT:
+            resp = menu
+        else:
+            # translated: the language is picked by `get_response`
+            resp = {'name': name, 'menu': menu}
 
         return resp, _state, valid_last_input
 
     def get_response(self, current_step, last_input, msisdn, session_id, ussd_string, lang):
+        return _drive(self._get_response_gen(current_step, last_input, msisdn, session_id, ussd_string, lang))
+
+    def _get_response_gen(self, current_step, last_input, msisdn, session_id, ussd_string, lang):
         if current_step is None:
             current_step = 1
 
-        _resp, state, valid = self._response(
+        _resp, state, valid = yield from self._response_gen(
             current_step=current_step,
             last_input=last_input,
             msisdn=msisdn,
@@ -402,23 +1056,134 @@ class FormFlow:
         return _resp, state, valid
 
 
+_NO_RESULT = object()
+
+
+def _dotted_name(fxn) -> Optional[str]:
+    """`module.qualname` of a module level function or method, None when that does not tell `fxn` apart"""
+    qualname = getattr(fxn, '__qualname__', None)
+    if isinstance(fxn, functools.partial) or not isinstance(qualname, str) or '<' in qualname:
+        return None
+    return f'{fxn.__module__}.{qualname}'
+
+
 class ConditionalFlow:
     def __init__(
             self,
             condition_fxn,
             condition_result_mapping: dict,
-            cache_results=False,
-            logger=None
+            cache_results: Union[bool, str] = False,
+            logger=None,
+            cache_key: Callable = None,
+            cache_ttl: Optional[int] = None,
+            cache_size: Optional[int] = 100_000,
+            cache_name: str = None
     ):
+        """
+        :param condition_fxn: called with `msisdn`, `session_id`, `ussd_string`, `last_input`, `redis_key` and
+                              `redis_conn`. Its result picks the branch from `condition_result_mapping`
+        :param cache_results: [Optional] reuse results instead of calling `condition_fxn` on every request:
+
+                              - `'session'` (or True): the first result is kept in the session, pinning the branch
+                                until the session ends or `invalidate_session()` is called
+                              - `'global'`: results are kept in this process, shared by sessions with the same
+                                `cache_key`, for `cache_ttl` seconds or until `invalidate()` is called
+        :param cache_key: [Optional] for `'global'` caching: called with the same arguments as `condition_fxn`, returns
+                          the key results are shared by. defaults to the msisdn
+        :param cache_ttl: [Optional] for `'global'` caching: seconds a result is reused. None keeps it until evicted
+        :param cache_size: [Optional] for `'global'` caching: number of keys kept, the least recently used is evicted
+        :param cache_name: [Optional] for `'session'` caching: the session variable is `USSD_CONDITION:{cache_name}`.
+                           defaults to the dotted path of `condition_fxn`; set it when one function is used by
+                           conditionals that should not share a result. Required to cache the results of a lambda,
+                           nested function, `functools.partial` or callable instance
+        """
+        if cache_results is True:
+            cache_results = 'session'
+        if cache_results not in (False, None, 'session', 'global'):
+            raise ImproperlyConfigured(f"cache_results should be False, True, 'session' or 'global', "
+                                       f"not {cache_results!r}")
 
         self.condition_fxn = condition_fxn
         self.condition_result_mapping = condition_result_mapping
-        self.cache_result = cache_results
+        self.cache_result = cache_results or None
         self.logger = logger if logger is not None else universal_logger
+        self.cache_key = cache_key
+        self.cache_ttl = cache_ttl
+        self.cache_size = cache_size
+        if cache_name is None and self.cache_result is not None:
+            cache_name = _dotted_name(condition_fxn)
+            if cache_name is None:
+                # lambdas, nested functions, partials and callable instances have no name that is both unique and the
+                # same in every process
+                raise ImproperlyConfigured(f'cache_name is required to cache the results of {condition_fxn!r}')
+        self.cache_name = cache_name
+        self._results = None
+        if self.cache_result == 'global':
+            self._results = MemorySessionStore(max_sessions=cache_size, ttl=cache_ttl)
 
     def __str__(self):
         return f'{self.condition_fxn}'
 
+    def __getstate__(self):
+        # cached results (and their lock) stay in the process
+        state = self.__dict__.copy()
+        state['_results'] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        if self.cache_result == 'global':
+            self._results = MemorySessionStore(max_sessions=self.cache_size, ttl=self.cache_ttl)
+
+    @property
+    def session_field(self):
+        """the session variable holding the result, with `'session'` caching"""
+        return f'USSD_CONDITION:{self.cache_name}'
+
+    def invalidate(self, key=None):
+        """
+        forget results cached with `'global'` caching: the result of one `cache_key`, or all of them. The condition
+        is evaluated again the next time it is reached
+        """
+        if self._results is None:
+            return
+        if key is None:
+            self._results.clear()
+        else:
+            self._results.delete(str(key))
+
+    def invalidate_session(self, msisdn, session_id):
+        """unpin the result kept in a session with `'session'` caching"""
+        session = _active_session(f'{msisdn}:{session_id}')
+        if session is not None:
+            return session.delete(self.session_field)
+        return get_session_store().delete_many(f'{msisdn}:{session_id}', [self.session_field])
+
+    def _cached(self, kwargs, key):
+        if key is None:
+            stored = get_var(kwargs['msisdn'], kwargs['session_id'], self.session_field, raw=True)
+        else:
+            stored = self._results.get_many(key, ['result'])['result']
+        if stored is None:
+            return _NO_RESULT
+        try:
+            result = decode_state(stored)
+            # a result of an older version of the menu is not used
+            return result if result in self.condition_result_mapping else _NO_RESULT
+        except (TypeError, ValueError):
+            return _NO_RESULT
+
+    def _keep(self, result, kwargs, key):
+        try:
+            encoded = encode_state(result)
+        except (TypeError, ValueError) as x:
+            self.logger.warning(f'result of {self} cannot be cached: {x}')
+            return
+        if key is None:
+            set_var(kwargs['msisdn'], kwargs['session_id'], {self.session_field: encoded})
+        else:
+            self._results.update(key, changed={'result': encoded})
+
     def verify_result(self, result):
         if result is None:
             raise ConditionResultError('Condition Evaluation Result is None')
@@ -427,8 +1192,23 @@ class ConditionalFlow:
             raise ConditionResultError(f'Condition Evaluation Result <{result}> not in mapping keys')
 
     def evaluate(self, msisdn, session_id, ussd_string, last_input, redis_key, redis_conn):
+        return _drive(self._evaluate_gen(msisdn, session_id, ussd_string, last_input, redis_key, redis_conn))
+
+    def _evaluate_gen(self, msisdn, session_id, ussd_string, last_input, redis_key, redis_conn):
+        kwargs = key = None
         try:
-            result = self.condition_fxn(
+            if self.cache_result is not None:
+                kwargs = dict(msisdn=msisdn, session_id=session_id, ussd_string=ussd_string, last_input=last_input,
+                              redis_key=redis_key, redis_conn=redis_conn)
+                if self.cache_result == 'global':
+                    key = str(kwargs['msisdn'] if self.cache_key is None else self.cache_key(**kwargs))
+                result = self._cached(kwargs, key)
+                if result is not _NO_RESULT:
+                    return result
+
+            result = yield _callback(
+                'condition',
+                self.condition_fxn,
                 msisdn=msisdn,
                 session_id=session_id,
                 ussd_string=ussd_string,
@@ -442,35 +1222,55 @@ class ConditionalFlow:
         except Exception as x:
             self.logger.exception(x)
             raise ConditionEvaluationError('Error when evaluating conditional function')
+        if kwargs is not None:
+            self._keep(result, kwargs, key)
         return result
 
     def get_menu(self, msisdn, session_id, ussd_string, last_input, redis_key, redis_conn):
-        result = self.evaluate(msisdn, session_id, ussd_string, last_input, redis_key, redis_conn)
+        return _drive(self._get_menu_gen(msisdn, session_id, ussd_string, last_input, redis_key, redis_conn))
+
+    def _get_menu_gen(self, msisdn, session_id, ussd_string, last_input, redis_key, redis_conn):
+        result = yield from self._evaluate_gen(msisdn, session_id, ussd_string, last_input, redis_key, redis_conn)
 
         menu = self.condition_result_mapping.get(result)
 
         return menu
 
 
+class MenuResult(NamedTuple):
+    """
+    What rendering a `NavigationMenu` produced for one request. The menu tree is shared by every request, so results
+    are returned, never stored on the nodes
+    """
+    menu_string: Union[str, dict]
+    form_state: Optional[dict]
+    valid_last_input: Optional[bool]
+
+
 class NavigationMenu(Node, NodeMixin):
     _ids = count(0)
+    # bumped whenever a menu is attached or detached anywhere, which invalidates every cached `root_path`
+    _mutations = 0
 
     def __init__(self, name="", title: Union[str, dict] = None, show_title: bool = True, next_form=None, **kwargs):
+        self._menu_cache = {}
+        self._child_count = 0
+        self._child_positions = None
+        self._root_path = None
         super().__init__(name, **kwargs)
         self.next_form = next_form
         self.title = title
         self.show_title = show_title
         self.id = next(self._ids)
         self._generate_id()
-        self.form_state = None
-        self.valid_last_input = None
         self.label = self.id,
-        self.menu_string = ""
-        self.menu_string += "" if self.parent is None else f"\n{back_symbol}: BACK  {home_symbol}: MAIN MENU"
 
         self.all_ids = next(self._ids)
 
     def _generate_menu(self, last_input, msisdn, session_id, ussd_string, lang, step=None, ):
+        return _drive(self._generate_menu_gen(last_input, msisdn, session_id, ussd_string, lang, step=step))
+
+    def _generate_menu_gen(self, last_input, msisdn, session_id, ussd_string, lang, step=None, ):
         if len(self.children) == 0 and self.next_form is not None:
             # form variable is set but it is not a FormFlow class
             if not isinstance(self.next_form, FormFlow):
@@ -479,134 +1279,452 @@ class NavigationMenu(Node, NodeMixin):
 
             # Here means this Node has no children but has next_form set
 
-            _message, _state, valid = getattr(
-                self.next_form, 'get_response')(step, last_input, msisdn, session_id, ussd_string, lang)
-            self.menu_string = _message
-            self.form_state = _state
-            self.valid_last_input = valid
+            _message, _state, valid = yield from self.next_form._get_response_gen(
+                step, last_input, msisdn, session_id, ussd_string, lang)
+            return MenuResult(_message, _state, valid)
 
         # Node has no children and no form to call
         elif len(self.children) == 0:
             raise ValueError("Either children or next_form should be set to define next action")
 
         else:
-            self.form_state = {'FORM_STEP': None, 'USSD_RESPONSE_MENU_NAME': f"{self.name}".upper()}
-            if last_input == back_symbol:
+            form_state = {'FORM_STEP': None, 'USSD_RESPONSE_MENU_NAME': f"{self.name}".upper()}
+            if last_input == settings.back_symbol:
                 raise NavigationBackError('We are at home')
 
             # Navigating through nodes. Here it means we are at a node which has children. so we will display the
             # children as menu
-            self.menu_string = "CON "
-            menu_children_display_strings = []
-            for child in self.children:
-                if lang is None:
-                    menu_children_display_strings.append(f"{child.id}. {child.title}")
-                else:
-                    if isinstance(self.title, dict):
-                        translation_text = child.title.get(lang)
-                        if translation_text is not None:
-                            menu_children_display_strings.append(f"{child.id}. {translation_text}")
-                        else:
-                            raise TranslationError(f"Translation for language {lang} was not found")
-                    else:
-                        raise TranslationError(
-                            f"When translation is enabled, `title` should be of type dict. not {self.title.__class__}")
-            if isinstance(self.title, dict):
-                self.menu_string = f"CON {self.title.get(lang)}\n" + "\n".join(menu_children_display_strings)
-            else:
-                self.menu_string = "CON {self.title}:\n" + "\n".join(menu_children_display_strings)
+            return MenuResult(self._render_children(lang), form_state, None)
         # if self.show_title: self.menu_string = f'{self.title}\n{self.menu_string[4:] if self.menu_string[0:2] in [
         # "CON", "END"] else self.menu_string}'
 
+    @property
+    def title(self):
+        return self._title
+
+    @title.setter
+    def title(self, value):
+        self._title = value
+        self.invalidate_menu_cache()
+        if isinstance(self.parent, NavigationMenu):
+            self.parent.invalidate_menu_cache()
+
+    def invalidate_menu_cache(self):
+        """
+        drop the rendered children listings. Called automatically when children are attached or detached and when a
+        title is replaced; call it yourself after changing a title dict in place
+        """
+        self._menu_cache.clear()
+
+    def _post_attach(self, parent):
+        self._structure_changed(parent, 1)
+
+    def _post_detach(self, parent):
+        self._structure_changed(parent, -1)
+
+    @staticmethod
+    def _structure_changed(parent, added):
+        NavigationMenu._mutations += 1
+        # a menu can hang from a plain anytree node, which has none of this
+        if isinstance(parent, NavigationMenu):
+            parent.invalidate_menu_cache()
+            parent._child_count += added
+            parent._child_positions = None
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        # keyed on object ids and on this process' mutation counter, so rebuilt after unpickling
+        state['_child_positions'] = None
+        state['_root_path'] = None
+        return state
+
+    @property
+    def position(self) -> Optional[int]:
+        """1 based position among the parent's children, i.e. the choice that selects this menu. None for the root"""
+        parent = self.parent
+        if parent is None:
+            return None
+        if not isinstance(parent, NavigationMenu):
+            return parent.children.index(self) + 1
+        positions = parent._child_positions
+        if positions is None:
+            positions = parent._child_positions = {id(child): n for n, child in enumerate(parent.children, 1)}
+        return positions[id(self)]
+
+    @property
+    def root_path(self) -> tuple:
+        """positions from the root down to this menu, i.e. the choices that lead to it. Empty for the root"""
+        cached = self._root_path
+        if cached is not None and cached[0] == NavigationMenu._mutations:
+            return cached[1]
+        parent = self.parent
+        path = () if parent is None else _root_path(parent) + (self.position,)
+        # plain anytree nodes do not report being attached or detached, so paths through them are worked out every time
+        self._root_path = (NavigationMenu._mutations, path) if all(
+            isinstance(node, NavigationMenu) for node in self.ancestors) else None
+        return path
+
+    def _render_children(self, lang):
+        # the children listing never changes for a given node and language, so it is rendered once per language
+        try:
+            return self._menu_cache[lang]
+        except KeyError:
+            pass
+
+        menu_children_display_strings = []
+        for child in self.children:
+            if lang is None:
+                menu_children_display_strings.append(f"{child.id}. {child.title}")
+            else:
+                if isinstance(self.title, dict):
+                    translation_text = child.title.get(lang)
+                    if translation_text is not None:
+                        menu_children_display_strings.append(f"{child.id}. {translation_text}")
+                    else:
+                        raise TranslationError(f"Translation for language {lang} was not found")
+                else:
+                    raise TranslationError(
+                        f"When translation is enabled, `title` should be of type dict. not {self.title.__class__}")
+        if isinstance(self.title, dict):
+            menu_string = f"CON {self.title.get(lang)}\n" + "\n".join(menu_children_display_strings)
+        else:
+            menu_string = f"CON {self.title}:\n" + "\n".join(menu_children_display_strings)
+
+        self._menu_cache[lang] = menu_string
+        return menu_string
+
     def get_menu(self, last_input, msisdn, session_id, ussd_string, step=None, lang=None):
-        self._generate_menu(
+        return _drive(self._get_menu_gen(last_input, msisdn, session_id, ussd_string, step=step, lang=lang))
+
+    def _get_menu_gen(self, last_input, msisdn, session_id, ussd_string, step=None, lang=None):
+        return (yield from self._generate_menu_gen(
             last_input=last_input,
             msisdn=msisdn,
             session_id=session_id,
             ussd_string=ussd_string,
             lang=lang,
             step=step
-        )
-        return self.menu_string, self.form_state, self.valid_last_input
+        ))
 
     def _generate_id(self):
-        if self.parent is not None:
-            _children = self.parent.children
-            self.id = len(_children)
+        if isinstance(self.parent, NavigationMenu):
+            self.id = self.parent._child_count
+        elif self.parent is not None:
+            self.id = len(self.parent.children)
+
+
+def _root_path(node) -> tuple:
+    """`NavigationMenu.root_path` of any node of a menu tree, including plain anytree nodes"""
+    if isinstance(node, NavigationMenu):
+        return node.root_path
+    parent = node.parent
+    if parent is None:
+        return ()
+    return _root_path(parent) + (parent.children.index(node) + 1,)
+
+
+class CompiledMenu:
+    __slots__ = ('nodes', 'parents', 'titles', 'forms', 'conditions', 'branches', 'child_offsets', 'child_counts',
+                 'children', 'depths', 'guarded', 'version', '_index')
+
+    def __init__(self, home: Union[NavigationMenu, ConditionalFlow]):
+        """
+        Immutable, index addressed routing table built from a navigation tree. Use `compile_menu()` to build one.
+
+        Every `NavigationMenu` and `ConditionalFlow` reachable from `home` gets an integer id (`home` is 0). For each
+        id the table holds the node, its parent id, its title, its `FormFlow` and the offset and count of its
+        children in the flat `children` tuple. `ConditionalFlow` entries hold the ids each condition result maps to.
+
+        `depths` is the number of choices that lead from `home` to a node, and `guarded` tells whether a
+        `ConditionalFlow` is on the way. `version` identifies the structure of the menu, so ids stored in a session by
+        one process can be used by another one running the same menu.
+
+        :param home: the navigation root, as passed to `NavigationController`
+        """
+        nodes, parents, kids, depths, guarded = [], [], [], [], []
+        index = {}
+
+        # first pass: number every node breadth first, so a node's id is known before its parent is flattened
+        queue = deque([(home, -1)])
+        while queue:
+            node, parent = queue.popleft()
+            if id(node) in index:
+                # a conditional branch pointing at a node reachable through another route
+                continue
+            index[id(node)] = len(nodes)
+            nodes.append(node)
+            parents.append(parent)
+            if parent < 0:
+                depths.append(0)
+                guarded.append(isinstance(node, ConditionalFlow))
+            else:
+                # a conditional redirects without consuming a choice
+                depths.append(depths[parent] + (0 if isinstance(nodes[parent], ConditionalFlow) else 1))
+                guarded.append(guarded[parent] or isinstance(node, ConditionalFlow))
+            if isinstance(node, ConditionalFlow):
+                _kids = list(node.condition_result_mapping.values())
+            elif isinstance(node, NavigationMenu):
+                _kids = list(node.children)
+            else:
+                raise ImproperlyConfigured(
+                    f'navigation can only contain NavigationMenu and ConditionalFlow, not {node.__class__.__name__}')
+            kids.append(_kids)
+            queue.extend((kid, index[id(node)]) for kid in _kids)
+
+        # conditionals caching their results in the session each need a session variable of their own
+        cache_names = {}
+        for node in nodes:
+            if isinstance(node, ConditionalFlow) and node.cache_result is not None:
+                other = cache_names.setdefault(node.cache_name, node)
+                if other is not node:
+                    raise ImproperlyConfigured(
+                        f'conditionals {other} and {node} both cache results as {node.cache_name!r}. '
+                        f'Give each a cache_name of its own')
+
+        # second pass: flatten
+        children, child_offsets, child_counts, branches = [], [], [], []
+        for node, _kids in zip(nodes, kids):
+            if isinstance(node, ConditionalFlow):
+                branches.append(MappingProxyType(
+                    {result: index[id(menu)] for result, menu in node.condition_result_mapping.items()}))
+                child_offsets.append(len(children))
+                child_counts.append(0)
+            else:
+                branches.append(None)
+                child_offsets.append(len(children))
+                child_counts.append(len(_kids))
+                children.extend(index[id(kid)] for kid in _kids)
+
+        _set = super().__setattr__
+        _set('nodes', tuple(nodes))
+        _set('parents', tuple(parents))
+        _set('titles', tuple(getattr(node, 'title', None) for node in nodes))
+        _set('forms', tuple(getattr(node, 'next_form', None) for node in nodes))
+        _set('conditions', tuple(node if isinstance(node, ConditionalFlow) else None for node in nodes))
+        _set('branches', tuple(branches))
+        _set('child_offsets', tuple(child_offsets))
+        _set('child_counts', tuple(child_counts))
+        _set('children', tuple(children))
+        _set('depths', tuple(depths))
+        _set('guarded', tuple(guarded))
+        structure = [(node.__class__.__name__, getattr(node, 'name', None)) for node in nodes]
+        structure += [parents, child_counts, children, [dict(b) if b is not None else None for b in branches]]
+        _set('version', hashlib.sha1(repr(structure).encode()).hexdigest()[:16])
+        _set('_index', MappingProxyType(index))
+
+    def __setattr__(self, key, value):
+        raise AttributeError(f'{self.__class__.__name__} is immutable. Compile the menu again instead')
+
+    def __reduce__(self):
+        # the table is indexed by object ids, which do not survive pickling: pickle the tree and compile it again
+        return self.__class__, (self.home,)
+
+    def __len__(self):
+        return len(self.nodes)
+
+    @property
+    def home(self):
+        return self.nodes[0]
+
+    def index_of(self, node):
+        """id of `node` in this table"""
+        try:
+            return self._index[id(node)]
+        except KeyError:
+            raise ValueError(f'{node} is not part of this compiled menu')
+
+    def resolve(self, path: list, **kwargs):
+        """same as `NavigationController.path_navigator`, using the table instead of walking the tree"""
+        return _drive(self._resolve_gen(path, **kwargs))
+
+    def checkpoint(self, node_id: int, path: list) -> Optional[str]:
+        """
+        serialized position of `node_id`, reached by resolving `path`, for `resume()` on the next request. None when a
+        condition led to the node, since conditions have to be evaluated again on every request (`cache_results` makes
+        that a lookup)
+        """
+        if self.guarded[node_id]:
+            return None
+        return json.dumps([self.version, node_id, path[:self.depths[node_id]]])
+
+    def resume(self, checkpoint: Optional[str], path: list):
+        """
+        where resolving `path` can start from, given the `checkpoint()` of an earlier resolution: the node itself, or
+        the ancestor `path` goes back to. Conditions are never skipped, see `checkpoint()`
+
+        :return: (node id, number of choices of `path` already consumed). (0, 0) to resolve from `home`
+        """
+        if not checkpoint:
+            return 0, 0
+        try:
+            version, node_id, choices = json.loads(checkpoint)
+        except (ValueError, TypeError):
+            return 0, 0
+        if version != self.version or not isinstance(node_id, int) or not 0 <= node_id < len(self.nodes) \
+                or self.guarded[node_id]:
+            return 0, 0
+
+        depths, parents = self.depths, self.parents
+        # back symbols shortened the path: climb to the ancestor it now points to
+        while depths[node_id] > len(path):
+            node_id = parents[node_id]
+        depth = depths[node_id]
+        if path[:depth] != choices[:depth]:
+            return 0, 0
+        return node_id, depth
+
+    def _resolve_gen(self, path: list, **kwargs):
+        return self.nodes[(yield from self._resolve_id_gen(path, **kwargs))]
+
+    def _resolve_id_gen(self, path: list, start: int = 0, position: int = 0, **kwargs):
+        conditions, branches, counts, offsets, children = \
+            self.conditions, self.branches, self.child_counts, self.child_offsets, self.children
+        node_id = start
+        while True:
+            condition = conditions[node_id]
+            if condition is not None:
+                result = yield from condition._evaluate_gen(**kwargs)
+                node_id = branches[node_id][result]
+                continue
+
+            if position == len(path):
+                return node_id
+
+            count = counts[node_id]
+            if not count:
+                return node_id
+
+            choice = path[position]
+            position += 1
+            try:
+                choice = int(choice) - 1
+            except ValueError:
+                raise NavigationInvalidChoice('Invalid selection')
+            # same bounds as indexing the anytree children tuple
+            if not -count <= choice < count:
+                raise NavigationInvalidChoice('Invalid selection')
+            node_id = children[offsets[node_id] + choice % count]
+
+
+def compile_menu(home: Union[NavigationMenu, ConditionalFlow]) -> CompiledMenu:
+    """
+    Freeze a navigation tree into a `CompiledMenu`, which `NavigationController` resolves paths against iteratively
+    instead of walking the tree on every hop. Compile again after changing the tree.
+    """
+    return CompiledMenu(home)
+
+
+class ReloadableMenu:
+    def __init__(self, home: Union[NavigationMenu, ConditionalFlow]):
+        """
+        Holds the `CompiledMenu` used by running controllers, so a new menu can be swapped in without a restart.
+        Each `NavigationController` uses the table that was current when it was created.
+        """
+        self.compiled = compile_menu(home)
+
+    def reload(self, home: Union[NavigationMenu, ConditionalFlow]):
+        compiled = compile_menu(home)
+        self.compiled = compiled
+        return compiled
 
 
 class NavigationController(BaseUSSD):
     def __init__(
             self,
-            home_menu: NavigationMenu,
+            home_menu: Union[NavigationMenu, ConditionalFlow, CompiledMenu, ReloadableMenu],
             msisdn,
             session_id,
             ussd_string,
             enable_translation,
             get_translation_fxn,
-            logger=None
+            logger=None,
+            store: SessionStore = None,
+            instrumentation: Union[Instrumentation, Callable] = None
     ):
+        """
+        :param store: [Optional] session store. defaults to `get_session_store()`
+        :param instrumentation: [Optional] receives the `HopMetrics` of `navigate()`. defaults to
+                                `get_instrumentation()`. Nothing is measured when there is none
+        """
 
         super().__init__(msisdn, session_id, ussd_string)
+        if isinstance(home_menu, ReloadableMenu):
+            # pin the table for the whole hop, even if it is reloaded meanwhile
+            home_menu = home_menu.compiled
         self.home_menu = home_menu
         self.enable_translation = enable_translation
         self.translation_fxn = get_translation_fxn
         self.logger = logger if logger is not None else universal_logger
+        self.instrumentation = get_instrumentation() if instrumentation is None else instrumentation
+        self.metrics = None
+        if self.instrumentation is not None:
+            self.metrics = HopMetrics(msisdn, session_id, ussd_string)
+        store = self._metered(get_session_store() if store is None else store)
+        self.session = SessionUnitOfWork(self.redis_key, store)
+        self.globals = SessionUnitOfWork(self.redis_global_key, store)
+        self.session_ttl = settings.session_ttl
+        self.completed_session_ttl = settings.completed_session_ttl
         if self.enable_translation:
             if self.translation_fxn is None:
                 raise TranslationError('get_translation_fxn is required if enable_transactions is set to True')
 
+    def _metered(self, store):
+        if self.metrics is None:
+            return store
+        return MeteredSessionStore(store, self.metrics)
+
+    def _report(self, response=None, error=None):
+        self.metrics.finish(response, error)
+        _emit_metrics(self.instrumentation, self.metrics)
+
     def _path_process(self, path_as_list: list = None, index=1):
         """
+        Reduce a list of inputs to the path of choices from the home menu, applying back and home symbols.
+
+        Single pass over the inputs: choices are pushed on a stack, a back symbol pops the last choice, and a home
+        symbol discards everything before it. A back or home symbol with no choice before it resets the path.
 
-                :param path_as_list:
-                :param index:
-                :return:
-                """
+        :param path_as_list: inputs, in the order they were entered. defaults to the session's `PATH_AS_LIST`
+        :param index: number of leading inputs already reduced, which are kept as they are
+        :return: reduced path
+        """
 
         path = path_as_list
         if path is None:
-            path = json.loads(r.hget(self.redis_key, 'PATH_AS_LIST'))
-
-        if path and path[0] in [str(back_symbol), str(home_symbol)]:
-            return []
-
-        if len(path) == 1:
-            # only one path and is not 0, just return it
-            return path
-
-        if index + 1 > len(path):
-            # reached the end of list, nothing beyond to compare
-            return path
-
-        if path[index] == str(back_symbol):
-            path.pop(index)
-            path.pop(index - 1)
-
-            if len(path) > index - 1:
-                return self._path_process(path, index - 1)
-
-        elif path[index] == str(home_symbol):
-            for i in range(index + 1):
-                path.pop(0)
-
-            if len(path) > 1:
-                return self._path_process(path, index=1)
-        else:
-            return self._path_process(path, index + 1)
-
-        return path
+            path = decode_state(self.session.get('PATH_AS_LIST'))
+
+        back, home = settings.back_symbol, settings.home_symbol
+        stack = path[:index]
+        position = index
+        length = len(path)
+
+        while True:
+            first = stack[0] if stack else (path[position] if position < length else None)
+            if first == back or first == home:
+                return []
+
+            if position >= length:
+                return stack
+
+            token = path[position]
+            position += 1
+            if token == back:
+                stack.pop()
+            elif token == home:
+                remainder = path[position:]
+                if len(remainder) <= 1:
+                    return remainder
+                stack = [remainder[0]]
+                position += 1
+            else:
+                stack.append(token)
 
     def path_to_list(self, start: NavigationMenu, path=None):
 
         if path is None:
             path = []
-        if start.parent is None:
-            return path
-        else:
-            path.insert(0, start.parent.children.index(start) + 1)
-            start = start.parent
-            return self.path_to_list(start, path)
+        path[:0] = start.root_path
+        return path
 
     def path_processor(self, path_as_list: list = None, index=1, offset: int = None):
         if offset is None:
@@ -619,12 +1737,18 @@ class NavigationController(BaseUSSD):
         return processed_path
 
     def path_navigator(self, start: NavigationMenu, path: list, **kwargs):
+        return _drive(self._path_navigator_gen(start, path, **kwargs))
+
+    def _path_navigator_gen(self, start: NavigationMenu, path: list, **kwargs):
+        if isinstance(start, CompiledMenu):
+            return (yield from start._resolve_gen(path, **kwargs))
+
         if len(path) == 0 and isinstance(start, NavigationMenu):
             return start
 
         if isinstance(start, ConditionalFlow):
-            start = start.get_menu(**kwargs)
-            return self.path_navigator(start, path, **kwargs)
+            start = yield from start._get_menu_gen(**kwargs)
+            return (yield from self._path_navigator_gen(start, path, **kwargs))
 
         idx = path.pop(0)
         if start.children:
@@ -636,7 +1760,39 @@ class NavigationController(BaseUSSD):
         else:
             return start
 
-        return self.path_navigator(child, path, **kwargs)
+        return (yield from self._path_navigator_gen(child, path, **kwargs))
+
+    def _reduced_prefix(self, path: list) -> int:
+        """
+        number of leading inputs of `path` that reducing it would leave as they are. The stored path is already reduced,
+        so unless it holds a back or home symbol, only the newest input has to be applied
+        """
+        prefix = len(path) - 1
+        if prefix > 1:
+            head = path[:prefix]
+            if settings.back_symbol not in head and settings.home_symbol not in head:
+                return prefix
+        return 1
+
+    def _resolve_path_gen(self, path: list, **kwargs):
+        """
+        menu `path` points to. With a compiled menu, resolution continues from the node the previous request resolved
+        to (kept in the session as `USSD_NODE`), so each request only applies its own input
+        """
+        menu = self.home_menu
+        if not isinstance(menu, CompiledMenu):
+            return (yield from self._path_navigator_gen(menu, path.copy(), **kwargs))
+
+        start, position = menu.resume(self.session.get('USSD_NODE'), path)
+        node_id = yield from menu._resolve_id_gen(path, start, position, **kwargs)
+        checkpoint = menu.checkpoint(node_id, path)
+        stored = self.session.get('USSD_NODE')
+        if checkpoint is None:
+            if stored is not None:
+                self.session.delete('USSD_NODE')
+        elif checkpoint != stored:
+            self.session.set('USSD_NODE', checkpoint)
+        return menu.nodes[node_id]
 
     def _redis_processing(self, state: dict):
         if state is None:
@@ -645,35 +1801,100 @@ class NavigationController(BaseUSSD):
         del_keys = [key for key in state.keys() if state[key] is None]
         other_keys = [key for key in state.keys() if state[key] is not None]
         if del_keys:
-            r.hdel(self.redis_key, *del_keys)
+            self.session.delete(*del_keys)
 
         if other_keys:
+            encoded = {}
             for key in other_keys:
                 if type(state[key]) in [str, int, bytes, float]:
-                    r.hset(self.redis_key, key, state[key])
+                    self.session.set(key, state[key])
                 elif type(state[key]) in [dict, tuple, list]:
                     try:
-                        r.hset(self.redis_key, key, json.dumps(state[key]))
+                        encoded[key] = encode_state(state[key])
                     except Exception as e:
                         self.logger.warning('Error saving state data to redis: ')
                         self.logger.warning(e)
                 else:
                     self.logger.warning(f"cannot save data of type {state[key].__class__.__name__} to redis")
+            if encoded:
+                self.session.update(_record_encoded(self.session.get(_ENCODED_REGISTRY), encoded, encoded))
 
     def get_language(self):
+        return _drive(self._get_language_gen())
+
+    def _get_language_gen(self):
+        """
+        `translation_fxn` is only called for the first hop of a session: the language it returns is kept in the session
+        and reused, until `set_language()` or `reset_language()` changes it
+        """
         if self.enable_translation:
-            lang = self.translation_fxn(msisdn=self.msisdn, session_id=self.session_id, ussd_string=self.ussd_string)
+            lang = self.session.get(language_key)
+            if lang:
+                return lang
+            lang = yield _callback(
+                'translation', self.translation_fxn, msisdn=self.msisdn, session_id=self.session_id, ussd_string=self.ussd_string)
             if not lang:
                 raise TranslationError(
                     f'{self.translation_fxn} did not return a language. It returned {lang.__class__.__name__}')
+            self.session.set(language_key, lang)
             return lang
 
     def navigate(self, offset=None):
-        step = r.hget(self.redis_key, 'FORM_STEP')
+        """
+        Resolve the response for this hop.
+
+        The session and global variable hashes are loaded together at the start, every change made during the hop
+        (including `set_var` and `set_global_var` calls from validators and hooks) is buffered, then written back in
+        one pipeline.
+        """
+        metrics = self.metrics
+        if metrics is not None:
+            metrics.mark('load')
+        units = (self.session, self.globals)
+        try:
+            SessionUnitOfWork.load_all(units)
+            resp = self._resolve(offset)
+            SessionUnitOfWork.flush_all(units, ttl=self.get_session_ttl(resp))
+        except Exception as e:
+            if metrics is not None:
+                self._report(error=e)
+            raise
+        if metrics is not None:
+            self._report(resp)
+        return resp
+
+    def _resolve(self, offset=None):
+        """the response of this hop, once the session is loaded. Changes stay buffered until flushed"""
+        token = SessionUnitOfWork.activate_all((self.session, self.globals))
+        try:
+            resp = _drive(self._navigate_gen(offset), self.metrics)
+        finally:
+            SessionUnitOfWork.deactivate(token)
+        if self.metrics is not None:
+            self.metrics.mark('flush')
+        return resp
+
+    def _pending_updates(self, resp) -> dict:
+        ttl = self.get_session_ttl(resp)
+        return {unit.redis_key: unit._pending_update(ttl) for unit in (self.session, self.globals)}
+
+    def _discard(self):
+        # a failed hop leaves the session as it was
+        for unit in (self.session, self.globals):
+            unit._clear_writes()
+
+    def get_session_ttl(self, resp):
+        """seconds the session should live after this hop. `completed_session_ttl` applies once the session ended"""
+        if self.completed_session_ttl and isinstance(resp, str) and resp.startswith('END'):
+            return self.completed_session_ttl
+        return self.session_ttl
+
+    def _navigate_gen(self, offset=None):
+        step = self.session.get('FORM_STEP')
         step = int(step) if step is not None else 0
         last_input = self.ussd_string.split("*")[-1]
 
-        processed_path = self.get_processed_path()
+        processed_path = yield _call(self.get_processed_path)
         # processed_path = self.ussd_string.split("*") if self.ussd_string else []
 
         # append current input to processed_path
@@ -683,8 +1904,12 @@ class NavigationController(BaseUSSD):
         if last_input:
             processed_path.append(last_input)
 
+        metrics = self.metrics
+
         def _menu(path, add_last_input=True, offset=None):
-            pro_path = self.path_processor(path.copy(), offset=offset)
+            if metrics is not None:
+                metrics.mark('resolve')
+            pro_path = self.path_processor(path.copy(), index=self._reduced_prefix(path), offset=offset)
             self.logger.debug(f"PROCESSED_PATH: {pro_path}")
 
             data = {
@@ -693,14 +1918,15 @@ class NavigationController(BaseUSSD):
                 'ussd_string': self.ussd_string,
                 'last_input': self.last_input,
                 'redis_key': self.redis_key,
-                'redis_conn': r
+                'redis_conn': self.r
             }
-            _menu_ref = self.path_navigator(self.home_menu, pro_path.copy(), **data)
-            r.hset(self.redis_key, 'PROCESSED_PATH', json.dumps(pro_path))
-            r.hset(self.redis_key, 'USSD_VALID_LAST_INPUT', 1)
+            _menu_ref = yield from self._resolve_path_gen(pro_path, **data)
+            self.session.update({'PROCESSED_PATH': encode_state(pro_path), 'USSD_VALID_LAST_INPUT': 1})
 
-            lang = self.get_language()
-            _resp, _state, valid_input, = getattr(_menu_ref, 'get_menu')(
+            if metrics is not None:
+                metrics.mark('menu')
+            lang = yield from self._get_language_gen()
+            _resp, _state, valid_input, = yield from _menu_ref._get_menu_gen(
                 last_input if add_last_input else None,
                 self.msisdn,
                 self.session_id,
@@ -710,49 +1936,51 @@ class NavigationController(BaseUSSD):
             )
 
             if valid_input is not None and not valid_input:
-                r.hset(self.redis_key, 'PROCESSED_PATH', json.dumps(pro_path[:-1]))
-            self._redis_processing(_state)
+                self.session.set('PROCESSED_PATH', encode_state(pro_path[:-1]))
+            yield _call(self._redis_processing, _state)
             return _resp
 
         try:
-            resp = _menu(processed_path, offset=offset)
-            r.hset(self.redis_key, 'LAST_SUCCESS_RESPONSE', resp)
+            resp = yield from _menu(processed_path, offset=offset)
+            self.session.set('LAST_SUCCESS_RESPONSE', resp)
         except FormBackError:
             # we pop the last path since it was pointing to a form, and now we can't go back further in the form
             # , so we also pop the path that led us to the form,
             # for that we also set FORM_STEP to None, which will later be deleted, since we are not navigating
             # in the form
-            processed_path = self.get_processed_path()
+            processed_path = yield _call(self.get_processed_path)
             try:
                 processed_path.pop()
             except:
                 pass
-            self._redis_processing({'FORM_STEP': None})
-            r.hset(self.redis_key, 'PROCESSED_PATH', json.dumps(processed_path))
-            resp = _menu(processed_path, add_last_input=False, offset=offset)
-            r.hset(self.redis_key, 'LAST_SUCCESS_RESPONSE', resp)
+            yield _call(self._redis_processing, {'FORM_STEP': None})
+            self.session.set('PROCESSED_PATH', encode_state(processed_path))
+            resp = yield from _menu(processed_path, add_last_input=False, offset=offset)
+            self.session.set('LAST_SUCCESS_RESPONSE', resp)
 
         except NavigationBackError:
             # we are going back inside navigation
-            processed_path = self.get_processed_path()
-            r.hset(self.redis_key, 'PROCESSED_PATH', json.dumps(processed_path))
-            resp = _menu(processed_path, add_last_input=False, offset=offset)
-            r.hset(self.redis_key, 'LAST_SUCCESS_RESPONSE', resp)
+            processed_path = yield _call(self.get_processed_path)
+            self.session.set('PROCESSED_PATH', encode_state(processed_path))
+            resp = yield from _menu(processed_path, add_last_input=False, offset=offset)
+            self.session.set('LAST_SUCCESS_RESPONSE', resp)
         except NavigationInvalidChoice:
-            last_resp = r.hget(self.redis_key, "LAST_SUCCESS_RESPONSE")
+            last_resp = self.session.get("LAST_SUCCESS_RESPONSE")
             set_var(msisdn=self.msisdn, session_id=self.session_id, data={'USSD_VALID_LAST_INPUT': 0})
             resp = f'CON Invalid Choice\n{last_resp[4:] if last_resp and last_resp[:3] in ["CON", "END"] else ""}'
 
-        resp: Union[dict, str] = self.format_response(resp)
+        if metrics is not None:
+            metrics.mark('format_response')
+        resp: Union[dict, str] = yield _call(self.format_response, resp)
         self.logger.debug(f'Response :: {resp}')
         return resp
 
     def get_processed_path(self):
-        processed_path = r.hget(self.redis_key, 'PROCESSED_PATH')
+        processed_path = self.session.get('PROCESSED_PATH')
         if not processed_path:
             processed_path = "[]"
         try:
-            processed_path = json.loads(processed_path)
+            processed_path = decode_state(processed_path)
         except Exception as e:
             self.logger.warning("invalid processed path variable... ")
             self.logger.warning(e)
@@ -760,28 +1988,27 @@ class NavigationController(BaseUSSD):
         return processed_path
 
     def get_global_variables(self, items):
-        kwargs = {}
-        for item in items:
-            kwargs[item] = get_global_var(self.msisdn, self.session_id, item)
-        return kwargs
+        token = SessionUnitOfWork.activate_all((self.session, self.globals))
+        try:
+            return get_global_vars(self.msisdn, self.session_id, items)
+        finally:
+            SessionUnitOfWork.deactivate(token)
 
     def get_local_variables(self, items):
-        kwargs = {}
-        for item in items:
-            kwargs[item] = r.hget(self.redis_key, item)
-        
-        return kwargs
+        return {k: as_text(v) for k, v in self.session.get_many(items).items()}
 
     def format_response(self, resp):
-        items = [tup[1] for tup in string.Formatter().parse(resp) if tup[1] is not None]
-        
+        items = _template_fields(resp)
+        if not items:
+            return resp.format()
+
         local_variables = self.get_local_variables(items)
         self.logger.debug(f'LOCAL VARIABLES :: {local_variables}')
 
         global_variables = self.get_global_variables(items)
         self.logger.debug(f'GLOBAL VARIABLES :: {global_variables}')
         
-        if os.getenv('VARIABLE_SUBSTITUTION_PRECEDENCE', 'local') == 'local':
+        if settings.variable_substitution_precedence == 'local':
             local_variables = {k: v for k, v in local_variables.items() if v is not None} 
             global_variables.update(local_variables)
             kwargs = global_variables
@@ -793,3 +2020,150 @@ class NavigationController(BaseUSSD):
             
         resp = resp.format(**kwargs)
         return resp
+
+
+class NavigationRequest(NamedTuple):
+    """one hop for `navigate_many()`"""
+    msisdn: str
+    session_id: str
+    ussd_string: str
+
+
+class NavigationResult(NamedTuple):
+    """what one hop of `navigate_many()` produced: its response, or the exception it raised"""
+    request: NavigationRequest
+    response: Optional[Union[str, dict]] = None
+    error: Optional[Exception] = None
+
+
+class _BatchRound:
+    """
+    Hops of distinct sessions, whose hashes are loaded in one round trip and written back in another. A session with
+    several hops in a batch has one in each round, so every hop sees the state left by the one before it
+    """
+
+    def __init__(self, requests: List[NavigationRequest], indexes: List[int], results: list, controller: Callable):
+        self.results = results
+        self.requests = requests
+        self.hops = []  # (index, controller)
+        self.resolved = []  # (index, controller, response)
+        for index in indexes:
+            try:
+                self.hops.append((index, controller(*requests[index])))
+            except Exception as e:
+                results[index] = NavigationResult(requests[index], error=e)
+
+    @staticmethod
+    def rounds(requests: List[NavigationRequest]) -> List[List[int]]:
+        rounds, seen = [], {}
+        for index, request in enumerate(requests):
+            key = (request.msisdn, request.session_id)
+            n = seen[key] = seen.get(key, -1) + 1
+            if n == len(rounds):
+                rounds.append([])
+            rounds[n].append(index)
+        return rounds
+
+    def units(self):
+        return [unit for _, nav in self.hops for unit in (nav.session, nav.globals)]
+
+    def start(self):
+        for _, nav in self.hops:
+            if nav.metrics is not None:
+                nav.metrics.mark('load')
+        return [unit.redis_key for unit in self.units()]
+
+    def loaded(self, data: list):
+        for unit, _data in zip(self.units(), data):
+            unit._loaded_with(_data)
+
+    def hop_done(self, index, nav, resp):
+        self.resolved.append((index, nav, resp))
+
+    def hop_failed(self, index, nav, error):
+        nav._discard()
+        self._fail(index, nav, error)
+
+    def updates(self) -> dict:
+        updates = {}
+        for _, nav, resp in self.resolved:
+            updates.update(nav._pending_updates(resp))
+        return updates
+
+    def flushed(self):
+        for index, nav, resp in self.resolved:
+            for unit in (nav.session, nav.globals):
+                unit._clear_writes()
+            self.results[index] = NavigationResult(self.requests[index], response=resp)
+            if nav.metrics is not None:
+                nav._report(resp)
+
+    def failed(self, error):
+        """the store failed: no hop of the round took effect"""
+        failed = self.resolved or [(index, nav, None) for index, nav in self.hops]
+        for index, nav, _ in failed:
+            self._fail(index, nav, error)
+
+    def _fail(self, index, nav, error):
+        self.results[index] = NavigationResult(self.requests[index], error=error)
+        if nav.metrics is not None:
+            nav._report(error=error)
+
+
+def navigate_many(
+        home_menu: Union[NavigationMenu, ConditionalFlow, CompiledMenu, ReloadableMenu],
+        requests,
+        enable_translation=False,
+        get_translation_fxn=None,
+        logger=None,
+        store: SessionStore = None,
+        instrumentation: Union[Instrumentation, Callable] = None,
+        offset=None
+) -> List[NavigationResult]:
+    """
+    Resolve a batch of hops, like the ones an aggregator delivers over a queue. The session hashes of every hop are
+    fetched in one pipeline, each hop is resolved in process, and all their changes are written back in one atomic
+    pipeline, instead of two round trips per hop.
+
+    Errors are isolated: a hop that raises gets the exception in its result and leaves its session as it was, without
+    affecting the others. If the store fails, every hop of the round gets the store's error. Several hops of the same
+    session are applied in order, one round of round trips each.
+
+    :param requests: (msisdn, session_id, ussd_string) tuples or `NavigationRequest`s
+    :param store: [Optional] session store. defaults to `get_session_store()`
+    :param instrumentation: [Optional] see `NavigationController`. Store round trips are shared by the batch, so they
+                            are not counted per hop
+    :return: a `NavigationResult` per request, in the same order
+    """
+    store = get_session_store() if store is None else store
+    requests = [NavigationRequest(*request) for request in requests]
+    results = [None] * len(requests)
+
+    def controller(msisdn, session_id, ussd_string):
+        return NavigationController(home_menu, msisdn, session_id, ussd_string, enable_translation,
+                                    get_translation_fxn, logger=logger, store=store, instrumentation=instrumentation)
+
+    for indexes in _BatchRound.rounds(requests):
+        batch = _BatchRound(requests, indexes, results, controller)
+        if not batch.hops:
+            continue
+        try:
+            batch.loaded(store.get_all_many(batch.start()))
+        except Exception as e:
+            batch.failed(e)
+            continue
+
+        for index, nav in batch.hops:
+            try:
+                batch.hop_done(index, nav, nav._resolve(offset))
+            except Exception as e:
+                batch.hop_failed(index, nav, e)
+
+        try:
+            if batch.resolved:
+                store.update_many(batch.updates())
+        except Exception as e:
+            batch.failed(e)
+            continue
+        batch.flushed()
+    return results
@@ -0,0 +1,521 @@
+"""
+Load generator: simulated subscribers walking a menu, for capacity planning.
+
+    python -m anysd.simulator myapp.menu:home --sessions 5000 --concurrency 200 --mode thread
+    python -m anysd.simulator myapp.menu:home --url http://localhost:5000/ussd --duration 60 --concurrency 500
+"""
+import argparse
+import asyncio
+import functools
+import json
+import random
+import re
+import threading
+import time
+import urllib.parse
+import urllib.request
+import uuid
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from typing import Callable, Dict, Optional, Sequence, Union
+
+from .conf import ImproperlyConfigured, settings
+from .main import NavigationController, NavigationMenu, ConditionalFlow, CompiledMenu, ReloadableMenu, ListInput
+from .store import SessionStore, MemorySessionStore
+
+_OPTION = re.compile(r'^\s*(\d+)[.)]', re.MULTILINE)
+
+MODES = ('thread', 'process', 'asyncio')
+
+
+def _percentile(sorted_values, q):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, max(0, round(q / 100 * len(sorted_values) + 0.5) - 1))
+    return sorted_values[index]
+
+
+class SimulationReport:
+    """
+    Outcome of a simulation. `completed` sessions reached an `END` response, `abandoned` ones were dropped by the
+    subscriber or hit `max_hops`, `failed` ones raised (`errors` counts them by exception)
+    """
+
+    def __init__(self):
+        self.sessions = 0
+        self.completed = 0
+        self.abandoned = 0
+        self.failed = 0
+        self.hops = 0
+        self.elapsed = 0.0
+        self.latencies = []
+        self.errors = Counter()
+
+    def merge(self, other: 'SimulationReport'):
+        self.sessions += other.sessions
+        self.completed += other.completed
+        self.abandoned += other.abandoned
+        self.failed += other.failed
+        self.hops += other.hops
+        self.latencies.extend(other.latencies)
+        self.errors.update(other.errors)
+        return self
+
+    @property
+    def sessions_per_sec(self):
+        return self.sessions / self.elapsed if self.elapsed else 0.0
+
+    @property
+    def hops_per_sec(self):
+        return self.hops / self.elapsed if self.elapsed else 0.0
+
+    def latency(self) -> dict:
+        """hop latency percentiles, in milliseconds"""
+        latencies = sorted(self.latencies)
+        if not latencies:
+            return {}
+        summary = {f'p{q}': _percentile(latencies, q) * 1000 for q in (50, 90, 95, 99)}
+        summary['mean'] = sum(latencies) / len(latencies) * 1000
+        summary['max'] = latencies[-1] * 1000
+        return summary
+
+    def as_dict(self) -> dict:
+        return {
+            'sessions': self.sessions,
+            'completed': self.completed,
+            'abandoned': self.abandoned,
+            'failed': self.failed,
+            'hops': self.hops,
+            'elapsed': self.elapsed,
+            'sessions_per_sec': self.sessions_per_sec,
+            'hops_per_sec': self.hops_per_sec,
+            'latency_ms': self.latency(),
+            'errors': dict(self.errors),
+        }
+
+    def __str__(self):
+        latency = ''.join(f'  {name} {value:.2f}ms' for name, value in self.latency().items())
+        return (f'{self.sessions} sessions ({self.completed} completed, {self.abandoned} abandoned, {self.failed} '
+                f'failed), {self.hops} hops in {self.elapsed:.1f}s: {self.sessions_per_sec:.1f} sessions/s, '
+                f'{self.hops_per_sec:.1f} hops/s\nlatency:{latency}')
+
+
+class _Walk:
+    """
+    One subscriber's way through the menu. Keeps track of the menu and form step on screen, when the tree tells (it
+    cannot past a `ConditionalFlow`, or through a URL without a tree), and otherwise picks from the numbered options
+    on screen
+    """
+
+    def __init__(self, simulator: 'Simulator', rng: random.Random):
+        self.simulator = simulator
+        self.rng = rng
+        self.node = simulator.tree
+        self.step = None
+        self._move = None
+
+    def next_input(self, screen: str) -> Optional[str]:
+        """the key the subscriber presses on `screen`. None when they drop the session"""
+        simulator, rng = self.simulator, self.rng
+        roll = rng.random()
+        if roll < simulator.abandon_rate:
+            return None
+        roll -= simulator.abandon_rate
+        if roll < simulator.back_rate:
+            self._move = self._back
+            return settings.back_symbol
+        roll -= simulator.back_rate
+        if roll < simulator.home_rate:
+            self._move = self._home
+            return settings.home_symbol
+
+        options = [int(option) for option in _OPTION.findall(screen)]
+        if self.step is not None:
+            question = self.node.next_form.form_questions.get(str(self.step), {})
+            value = self._form_input(question, options)
+            menu = question.get('menu')
+            # the next and previous page keys of a paginated list stay on the same step
+            self._move = None if isinstance(menu, ListInput) and menu.is_page_key(value) else self._answer
+            return value
+
+        node = self.node
+        if isinstance(node, NavigationMenu) and node.children:
+            weights = simulator.weights.get(node.name)
+            index = rng.choices(range(len(node.children)), weights=weights)[0]
+            self._move = lambda: self._descend(node.children[index])
+            return str(index + 1)
+
+        # the menu on screen is not known: pick an option, like a subscriber reading the screen would
+        self._move = self._forget
+        return str(rng.choice(options)) if options else '1'
+
+    def _form_input(self, question, options):
+        generator = self.simulator.form_inputs.get(question.get('name'))
+        if generator is None:
+            if isinstance(question.get('menu'), ListInput) or options:
+                return str(self.rng.choice(options)) if options else '1'
+            return str(self.rng.randint(1, 1000))
+        if callable(generator):
+            return str(generator(self.rng))
+        if isinstance(generator, (list, tuple)):
+            return str(self.rng.choice(generator))
+        return str(generator)
+
+    def accept(self, screen: str):
+        """apply the move of the last input, unless `screen` says it was rejected"""
+        move, self._move = self._move, None
+        first_line = screen.split('\n', 1)[0]
+        if move is not None and self.simulator.invalid_marker not in first_line:
+            move()
+
+    def _descend(self, child):
+        self.node = child
+        if not child.children and child.next_form is not None:
+            self.step = 1
+
+    def _answer(self):
+        self.step += 1
+
+    def _back(self):
+        if self.step is not None and self.step > 1:
+            self.step -= 1
+            return
+        self.step = None
+        if isinstance(self.node, NavigationMenu) and self.node.parent is not None:
+            self.node = self.node.parent
+        elif self.node is not self.simulator.tree:
+            self.node = None
+
+    def _home(self):
+        self.node, self.step = self.simulator.tree, None
+
+    def _forget(self):
+        self.node, self.step = None, None
+
+
+class Simulator:
+    def __init__(
+            self,
+            home_menu: Union[NavigationMenu, ConditionalFlow, CompiledMenu, ReloadableMenu] = None,
+            url: str = None,
+            weights: Dict[str, Sequence[float]] = None,
+            form_inputs: Dict[str, Union[Callable, Sequence, str]] = None,
+            back_rate: float = 0.05,
+            home_rate: float = 0.01,
+            abandon_rate: float = 0.0,
+            max_hops: int = 30,
+            think_time: float = 0.0,
+            enable_translation: bool = False,
+            get_translation_fxn: Callable = None,
+            store: SessionStore = None,
+            msisdn_prefix: str = '2547',
+            invalid_marker: str = 'Invalid',
+            timeout: float = 10,
+            seed=None
+    ):
+        """
+        Simulated subscribers dialing in and walking the menu, for sizing workers and redis.
+
+        Each session dials in, picks menu options (weighted, or uniformly), answers form questions, now and then
+        presses back or home, and ends on an `END` response, when the subscriber drops it, or after `max_hops`.
+
+        :param home_menu: the navigation, driven in process through `NavigationController` (or
+                          `AsyncNavigationController` in `asyncio` mode). Also used to know what is on screen when
+                          driving `url`
+        :param url: [Optional] endpoint wrapping the controller, called with `GET url?msisdn=..&session_id=..&
+                    ussd_string=..` and answering with the response text
+        :param weights: [Optional] {menu name: weight of each child}. children are picked uniformly otherwise
+        :param form_inputs: [Optional] {form field name: input}. the input is a function of a `random.Random`, a
+                            sequence to pick from, or a constant. list questions default to a random option on
+                            screen, other questions to a random number
+        :param back_rate: [Optional] probability of pressing back on a screen
+        :param home_rate: [Optional] probability of pressing home on a screen
+        :param abandon_rate: [Optional] probability of dropping the session on a screen
+        :param max_hops: [Optional] hops after which a session is abandoned
+        :param think_time: [Optional] seconds a subscriber waits before each input. not counted in latencies
+        :param enable_translation: [Optional] passed to the controller
+        :param get_translation_fxn: [Optional] passed to the controller
+        :param store: [Optional] session store passed to the controller. In `process` mode every process gets an
+                      empty copy of a `MemorySessionStore`
+        :param msisdn_prefix: [Optional] simulated phone numbers start with this
+        :param invalid_marker: [Optional] text in the first line of a response rejecting the input
+        :param timeout: [Optional] seconds to wait for `url`
+        :param seed: [Optional] makes the sessions reproducible
+        """
+        if home_menu is None and url is None:
+            raise ImproperlyConfigured('home_menu or url is required')
+        self.home_menu = home_menu
+        self.url = url
+        self.weights = weights or {}
+        self.form_inputs = form_inputs or {}
+        self.back_rate = back_rate
+        self.home_rate = home_rate
+        self.abandon_rate = abandon_rate
+        self.max_hops = max_hops
+        self.think_time = think_time
+        self.enable_translation = enable_translation
+        self.get_translation_fxn = get_translation_fxn
+        self.store = store
+        self.msisdn_prefix = msisdn_prefix
+        self.invalid_marker = invalid_marker
+        self.timeout = timeout
+        self.seed = random.randrange(2 ** 32) if seed is None else seed
+        # session ids never repeat between simulators or runs, however the choices are seeded
+        self.token = uuid.uuid4().hex[:8]
+        self.runs = 0
+
+        if isinstance(home_menu, ReloadableMenu):
+            home_menu = home_menu.compiled
+        # the tree is followed to know what is on screen
+        self.tree = home_menu.home if isinstance(home_menu, CompiledMenu) else home_menu
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        if isinstance(self.store, MemorySessionStore):
+            # in-process sessions stay in their process: a simulator sent to a worker process gets an empty store
+            state['store'] = (self.store.max_sessions, self.store.ttl, self.store.clock)
+        return state
+
+    def __setstate__(self, state):
+        if isinstance(state['store'], tuple):
+            state['store'] = MemorySessionStore(*state['store'])
+        self.__dict__.update(state)
+
+    def _session_ids(self, n, run):
+        return f'{self.msisdn_prefix}{n:08d}', f'sim-{self.token}-{run}-{n}'
+
+    def send(self, msisdn, session_id, ussd_string) -> str:
+        """one hop. the response text"""
+        if self.url is not None:
+            query = urllib.parse.urlencode({'msisdn': msisdn, 'session_id': session_id, 'ussd_string': ussd_string})
+            separator = '&' if '?' in self.url else '?'
+            with urllib.request.urlopen(f'{self.url}{separator}{query}', timeout=self.timeout) as response:
+                return response.read().decode('utf-8')
+        return NavigationController(self.home_menu, msisdn, session_id, ussd_string, self.enable_translation,
+                                    self.get_translation_fxn, store=self.store).navigate()
+
+    async def asend(self, msisdn, session_id, ussd_string) -> str:
+        """`send()` from an event loop"""
+        if self.url is not None:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(None, self.send, msisdn, session_id, ussd_string)
+        from .aio import AsyncNavigationController
+        return await AsyncNavigationController(self.home_menu, msisdn, session_id, ussd_string,
+                                               self.enable_translation, self.get_translation_fxn,
+                                               store=self.store).navigate()
+
+    def session(self, n: int, report: SimulationReport, run: int = 0):
+        """simulate session number `n` of run `run`, recording it in `report`"""
+        msisdn, session_id = self._session_ids(n, run)
+        walk = _Walk(self, random.Random(f'{self.seed}-{n}'))
+        inputs = []
+        report.sessions += 1
+        try:
+            for _ in range(self.max_hops):
+                started = time.perf_counter()
+                screen = self.send(msisdn, session_id, '*'.join(inputs))
+                report.latencies.append(time.perf_counter() - started)
+                report.hops += 1
+                walk.accept(screen)
+                if screen.startswith('END'):
+                    report.completed += 1
+                    return
+                key = walk.next_input(screen)
+                if key is None:
+                    break
+                inputs.append(key)
+                if self.think_time:
+                    time.sleep(self.think_time)
+            report.abandoned += 1
+        except Exception as e:
+            report.failed += 1
+            report.errors[e.__class__.__name__] += 1
+
+    async def asession(self, n: int, report: SimulationReport, run: int = 0):
+        """`session()` from an event loop"""
+        msisdn, session_id = self._session_ids(n, run)
+        walk = _Walk(self, random.Random(f'{self.seed}-{n}'))
+        inputs = []
+        report.sessions += 1
+        try:
+            for _ in range(self.max_hops):
+                started = time.perf_counter()
+                screen = await self.asend(msisdn, session_id, '*'.join(inputs))
+                report.latencies.append(time.perf_counter() - started)
+                report.hops += 1
+                walk.accept(screen)
+                if screen.startswith('END'):
+                    report.completed += 1
+                    return
+                key = walk.next_input(screen)
+                if key is None:
+                    break
+                inputs.append(key)
+                if self.think_time:
+                    await asyncio.sleep(self.think_time)
+            report.abandoned += 1
+        except Exception as e:
+            report.failed += 1
+            report.errors[e.__class__.__name__] += 1
+
+    def run(self, sessions: int = None, duration: float = None, concurrency: int = 10, mode: str = 'thread',
+            processes: int = None) -> SimulationReport:
+        """
+        Run sessions, `concurrency` at a time, until `sessions` have run or `duration` seconds have passed.
+
+        :param mode: `thread`, `process` (sessions spread over `processes` processes, each running its share of
+                     `concurrency` in threads) or `asyncio`. In `process` mode the simulator is pickled to every
+                     process, so the menu and the functions it holds have to be importable
+        :param processes: [Optional] number of processes in `process` mode. defaults to the number of CPUs
+        """
+        if sessions is None and duration is None:
+            raise ImproperlyConfigured('sessions or duration is required')
+        if mode not in MODES:
+            raise ImproperlyConfigured(f'mode should be one of {MODES}, not {mode!r}')
+
+        run = self._next_run()
+        started = time.perf_counter()
+        if mode == 'asyncio':
+            report = asyncio.run(self._arun(sessions, duration, concurrency, run))
+        elif mode == 'process':
+            report = self._run_processes(sessions, duration, concurrency, processes, run)
+        else:
+            report = self._run_threads(sessions, duration, concurrency, run)
+        report.elapsed = time.perf_counter() - started
+        return report
+
+    def _next_run(self):
+        run, self.runs = self.runs, self.runs + 1
+        return run
+
+    def _claimer(self, sessions, duration, first_session=0, step=1):
+        # hands out session numbers to workers until the run is over
+        lock = threading.Lock()
+        deadline = time.perf_counter() + duration if duration is not None else None
+        last = first_session + sessions * step if sessions is not None else None
+        state = {'next': first_session}
+
+        def claim():
+            if deadline is not None and time.perf_counter() >= deadline:
+                return None
+            with lock:
+                n = state['next']
+                if last is not None and n >= last:
+                    return None
+                state['next'] = n + step
+                return n
+        return claim
+
+    def _run_threads(self, sessions, duration, concurrency, run, first_session=0, step=1):
+        claim = self._claimer(sessions, duration, first_session, step)
+
+        def worker():
+            report = SimulationReport()
+            n = claim()
+            while n is not None:
+                self.session(n, report, run)
+                n = claim()
+            return report
+
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            reports = [pool.submit(worker) for _ in range(concurrency)]
+            return _merge(future.result() for future in reports)
+
+    def _run_processes(self, sessions, duration, concurrency, processes, run):
+        with ProcessPoolExecutor(max_workers=processes) as pool:
+            processes = pool._max_workers
+            per_process = max(1, concurrency // processes)
+            reports = []
+            for p in range(processes):
+                # process p runs sessions p, p + processes, p + 2 * processes...
+                share = None if sessions is None else len(range(p, sessions, processes))
+                if share == 0:
+                    continue
+                reports.append(pool.submit(
+                    _run_process_share, self, share, duration, per_process, run, p, processes))
+            return _merge(future.result() for future in reports)
+
+    async def _arun(self, sessions, duration, concurrency, run):
+        claim = self._claimer(sessions, duration)
+
+        async def worker():
+            report = SimulationReport()
+            n = claim()
+            while n is not None:
+                await self.asession(n, report, run)
+                n = claim()
+            return report
+
+        return _merge(await asyncio.gather(*(worker() for _ in range(concurrency))))
+
+    async def arun(self, sessions: int = None, duration: float = None, concurrency: int = 10) -> SimulationReport:
+        """`run()` in `asyncio` mode, from a running event loop"""
+        if sessions is None and duration is None:
+            raise ImproperlyConfigured('sessions or duration is required')
+        run = self._next_run()
+        started = time.perf_counter()
+        report = await self._arun(sessions, duration, concurrency, run)
+        report.elapsed = time.perf_counter() - started
+        return report
+
+
+def _merge(reports):
+    merged = SimulationReport()
+    for report in reports:
+        merged.merge(report)
+    return merged
+
+
+def _run_process_share(simulator, sessions, duration, concurrency, run, first_session, step):
+    return simulator._run_threads(sessions, duration, concurrency, run, first_session, step)
+
+
+def _fixed_language(language, **kwargs):
+    return language
+
+
+def main(argv=None):
+    from .loader import import_string, load_menu
+
+    parser = argparse.ArgumentParser(prog='python -m anysd.simulator', description='simulate ussd subscribers')
+    parser.add_argument('menu', help='dotted path of the home menu (package.module:home), or a yaml/json menu spec')
+    parser.add_argument('--url', help='drive this endpoint instead of calling the controller in process')
+    parser.add_argument('--sessions', type=int)
+    parser.add_argument('--duration', type=float, help='seconds to run for')
+    parser.add_argument('--concurrency', type=int, default=10)
+    parser.add_argument('--mode', choices=MODES, default='thread')
+    parser.add_argument('--processes', type=int)
+    parser.add_argument('--back-rate', type=float, default=0.05)
+    parser.add_argument('--home-rate', type=float, default=0.01)
+    parser.add_argument('--abandon-rate', type=float, default=0.0)
+    parser.add_argument('--think-time', type=float, default=0.0)
+    parser.add_argument('--language', help='translate menus to this language')
+    parser.add_argument('--memory', action='store_true', help='keep sessions in memory instead of redis')
+    parser.add_argument('--seed', type=int)
+    parser.add_argument('--json', help='write the report to this file')
+    args = parser.parse_args(argv)
+    if args.sessions is None and args.duration is None:
+        parser.error('--sessions or --duration is required')
+
+    if args.menu.endswith(('.yaml', '.yml', '.json')):
+        home = load_menu(args.menu)
+    else:
+        home = import_string(args.menu)
+
+    store = MemorySessionStore(max_sessions=None) if args.memory else None
+    translation = functools.partial(_fixed_language, args.language) if args.language else None
+
+    simulator = Simulator(home, url=args.url, back_rate=args.back_rate, home_rate=args.home_rate,
+                          abandon_rate=args.abandon_rate, think_time=args.think_time,
+                          enable_translation=translation is not None, get_translation_fxn=translation, store=store,
+                          seed=args.seed)
+    report = simulator.run(args.sessions, args.duration, args.concurrency, args.mode, args.processes)
+    print(report)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report.as_dict(), f, indent=2)
+    return report
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,272 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import TYPE_CHECKING, Iterable, Optional
+
+from .conf import ImproperlyConfigured, get_redis, settings
+
+if TYPE_CHECKING:
+    # for annotations only: importing anysd does not import redis
+    import redis
+
+
+def encode_value(value):
+    """
+    convert a value to the string redis would give back for it (with decode_responses=True), so every store returns
+    the same thing regardless of where the value came from
+    """
+    if isinstance(value, str):
+        return value
+    if isinstance(value, bytes):
+        return value.decode('utf-8')
+    if isinstance(value, int) and not isinstance(value, bool):
+        return str(value)
+    if isinstance(value, float):
+        return repr(value)
+    # imported here, so that importing anysd does not import redis
+    from redis import DataError
+
+    raise DataError(f'Invalid input of type: {value.__class__.__name__}. Convert to a bytes, string, '
+                    f'int or float first.')
+
+
+class SessionStore:
+    """
+    Where session hashes (`{msisdn}:{session_id}`) are kept. Every field value is a string.
+
+    Subclass and implement all methods to add a backend, then pass it to `NavigationController(store=...)` or make it
+    the default with `set_session_store()`.
+    """
+
+    def get_all(self, key) -> dict:
+        """all fields of the session hash. empty dict if it does not exist"""
+        raise NotImplementedError
+
+    def get_many(self, key, fields: Iterable) -> dict:
+        """the requested fields, with None for missing ones"""
+        raise NotImplementedError
+
+    def set_many(self, key, mapping: dict):
+        raise NotImplementedError
+
+    def delete_many(self, key, fields: Iterable):
+        raise NotImplementedError
+
+    def update(self, key, changed: dict = None, deleted: Iterable = None, ttl: Optional[int] = None):
+        """
+        apply `changed` and remove `deleted` fields atomically. if `ttl` (seconds) is given, the session expires `ttl`
+        seconds from now
+        """
+        raise NotImplementedError
+
+    def expire(self, key, ttl: int):
+        raise NotImplementedError
+
+    def delete(self, key):
+        """remove the whole session hash"""
+        raise NotImplementedError
+
+    def get_all_many(self, keys: Iterable) -> list:
+        """`get_all` for several hashes. Backends should fetch them in one round trip"""
+        return [self.get_all(key) for key in keys]
+
+    def update_many(self, updates: dict):
+        """
+        `update` for several hashes. Backends should apply them atomically, in one round trip
+
+        :param updates: {key: {'changed': ..., 'deleted': ..., 'ttl': ...}}
+        """
+        for key, update in updates.items():
+            self.update(key, **update)
+
+
+class RedisSessionStore(SessionStore):
+    def __init__(self, conn: 'redis.Redis' = None):
+        """
+        :param conn: [Optional] redis client. defaults to the shared client from `get_redis()`
+        """
+        self.conn = get_redis() if conn is None else conn
+
+    def get_all(self, key):
+        return self.conn.hgetall(key) or {}
+
+    def get_many(self, key, fields):
+        fields = list(fields)
+        if not fields:
+            return {}
+        return dict(zip(fields, self.conn.hmget(key, fields)))
+
+    def set_many(self, key, mapping):
+        if mapping:
+            return self.conn.hset(key, mapping=mapping)
+
+    def delete_many(self, key, fields):
+        fields = list(fields)
+        if fields:
+            return self.conn.hdel(key, *fields)
+
+    def _queue_update(self, pipe, key, changed=None, deleted=None, ttl=None):
+        if deleted:
+            pipe.hdel(key, *deleted)
+        if changed:
+            pipe.hset(key, mapping=changed)
+        if ttl:
+            pipe.expire(key, ttl)
+
+    def update(self, key, changed=None, deleted=None, ttl=None):
+        if not (changed or deleted or ttl):
+            return
+        pipe = self.conn.pipeline(transaction=True)
+        self._queue_update(pipe, key, changed, deleted, ttl)
+        pipe.execute()
+
+    def expire(self, key, ttl):
+        return self.conn.expire(key, ttl)
+
+    def delete(self, key):
+        return self.conn.delete(key)
+
+    def get_all_many(self, keys):
+        pipe = self.conn.pipeline(transaction=False)
+        for key in keys:
+            pipe.hgetall(key)
+        return [data or {} for data in pipe.execute()]
+
+    def update_many(self, updates):
+        updates = {key: update for key, update in updates.items() if any(update.values())}
+        if not updates:
+            return
+        pipe = self.conn.pipeline(transaction=True)
+        for key, update in updates.items():
+            self._queue_update(pipe, key, **update)
+        pipe.execute()
+
+
+class MemorySessionStore(SessionStore):
+    def __init__(self, max_sessions: Optional[int] = 100_000, ttl: Optional[int] = None, clock=time.monotonic):
+        """
+        In-process session store, for single node deployments, tests and load tests that should not depend on redis.
+        Sessions are not shared between processes.
+
+        :param max_sessions: [Optional] number of sessions kept. the least recently used session is evicted when the
+                             store is full. None for no limit
+        :param ttl: [Optional] default lifetime of a session in seconds, counted from its last update
+        :param clock: [Optional] time source, in seconds
+        """
+        if max_sessions is not None and max_sessions < 1:
+            raise ImproperlyConfigured('max_sessions should be a positive number or None')
+        self.max_sessions = max_sessions
+        self.ttl = ttl
+        self.clock = clock
+        self._lock = threading.RLock()
+        self._sessions = OrderedDict()
+        self._expiry = {}
+
+    def __len__(self):
+        with self._lock:
+            self._purge_expired()
+            return len(self._sessions)
+
+    def _purge_expired(self):
+        now = self.clock()
+        for key in [k for k, deadline in self._expiry.items() if deadline <= now]:
+            self._drop(key)
+
+    def _drop(self, key):
+        self._sessions.pop(key, None)
+        self._expiry.pop(key, None)
+
+    def _get(self, key, create=False):
+        # caller holds the lock
+        deadline = self._expiry.get(key)
+        if deadline is not None and deadline <= self.clock():
+            self._drop(key)
+
+        session = self._sessions.get(key)
+        if session is None:
+            if not create:
+                return None
+            session = self._sessions[key] = {}
+            if self.max_sessions is not None and len(self._sessions) > self.max_sessions:
+                self._purge_expired()
+                while len(self._sessions) > self.max_sessions:
+                    oldest = next(iter(self._sessions))
+                    self._drop(oldest)
+        self._sessions.move_to_end(key)
+        return session
+
+    def _touch(self, key, ttl=None):
+        ttl = ttl or self.ttl
+        if ttl:
+            self._expiry[key] = self.clock() + ttl
+
+    def get_all(self, key):
+        with self._lock:
+            session = self._get(key)
+            return dict(session) if session else {}
+
+    def get_many(self, key, fields):
+        with self._lock:
+            session = self._get(key) or {}
+            return {field: session.get(field) for field in fields}
+
+    def set_many(self, key, mapping):
+        self.update(key, changed=mapping)
+
+    def delete_many(self, key, fields):
+        self.update(key, deleted=fields)
+
+    def update(self, key, changed=None, deleted=None, ttl=None):
+        with self._lock:
+            session = self._get(key, create=bool(changed))
+            if session is None:
+                return
+            for field in deleted or ():
+                session.pop(field, None)
+            for field, value in (changed or {}).items():
+                session[field] = encode_value(value)
+            if not session:
+                # like redis, a hash without fields does not exist
+                self._drop(key)
+                return
+            self._touch(key, ttl)
+
+    def expire(self, key, ttl):
+        with self._lock:
+            if self._get(key) is None:
+                return False
+            self._expiry[key] = self.clock() + ttl
+            return True
+
+    def delete(self, key):
+        with self._lock:
+            existed = key in self._sessions
+            self._drop(key)
+            return int(existed)
+
+    def update_many(self, updates):
+        with self._lock:
+            for key, update in updates.items():
+                self.update(key, **update)
+
+    def clear(self):
+        with self._lock:
+            self._sessions.clear()
+            self._expiry.clear()
+
+
+_default_store: Optional[SessionStore] = None
+
+
+def get_session_store() -> SessionStore:
+    """the store used when none is passed explicitly. redis, through the shared pool, unless changed"""
+    if _default_store is None:
+        return settings.session_store
+    return _default_store
+
+
+def set_session_store(store: SessionStore):
+    global _default_store
+    if not isinstance(store, SessionStore):
+        raise ImproperlyConfigured(f'store should be a SessionStore, not {store.__class__.__name__}')
+    _default_store = store
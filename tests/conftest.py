@@ -0,0 +1,22 @@
+import logging
+import os
+import sys
+
+import pytest
+
+# run against the working tree, installed or not
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src'))
+
+from anysd import MemorySessionStore, get_session_store, set_session_store  # noqa: E402
+
+
+@pytest.fixture
+def store():
+    """a fresh in-memory store, used by default for the duration of the test"""
+    previous = get_session_store()
+    store = MemorySessionStore()
+    set_session_store(store)
+    logging.disable(logging.CRITICAL)
+    yield store
+    logging.disable(logging.NOTSET)
+    set_session_store(previous)
@@ -0,0 +1,130 @@
+import asyncio
+import random
+
+from anysd import (AsyncNavigationController, ConditionalFlow, FormFlow, ListInput, MemorySessionStore,
+                   NavigationController, NavigationMenu, anavigate_many, get_var, global_key, navigate_many,
+                   set_global_var, set_var, settings)
+
+
+def _callbacks():
+    """plain versions of every kind of callback a menu can have"""
+
+    def validator(current_step, last_input, msisdn, session_id, **kwargs):
+        set_global_var(msisdn, session_id, key='STEP', value=current_step)
+        if current_step == 2:
+            return last_input.isdigit() and int(last_input) > 0, {'CHECKED': last_input}
+        return True, None
+
+    def items(msisdn, **kwargs):
+        return [f'{msisdn[-2:]} option {n}' for n in range(1, 6)]
+
+    def post_call(msisdn, session_id, ussd_string, data):
+        set_var(msisdn, session_id, {'POSTED': f"{data.get('OPTION')}:{data.get('AMOUNT')}"})
+
+    def confirm(msisdn, session_id, data, **kwargs):
+        return f"CON Send {data.get('AMOUNT')} to {get_var(msisdn, session_id, 'OPTION')}?\n1. Yes"
+
+    def condition(msisdn, **kwargs):
+        return 'even' if int(msisdn[-1]) % 2 == 0 else 'odd'
+
+    def translation(msisdn, **kwargs):
+        return 'en'
+
+    return dict(validator=validator, items=items, post_call=post_call, confirm=confirm, condition=condition,
+                translation=translation)
+
+
+def _coroutines():
+    def wrap(fxn):
+        async def coroutine(*args, **kwargs):
+            await asyncio.sleep(0)
+            return fxn(*args, **kwargs)
+        return coroutine
+
+    return {name: wrap(fxn) for name, fxn in _callbacks().items()}
+
+
+def _menu(callbacks):
+    form = FormFlow({
+        '1': {'name': 'OPTION', 'menu': ListInput(items=callbacks['items'], title='Pick', page_size=2)},
+        '2': {'name': 'AMOUNT', 'menu': {'en': 'CON Amount'}, 'post_call': callbacks['post_call']},
+        '3': {'name': 'CONFIRM', 'menu': callbacks['confirm']},
+        '4': {'menu': {'en': 'END Sent {AMOUNT} at step {STEP}'}},
+    }, callbacks['validator'])
+    homes = {}
+    for name in ('even', 'odd'):
+        home = homes[name] = NavigationMenu(name=name, title={'en': f'Home {name}'})
+        NavigationMenu(name='send', title={'en': 'Send'}, parent=home, next_form=form)
+        more = NavigationMenu(name='more', title={'en': 'More'}, parent=home)
+        NavigationMenu(name='again', title={'en': 'Send again'}, parent=more, next_form=form)
+    return ConditionalFlow(callbacks['condition'], homes)
+
+
+def _sessions(count=60, seed=3):
+    rng = random.Random(seed)
+    tokens = ['1', '2', '1', '99', '98', '50', '0', '7', settings.back_symbol, settings.home_symbol]
+    return [(f'2547000{n:02d}', f's{n}', [rng.choice(tokens) for _ in range(rng.randint(1, 9))]) for n in range(count)]
+
+
+def _hops(session):
+    msisdn, session_id, inputs = session
+    ussd_string = ''
+    for n, key in enumerate([''] + inputs):
+        ussd_string = key if n <= 1 else f'{ussd_string}*{key}'
+        yield msisdn, session_id, ussd_string
+
+
+def _state(store, sessions):
+    return [(store.get_all(f'{msisdn}:{session_id}'), store.get_all(global_key(msisdn, session_id)))
+            for msisdn, session_id, _ in sessions]
+
+
+def _outcome(call):
+    try:
+        return call()
+    except Exception as e:
+        return type(e).__name__
+
+
+def test_async_controller_matches_the_sync_one_hop_for_hop():
+    sessions = _sessions()
+    home, ahome = _menu(_callbacks()), _menu(_coroutines())
+    translation, atranslation = _callbacks()['translation'], _coroutines()['translation']
+    store, astore = MemorySessionStore(), MemorySessionStore()
+
+    expected = [_outcome(lambda: NavigationController(home, *hop, True, translation, store=store).navigate())
+                for session in sessions for hop in _hops(session)]
+
+    async def run():
+        screens = []
+        for session in sessions:
+            for hop in _hops(session):
+                try:
+                    screens.append(await AsyncNavigationController(ahome, *hop, True, atranslation,
+                                                                   store=astore).navigate())
+                except Exception as e:
+                    screens.append(type(e).__name__)
+        return screens
+
+    assert asyncio.run(run()) == expected
+    assert any(screen.startswith('END Sent') for screen in expected)
+    assert _state(astore, sessions) == _state(store, sessions)
+
+
+def test_anavigate_many_matches_navigate_many():
+    sessions = _sessions(seed=4)
+    # several hops of a session in one batch are applied in order
+    requests = [hop for session in sessions for hop in _hops(session)]
+    random.Random(5).shuffle(requests)
+    requests.sort(key=lambda hop: len(hop[2]))
+    store, astore = MemorySessionStore(), MemorySessionStore()
+
+    expected = navigate_many(_menu(_callbacks()), requests, True, _callbacks()['translation'], store=store)
+    results = asyncio.run(anavigate_many(_menu(_coroutines()), requests, True, _coroutines()['translation'],
+                                         store=astore))
+
+    def outcomes(results):
+        return [(result.request, result.response, type(result.error).__name__) for result in results]
+
+    assert outcomes(results) == outcomes(expected)
+    assert _state(astore, sessions) == _state(store, sessions)
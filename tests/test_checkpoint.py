@@ -0,0 +1,71 @@
+import random
+
+from anysd import CompiledMenu, FormFlow, MemorySessionStore, NavigationController, NavigationMenu, compile_menu, \
+    settings
+
+
+def _tree(depth=4, width=3):
+    form = FormFlow({'1': {'name': 'AMOUNT', 'menu': 'CON Amount'}, '2': {'menu': 'END Sent {AMOUNT}'}},
+                    lambda *args, **kwargs: (True, None))
+    home = NavigationMenu(name='home', title='Home')
+    level = [home]
+    for d in range(depth):
+        level = [NavigationMenu(name=f'{parent.name}.{n}', title=f'{parent.title} {n}', parent=parent,
+                                next_form=form if d == depth - 1 else None)
+                 for parent in level for n in range(1, width + 1)]
+    return home
+
+
+def _play(home, store, inputs, checkpoint=None):
+    """:param checkpoint: [Optional] returns the checkpoint to leave in the session before each hop, None for none"""
+    screens, ussd_string = [], ''
+    for n, key in enumerate([''] + inputs):
+        ussd_string = key if n <= 1 else f'{ussd_string}*{key}'
+        if checkpoint is not None:
+            value = checkpoint()
+            if value is None:
+                store.delete_many('254700:s1', ['USSD_NODE'])
+            elif store.get_all('254700:s1'):
+                store.set_many('254700:s1', {'USSD_NODE': value})
+        try:
+            screens.append(NavigationController(home, '254700', 's1', ussd_string, False, None, store=store).navigate())
+        except Exception as e:
+            screens.append(type(e).__name__)
+    return screens
+
+
+def test_resuming_from_the_checkpoint_matches_full_resolution(monkeypatch):
+    tree = _tree()
+    compiled = compile_menu(tree)
+    starts = []
+    resolve = CompiledMenu._resolve_id_gen
+
+    def spy(self, path, start=0, position=0, **kwargs):
+        starts.append(start)
+        return (yield from resolve(self, path, start, position, **kwargs))
+
+    monkeypatch.setattr(CompiledMenu, '_resolve_id_gen', spy)
+    rng = random.Random(13)
+    tokens = ['1', '2', '3', '4', '50', settings.back_symbol, settings.home_symbol]
+    def stale():
+        # the checkpoint of some other menu, as a session id reused by another subscriber would leave
+        node_id = rng.randrange(len(compiled))
+        node, path = compiled.nodes[node_id], []
+        while node.parent is not None:
+            path.insert(0, str(node.position))
+            node = node.parent
+        return compiled.checkpoint(node_id, path)
+
+    resumed = hops = 0
+    for _ in range(200):
+        inputs = [rng.choice(tokens) for _ in range(rng.randint(1, 10))]
+        expected = _play(tree, MemorySessionStore(), inputs)
+        assert _play(compiled, MemorySessionStore(), inputs, checkpoint=lambda: None) == expected
+        assert _play(compiled, MemorySessionStore(), inputs, checkpoint=stale) == expected
+        starts.clear()
+        assert _play(compiled, MemorySessionStore(), inputs) == expected
+        resumed += sum(1 for start in starts if start)
+        hops += len(starts)
+
+    # the checkpoint was used, not just stored
+    assert resumed > hops / 4
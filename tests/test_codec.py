@@ -0,0 +1,132 @@
+import json
+
+import pytest
+
+from anysd import (ConditionalFlow, FormFlow, JsonCodec, ListInput, MemorySessionStore, MsgpackCodec,
+                   NavigationController, NavigationMenu, decode_state, get_var, global_key, migrate_session,
+                   set_global_var, set_state_codec)
+from anysd import codec as _codec
+
+# long enough to be compressed
+ITEMS = [{'name': 'Alpha', 'code': 'a' * 300}, {'name': 'Beta', 'code': 'b' * 300}]
+
+
+@pytest.fixture(params=[JsonCodec, lambda: JsonCodec(compress_threshold=64), MsgpackCodec,
+                        lambda: MsgpackCodec(compress_threshold=64)])
+def codec(request):
+    saved = _codec._default_codec
+    set_state_codec(request.param())
+    yield _codec._default_codec
+    _codec._default_codec = saved
+
+
+def _menu(seen):
+    def validator(current_step, last_input, msisdn, session_id, **kwargs):
+        if current_step == 2:
+            seen['validator'] = json.loads(get_var(msisdn, session_id, 'BANK'))
+        return True, None
+
+    def confirm(msisdn, session_id, data, **kwargs):
+        seen['menu'] = data['BANK']
+        return f"CON Pay {json.loads(data['BANK'])['name']}?"
+
+    form = FormFlow({
+        '1': {'name': 'BANK', 'menu': ListInput(items=ITEMS, title='Bank', key='name')},
+        '2': {'name': 'CONFIRM', 'menu': confirm,
+              'post_call': lambda msisdn, session_id, ussd_string, data: seen.setdefault('post_call', data['BANK'])},
+        '3': {'menu': 'END Done'},
+    }, validator)
+    home = NavigationMenu(name='home', title='Home')
+    NavigationMenu(name='pay', title='Pay', parent=home, next_form=form)
+    return home
+
+
+def test_structured_answers_are_json_text_whatever_the_codec(store, codec):
+    seen = {}
+    home = _menu(seen)
+    for ussd_string in ('', '1', '1*2', '1*2*1'):
+        response = NavigationController(home, '254700', 's1', ussd_string, False, None).navigate()
+    assert response == 'END Done'
+
+    text = json.dumps(ITEMS[1], separators=(',', ':'))
+    assert seen == {'post_call': text, 'menu': text, 'validator': ITEMS[1]}
+    assert get_var('254700', 's1', 'BANK') == text
+    assert get_var('254700', 's1', 'BANK', decode=True) == ITEMS[1]
+    assert get_var('254700', 's1', 'BANK', raw=True) == codec.encode(ITEMS[1])
+
+
+
+def _route(**kwargs):
+    return 'buy'
+
+
+def _screen(home, store, ussd_string):
+    return NavigationController(home, '254700', 's1', ussd_string, False, None, store=store).navigate()
+
+
+def _round_trip(store, home, inputs, encoded):
+    """navigate `inputs`, then migrate the session to msgpack and back to JSON"""
+    key, globals_key, reference = '254700:s1', global_key('254700', 's1'), MemorySessionStore()
+    ussd_string = ''
+    for n, value in enumerate(inputs):
+        ussd_string = value if n <= 1 else f'{ussd_string}*{value}'
+        for _store in (store, reference):
+            _screen(home, _store, ussd_string)
+    before = store.get_all(key), store.get_all(globals_key)
+    assert set(encoded) <= set(before[0])
+
+    assert migrate_session('254700', 's1', codec=MsgpackCodec()) == len(encoded) + len(before[1])
+    session, stored_globals = store.get_all(key), store.get_all(globals_key)
+    assert {field for field, value in session.items() if value.startswith('~m')} == set(encoded)
+    assert all(value.startswith('~m') for value in stored_globals.values())
+    decoded = [{field: decode_state(value) if field in encoded else value for field, value in fields.items()}
+               for fields in (session, before[0])]
+    assert decoded[0] == decoded[1]
+
+    assert migrate_session('254700', 's1', codec=JsonCodec()) == len(encoded) + len(before[1])
+    assert (store.get_all(key), store.get_all(globals_key)) == before
+
+    # a migrated session goes on as if it had not been
+    migrate_session('254700', 's1', codec=MsgpackCodec())
+    next_hop = f'{ussd_string}*1'
+    assert _screen(home, store, next_hop) == _screen(home, reference, next_hop)
+    migrate_session('254700', 's1', codec=JsonCodec())
+    assert _comparable(store.get_all(key)) == _comparable(reference.get_all(key))
+    assert store.get_all(globals_key) == reference.get_all(globals_key)
+
+
+def _comparable(session):
+    # lists are cached with the time they were fetched at
+    return {field: {**decode_state(value), 'at': None} if field.startswith('USSD_LIST_ITEMS:') else value
+            for field, value in session.items()}
+
+
+def test_migrate_session_round_trip(store):
+    def validator(current_step, last_input, msisdn, session_id, **kwargs):
+        set_global_var(msisdn, session_id, key='TOTAL', value={'amount': int(last_input), 'currency': 'KES'})
+        return True, {'CART': {'items': [last_input], 'step': current_step}}
+
+    form = FormFlow({
+        '1': {'name': 'AMOUNT', 'menu': 'CON Enter amount'},
+        '2': {'name': 'CONFIRM', 'menu': 'CON Pay {AMOUNT}?\n1. Yes'},
+        '3': {'menu': 'END Paid {AMOUNT}'},
+    }, validator)
+    home = NavigationMenu(name='home', title='Home')
+    buy = NavigationMenu(name='buy', title='Buy', parent=home)
+    NavigationMenu(name='pay', title='Pay', parent=buy, next_form=form)
+    route = ConditionalFlow(_route, {'buy': home}, cache_results='session', cache_name='route')
+
+    _round_trip(store, route, ['', '1', '1', '50'], ['PROCESSED_PATH', 'USSD_CONDITION:route', 'CART'])
+
+
+def test_migrate_session_round_trip_with_list_input(store):
+    form = FormFlow({
+        '1': {'name': 'BANK', 'menu': ListInput(items=lambda **kwargs: ITEMS, title='Bank', key='name',
+                                                cache_in_session=True, page_size=1)},
+        '2': {'name': 'CONFIRM', 'menu': 'CON Pay?\n1. Yes'},
+        '3': {'menu': 'END Paid'},
+    }, lambda *args, **kwargs: (True, None))
+    home = NavigationMenu(name='home', title='Home')
+    NavigationMenu(name='pay', title='Pay', parent=home, next_form=form)
+
+    _round_trip(store, home, ['', '1', '99', '1'], ['PROCESSED_PATH', 'USSD_LIST_ITEMS:BANK', 'BANK'])
@@ -0,0 +1,83 @@
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from anysd import (FormFlow, ListInput, MemorySessionStore, NavigationController, NavigationMenu, compile_menu,
+                   get_var, global_key, set_global_var, set_var, settings)
+
+
+def _items(msisdn, **kwargs):
+    # per subscriber, so a list read in another session's hop shows
+    return [f'{msisdn} option {n}' for n in range(1, 4)]
+
+
+def _validator(current_step, last_input, msisdn, session_id, **kwargs):
+    # reads and writes go through the hop's buffered session: they must not land in another session's
+    seen = get_var(msisdn, session_id, 'SEEN') or ''
+    set_var(msisdn, session_id, {'SEEN': f'{seen}{last_input}.'})
+    set_global_var(msisdn, session_id, key='LAST', value=last_input)
+    time.sleep(0)
+    if current_step == 3:
+        return last_input in ('1', '0'), None
+    return True, None
+
+
+def _post(msisdn, session_id, ussd_string, data):
+    set_var(msisdn, session_id, {'POSTED': f"{data.get('RECEIVER')}:{data.get('AMOUNT')}"})
+
+
+def _menu():
+    form = FormFlow({
+        '1': {'name': 'RECEIVER', 'menu': ListInput(items=_items, title='Select option')},
+        '2': {'name': 'AMOUNT', 'menu': 'Enter amount'},
+        '3': {'name': 'CONFIRM', 'menu': 'Buy {AMOUNT}\n1. Confirm\n0. Cancel', 'post_call': _post},
+        '4': {'name': 'DONE', 'menu': 'END Done {AMOUNT}'},
+    }, step_validator=_validator)
+    home = NavigationMenu(name='home', title='Home')
+    NavigationMenu(name='buy', title='Buy', parent=home, next_form=form)
+    more = NavigationMenu(name='more', title='More', parent=home)
+    NavigationMenu(name='one', title='One', parent=more, next_form=form)
+    NavigationMenu(name='two', title='Two', parent=more, next_form=form)
+    return home
+
+
+def _sessions(count, seed=6):
+    rng = random.Random(seed)
+    # numbers only: answers to text steps are read as numbers
+    tokens = ['1', '2', '3', '1', '2', '10', settings.back_symbol, settings.home_symbol]
+    return [(f'2547{n % 40:04d}', f'session-{n}', [rng.choice(tokens) for _ in range(rng.randint(1, 12))])
+            for n in range(count)]
+
+
+def _play(home, store, session):
+    msisdn, session_id, inputs = session
+    screens, ussd_string = [], ''
+    for n, key in enumerate([''] + inputs):
+        ussd_string = key if n <= 1 else f'{ussd_string}*{key}'
+        try:
+            screens.append(NavigationController(home, msisdn, session_id, ussd_string, False, None,
+                                                store=store).navigate())
+        except Exception as e:
+            screens.append(type(e).__name__)
+    return screens
+
+
+def _state(store, sessions):
+    return {session_id: (store.get_all(f'{msisdn}:{session_id}'), store.get_all(global_key(msisdn, session_id)))
+            for msisdn, session_id, _ in sessions}
+
+
+def test_concurrent_sessions_match_a_sequential_run():
+    tree = _menu()
+    sessions = _sessions(400)
+
+    for home in (tree, compile_menu(tree)):
+        sequential = MemorySessionStore()
+        expected = [_play(home, sequential, session) for session in sessions]
+
+        concurrent = MemorySessionStore()
+        with ThreadPoolExecutor(max_workers=32) as pool:
+            screens = list(pool.map(lambda session: _play(home, concurrent, session), sessions))
+
+        assert screens == expected
+        assert _state(concurrent, sessions) == _state(sequential, sessions)
@@ -0,0 +1,49 @@
+import functools
+
+import pytest
+
+from anysd import ConditionalFlow, FormFlow, ImproperlyConfigured, NavigationController, NavigationMenu, compile_menu
+
+
+def _leaf(name):
+    menu = NavigationMenu(name=name, title=name.upper())
+    NavigationMenu(name=f'{name}_end', title='End', parent=menu,
+                   next_form=FormFlow({'1': {'name': 'Z', 'menu': f'END {name}'}}, lambda *args, **kwargs: (True, None)))
+    return menu
+
+
+def _screen(home, ussd_string, session_id='s1', store=None):
+    return NavigationController(home, '254700', session_id, ussd_string, False, None, store=store).navigate()
+
+
+def test_lambda_conditions_need_a_cache_name():
+    with pytest.raises(ImproperlyConfigured):
+        ConditionalFlow(lambda **kwargs: 'yes', {'yes': _leaf('yes')}, cache_results='session')
+    with pytest.raises(ImproperlyConfigured):
+        ConditionalFlow(functools.partial(dict), {'yes': _leaf('yes')}, cache_results='global')
+
+    # nothing is cached, so nothing needs a name
+    ConditionalFlow(lambda **kwargs: 'yes', {'yes': _leaf('yes')})
+
+
+def _nested(first_name, second_name):
+    # the outer conditional leads to the inner one, and both see the same session
+    inner = ConditionalFlow(lambda **kwargs: 'no', {'yes': _leaf('yes'), 'no': _leaf('no')},
+                            cache_results='session', cache_name=second_name)
+    return ConditionalFlow(lambda **kwargs: 'yes', {'yes': inner, 'no': _leaf('other')},
+                           cache_results='session', cache_name=first_name)
+
+
+def test_lambda_conditions_on_one_path_keep_their_own_result(store):
+    home = _nested('outer', 'inner')
+
+    for menu in (home, compile_menu(home)):
+        store.clear()
+        assert _screen(menu, '').startswith('CON NO')
+        # the second hop reads the results cached by the first one
+        assert _screen(menu, '1') == 'END no'
+
+
+def test_compile_menu_rejects_duplicate_cache_names():
+    with pytest.raises(ImproperlyConfigured):
+        compile_menu(_nested('same', 'same'))
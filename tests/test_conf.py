@@ -0,0 +1,67 @@
+import pytest
+
+from anysd import (JsonCodec, MemorySessionStore, get_session_store, get_state_codec, set_session_store,
+                   set_state_codec, setup)
+from anysd.conf import DEFAULT_BLOCKING_MAX_CONNECTIONS, Settings
+
+
+@pytest.fixture
+def config_file(tmp_path):
+    def write(text):
+        path = tmp_path / 'config.yaml'
+        path.write_text(text)
+        return str(path)
+    return write
+
+
+def test_pool_timeout_without_max_connections_is_bounded(config_file):
+    settings = Settings(config_file('development:\n  redis:\n    pool_timeout: 2\n'))
+
+    assert 'max_connections' not in settings.pool_kwargs
+    assert settings.connection_pool.max_connections == DEFAULT_BLOCKING_MAX_CONNECTIONS
+    assert settings.async_redis.connection_pool.max_connections == DEFAULT_BLOCKING_MAX_CONNECTIONS
+
+
+def test_connection_details_under_connection(config_file):
+    settings = Settings(config_file('development:\n  redis:\n    connection:\n      host: cache\n'
+                                    '      max_connections: 7\n'))
+
+    assert settings.redis_connection == {'host': 'cache', 'max_connections': 7}
+    assert settings.connection_pool.max_connections == 7
+    assert settings.connection_pool.connection_kwargs['host'] == 'cache'
+
+
+@pytest.fixture
+def fresh_settings():
+    from anysd import codec, store
+
+    saved = codec._default_codec, store._default_store
+    codec._default_codec = store._default_store = None
+    yield
+    codec._default_codec, store._default_store = saved
+    setup(log_level=None)
+
+
+def test_setup_rebuilds_the_default_store_and_codec(config_file, tmp_path, fresh_settings):
+    first = config_file('development:\n  redis:\n    host: first\n')
+    second = tmp_path / 'second.yaml'
+    second.write_text('development:\n  redis:\n    host: second\n  session:\n    compress_threshold: 512\n')
+
+    setup(first, log_level=None)
+    assert get_session_store().conn.connection_pool.connection_kwargs['host'] == 'first'
+    assert get_state_codec().compress_threshold is None
+
+    setup(str(second), log_level=None)
+    assert get_session_store().conn.connection_pool.connection_kwargs['host'] == 'second'
+    assert get_state_codec().compress_threshold == 512
+
+
+def test_setup_keeps_a_store_and_codec_set_explicitly(config_file, fresh_settings):
+    store, codec = MemorySessionStore(), JsonCodec(compress_threshold=64)
+    set_session_store(store)
+    set_state_codec(codec)
+
+    setup(config_file('development:\n  redis:\n    host: other\n'), log_level=None)
+
+    assert get_session_store() is store
+    assert get_state_codec() is codec
@@ -0,0 +1,49 @@
+import pickle
+
+import pytest
+
+from anysd import FormFlow, NavigationController, NavigationMenu
+
+
+def _valid(*args, **kwargs):
+    return True, None
+
+
+def _screens(home, *inputs, session_id='s1'):
+    screens, ussd_string = [], ''
+    for n, key in enumerate(('',) + inputs):
+        ussd_string = key if n <= 1 else f'{ussd_string}*{key}'
+        screens.append(NavigationController(home, '254700', session_id, ussd_string, False, None).navigate())
+    return screens
+
+
+def test_steps_without_a_name(store):
+    posted = []
+    form = FormFlow({
+        '1': {'name': 'AMOUNT', 'menu': 'CON Enter amount',
+              'post_call': lambda msisdn, session_id, ussd_string, data: posted.append(data)},
+        '2': {'menu': 'END bye'},
+    }, _valid)
+    assert form.form_keys == ('AMOUNT',)
+
+    home = NavigationMenu(name='home', title='Home')
+    NavigationMenu(name='pay', title='Pay', parent=home, next_form=form)
+    assert _screens(home, '1', '50') == ['CON Home:\n1. Pay', 'CON Enter amount', 'END bye']
+    assert posted == [{'AMOUNT': '50'}]
+
+
+def test_questions_are_changed_by_replacing_them(store):
+    form = FormFlow({'1': {'name': 'AMOUNT', 'menu': 'CON Enter amount'}, '2': {'menu': 'END bye'}}, _valid)
+    # the steps are compiled from the questions: changes in place would be ignored, so they fail
+    with pytest.raises(TypeError):
+        form.form_questions['2'] = {'name': 'PIN', 'menu': 'CON Enter PIN'}
+    with pytest.raises(TypeError):
+        form.form_questions['2']['menu'] = 'END see you'
+
+    questions = dict(form.form_questions)
+    questions['2'] = {'name': 'PIN', 'menu': 'CON Enter PIN'}
+    questions['3'] = {'menu': 'END bye'}
+    form.form_questions = questions
+    home = NavigationMenu(name='home', title='Home')
+    NavigationMenu(name='pay', title='Pay', parent=home, next_form=pickle.loads(pickle.dumps(form)))
+    assert _screens(home, '1', '50', '1234') == ['CON Home:\n1. Pay', 'CON Enter amount', 'CON Enter PIN', 'END bye']
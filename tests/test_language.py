@@ -0,0 +1,35 @@
+from anysd import FormFlow, NavigationController, NavigationMenu, get_var, language_key
+
+
+def test_language_is_kept_until_extra_data_clears_it(store):
+    calls = []
+
+    def translation(msisdn, session_id, ussd_string):
+        calls.append(ussd_string)
+        return 'sw' if len(calls) > 1 else 'en'
+
+    def validator(current_step, last_input, **kwargs):
+        # answering the language question makes the next hop ask translation_fxn again
+        return True, {language_key: None} if current_step == 1 else None
+
+    form = FormFlow({
+        '1': {'name': 'LANGUAGE', 'menu': {'en': 'CON Language?\n1. Swahili', 'sw': 'CON Lugha?\n1. Kiswahili'}},
+        '2': {'name': 'AMOUNT', 'menu': {'en': 'CON Amount', 'sw': 'CON Kiasi'}},
+        '3': {'menu': {'en': 'END Done', 'sw': 'END Imekamilika'}},
+    }, validator)
+    home = NavigationMenu(name='home', title={'en': 'Home', 'sw': 'Nyumbani'})
+    NavigationMenu(name='settings', title={'en': 'Settings', 'sw': 'Mipangilio'}, parent=home, next_form=form)
+
+    def hop(ussd_string):
+        return NavigationController(home, '254700', 's1', ussd_string, True, translation).navigate()
+
+    assert hop('') == 'CON Home\n1. Settings'
+    assert hop('1') == 'CON Language?\n1. Swahili'
+    # reused from the session
+    assert calls == ['']
+    assert get_var('254700', 's1', language_key) == 'en'
+
+    assert hop('1*1') == 'CON Amount'
+    assert get_var('254700', 's1', language_key) is None
+    assert hop('1*1*50') == 'END Imekamilika'
+    assert calls == ['', '1*1*50']
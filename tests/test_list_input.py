@@ -0,0 +1,46 @@
+import pytest
+
+from anysd import ImproperlyConfigured, ParseError, build_menu, settings
+from anysd.main import ListInput
+
+ITEMS = [f'item {n}' for n in range(1, 200)]
+
+
+@pytest.mark.parametrize('page_size', [98, 99, 150])
+def test_page_keys_cannot_be_item_numbers(page_size):
+    with pytest.raises(ImproperlyConfigured):
+        ListInput(ITEMS, 'Pick one', page_size=page_size)
+
+
+def test_page_keys_outside_the_page():
+    ListInput(ITEMS, 'Pick one', page_size=97)
+    ListInput(ITEMS, 'Pick one', page_size=150, next_symbol='#', previous_symbol='*')
+    ListInput(ITEMS, 'Pick one', page_size=5, next_symbol='7', previous_symbol='*')
+
+
+@pytest.mark.parametrize('symbol', ['back_symbol', 'home_symbol'])
+def test_page_keys_cannot_be_navigation_symbols(store, symbol):
+    # back and home are handled before page keys: such a key would go back instead of turning the page
+    pick = ListInput(ITEMS, 'Pick one', page_size=5, next_symbol=getattr(settings, symbol), previous_symbol='*',
+                     cache_key='PICK')
+    with pytest.raises(ImproperlyConfigured, match='back or home'):
+        pick.get_items(None, msisdn='254700', session_id='s1')
+
+
+def test_page_keys_should_differ():
+    with pytest.raises(ImproperlyConfigured):
+        ListInput(ITEMS, 'Pick one', page_size=5, next_symbol='#', previous_symbol='#')
+
+
+@pytest.mark.parametrize('next_symbol', ['3', 'home_symbol'])
+def test_loader_reports_page_keys_it_cannot_tell_apart(next_symbol):
+    next_symbol = getattr(settings, next_symbol, next_symbol)
+    spec = {
+        'menu': {'name': 'home', 'title': 'Home', 'children': [{'name': 'pick', 'title': 'Pick', 'form': 'pick'}]},
+        'forms': {'pick': {'validator': 'os.path.join', 'questions': [
+            {'name': 'ITEM', 'menu': {'list': {
+                'items': ['a', 'b'], 'title': 'Pick one', 'page_size': 5, 'next_symbol': next_symbol}}},
+        ]}},
+    }
+    with pytest.raises(ParseError, match='page_size'):
+        build_menu(spec)
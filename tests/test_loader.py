@@ -0,0 +1,62 @@
+import os
+import stat
+
+import pytest
+
+from anysd import CompiledMenu, ParseError, build_menu, load_menu
+
+SPEC = {
+    'menu': {'name': 'home', 'title': 'Home', 'children': [{'name': 'pay', 'title': 'Pay', 'form': 'pay'}]},
+    'forms': {'pay': {'validator': 'os.path.join', 'questions': [{'name': 'AMOUNT', 'menu': 'END Enter amount'}]}},
+}
+
+
+def _pickles(path):
+    return [name for name in os.listdir(path) if name.endswith('.pickle')]
+
+
+def test_cache_dir_is_created_private(tmp_path):
+    cache_dir = tmp_path / 'cache'
+
+    assert isinstance(load_menu(SPEC, cache_dir=str(cache_dir)), CompiledMenu)
+    assert stat.S_IMODE(os.stat(cache_dir).st_mode) == 0o700
+    assert len(_pickles(cache_dir)) == 1
+    # the next load reads the same pickle
+    assert isinstance(load_menu(SPEC, cache_dir=str(cache_dir)), CompiledMenu)
+    assert len(_pickles(cache_dir)) == 1
+
+
+def test_writable_cache_dir_is_not_used(tmp_path):
+    cache_dir = tmp_path / 'shared'
+    cache_dir.mkdir()
+    os.chmod(cache_dir, 0o777)
+
+    assert isinstance(load_menu(SPEC, cache_dir=str(cache_dir)), CompiledMenu)
+    assert _pickles(cache_dir) == []
+
+
+def test_cache_is_keyed_on_the_anysd_version(tmp_path, monkeypatch):
+    from anysd import loader
+
+    load_menu(SPEC, cache_dir=str(tmp_path))
+    monkeypatch.setattr(loader, '__version__', '0.0.0')
+    load_menu(SPEC, cache_dir=str(tmp_path))
+
+    assert len(_pickles(tmp_path)) == 2
+
+
+class _Route:
+    def __call__(self, **kwargs):
+        return 'pay'
+
+
+# a callable instance: its class name would be shared by every instance
+route = _Route()
+
+
+def test_cached_condition_without_a_name_of_its_own_needs_a_cache_name():
+    condition = {'function': f'{__name__}.route', 'cache_results': 'session', 'branches': {'pay': SPEC['menu']}}
+
+    with pytest.raises(ParseError, match='cache_name'):
+        build_menu({'menu': {'condition': condition}, 'forms': SPEC['forms']})
+    assert build_menu({'menu': {'condition': {**condition, 'cache_name': 'route'}}, 'forms': SPEC['forms']})
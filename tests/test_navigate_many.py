@@ -0,0 +1,49 @@
+from anysd import FormFlow, MemorySessionStore, NavigationController, NavigationMenu, NavigationRequest, navigate_many
+
+
+class Boom(Exception):
+    pass
+
+
+def _validator(current_step, last_input, msisdn, session_id, **kwargs):
+    if last_input == '13':
+        raise Boom(msisdn)
+    return True, None
+
+
+def _menu():
+    form = FormFlow({
+        '1': {'name': 'AMOUNT', 'menu': 'CON Amount'},
+        '2': {'name': 'CONFIRM', 'menu': 'CON Send {AMOUNT}?\n1. Yes'},
+        '3': {'menu': 'END Sent {AMOUNT}'},
+    }, _validator)
+    home = NavigationMenu(name='home', title='Home')
+    NavigationMenu(name='send', title='Send', parent=home, next_form=form)
+    return home
+
+
+def test_a_failing_hop_does_not_affect_the_others():
+    home, store, reference = _menu(), MemorySessionStore(), MemorySessionStore()
+    requests = [
+        ('254700001', 'a', ''), ('254700002', 'b', ''), ('254700003', 'c', ''),
+        ('254700001', 'a', '1'), ('254700002', 'b', '1'), ('254700003', 'c', '1'),
+        ('254700001', 'a', '1*20'), ('254700002', 'b', '1*13'), ('254700003', 'c', '1*30'),
+        ('254700001', 'a', '1*20*1'), ('254700003', 'c', '1*30*1'),
+    ]
+
+    results = navigate_many(home, requests, store=store)
+
+    assert [result.request for result in results] == [NavigationRequest(*request) for request in requests]
+    failed = results[7]
+    assert failed.response is None and isinstance(failed.error, Boom)
+    assert [result.error for n, result in enumerate(results) if n != 7] == [None] * 10
+    # everything else is what resolving each hop on its own gives
+    for n, request in enumerate(requests):
+        if n != 7:
+            assert results[n].response == NavigationController(home, *request, False, None,
+                                                               store=reference).navigate()
+    assert results[9].response == 'END Sent 20' and results[10].response == 'END Sent 30'
+    # the failed hop left its session as it was, the others were saved
+    for key in ('254700001:a', '254700002:b', '254700003:c'):
+        assert store.get_all(key) == reference.get_all(key)
+    assert 'AMOUNT' not in store.get_all('254700002:b')
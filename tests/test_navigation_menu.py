@@ -0,0 +1,36 @@
+from anytree import Node
+
+from anysd import NavigationMenu
+
+
+def test_position_and_root_path_under_plain_nodes():
+    root = Node('root')
+    Node('first', parent=root)
+    group = Node('group', parent=root)
+    home = NavigationMenu(name='home', title='Home', parent=group)
+    other = NavigationMenu(name='other', title='Other', parent=home)
+    pay = NavigationMenu(name='pay', title='Pay', parent=home)
+    deep = NavigationMenu(name='deep', title='Deep', parent=Node('plain', parent=pay))
+
+    assert (home.position, pay.position, deep.position) == (1, 2, 1)
+    assert home.root_path == (2, 1)
+    assert pay.root_path == (2, 1, 2)
+    assert deep.root_path == (2, 1, 2, 1, 1)
+
+    # plain nodes do not report moves, so paths through them are never stale
+    group.parent = None
+    assert pay.root_path == (1, 2)
+    other.parent = None
+    assert pay.root_path == (1, 1)
+    assert deep.root_path == (1, 1, 1, 1)
+
+
+def test_root_path_of_a_menu_tree_is_kept_until_it_changes():
+    home = NavigationMenu(name='home', title='Home')
+    NavigationMenu(name='other', title='Other', parent=home)
+    pay = NavigationMenu(name='pay', title='Pay', parent=home)
+
+    assert pay.root_path == (2,)
+    assert pay._root_path is not None
+    home.children[0].parent = None
+    assert pay.root_path == (1,)
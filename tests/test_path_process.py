@@ -0,0 +1,81 @@
+import random
+
+import pytest
+
+from anysd import MemorySessionStore, NavigationController, NavigationMenu, settings
+
+
+def reference_path_process(path, index=1):
+    """the recursive reducer `_path_process` replaced, kept to check the new one against"""
+    back, home = settings.back_symbol, settings.home_symbol
+
+    if path and path[0] in [back, home]:
+        return []
+
+    if len(path) == 1:
+        return path
+
+    if index + 1 > len(path):
+        return path
+
+    if path[index] == back:
+        path.pop(index)
+        path.pop(index - 1)
+
+        if len(path) > index - 1:
+            return reference_path_process(path, index - 1)
+
+    elif path[index] == home:
+        for i in range(index + 1):
+            path.pop(0)
+
+        if len(path) > 1:
+            return reference_path_process(path, index=1)
+    else:
+        return reference_path_process(path, index + 1)
+
+    return path
+
+
+def reference_path_processor(path, index=1, offset=None):
+    if offset is None:
+        offset = 0
+    processed_path = reference_path_process(path, index)
+    if len(processed_path) >= offset:
+        return processed_path[offset:]
+    return processed_path
+
+
+def _outcome(fxn, *args):
+    try:
+        return fxn(*args)
+    except Exception as e:
+        return type(e)
+
+
+@pytest.fixture(scope='module')
+def controller():
+    home = NavigationMenu(name='home', title='Home')
+    return NavigationController(home, '254700', 'path', '', False, None, store=MemorySessionStore())
+
+
+def test_path_process_matches_the_recursive_reducer(controller):
+    rng = random.Random(12)
+    tokens = ['1', '2', '3', '11', settings.back_symbol, settings.home_symbol]
+
+    for _ in range(20_000):
+        # mostly choices, with back and home symbols anywhere, including first
+        path = [rng.choice(tokens) if rng.random() < 0.4 else rng.choice(tokens[:4])
+                for _ in range(rng.randint(0, 25))]
+        index = rng.randint(0, len(path) + 1)
+        offset = rng.choice([None, 0, 1, 2, rng.randint(0, 30)])
+
+        expected = _outcome(reference_path_processor, list(path), index, offset)
+        assert _outcome(controller.path_processor, list(path), index, offset) == expected, (path, index, offset)
+
+
+def test_path_process_is_not_recursive(controller):
+    # deeper than the recursion limit of the reducer it replaced
+    path = ['1', settings.back_symbol] * 5_000 + ['2']
+
+    assert controller.path_processor(path) == ['2']
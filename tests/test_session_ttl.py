@@ -0,0 +1,53 @@
+import pytest
+
+from anysd import FormFlow, MemorySessionStore, NavigationController, NavigationMenu, global_key, set_global_var, settings
+
+
+def _validator(current_step, last_input, msisdn, session_id, **kwargs):
+    set_global_var(msisdn, session_id, key='LAST', value=last_input)
+    return True, None
+
+
+@pytest.fixture
+def ttl(monkeypatch):
+    monkeypatch.setattr(settings, 'session_ttl', 300)
+    monkeypatch.setattr(settings, 'completed_session_ttl', 30)
+
+
+def test_ttl_is_refreshed_on_every_hop_and_shortened_on_end(ttl):
+    form = FormFlow({'1': {'name': 'AMOUNT', 'menu': 'CON Amount'}, '2': {'menu': 'END Sent {AMOUNT}'}}, _validator)
+    home = NavigationMenu(name='home', title='Home')
+    NavigationMenu(name='send', title='Send', parent=home, next_form=form)
+    now = [0]
+    store = MemorySessionStore(clock=lambda: now[0])
+    keys = '254700:s1', global_key('254700', 's1')
+
+    def hop(at, ussd_string):
+        now[0] = at
+        return NavigationController(home, '254700', 's1', ussd_string, False, None, store=store).navigate()
+
+    def alive(at):
+        now[0] = at
+        return [bool(store.get_all(key)) for key in keys]
+
+    hop(0, '')
+    assert hop(200, '1') == 'CON Amount'
+    # 300 seconds from the last hop, not the first
+    assert alive(499) == [True, True]
+    assert hop(450, '1*50') == 'END Sent 50'
+    # the session ended: kept for the completed ttl only
+    assert alive(479) == [True, True]
+    assert alive(481) == [False, False]
+
+
+def test_session_expires_after_the_ttl_without_hops(ttl):
+    home = NavigationMenu(name='home', title='Home')
+    NavigationMenu(name='send', title='Send', parent=home)
+    now = [0]
+    store = MemorySessionStore(clock=lambda: now[0])
+
+    NavigationController(home, '254700', 's1', '', False, None, store=store).navigate()
+    now[0] = 299
+    assert store.get_all('254700:s1')
+    now[0] = 301
+    assert store.get_all('254700:s1') == {}